@@ -1,5 +1,6 @@
 import os
 import webbrowser
+import multiprocessing
 from flask import Flask, session, redirect, url_for, request, render_template_string
 from datetime import timedelta
 
@@ -44,6 +45,8 @@ def create_app():
     import facturation
     import statistique
     import developpeur
+    import events
+    import jobs
     import routes # Importe le module contenant la fonction register_routes
     import activation # Importe le module activation pour accéder à son blueprint
 
@@ -56,6 +59,8 @@ def create_app():
     app.register_blueprint(rdv.rdv_bp, url_prefix="/rdv")
     app.register_blueprint(facturation.facturation_bp)
     app.register_blueprint(statistique.statistique_bp, url_prefix="/statistique")
+    app.register_blueprint(events.events_bp)
+    app.register_blueprint(jobs.jobs_bp)
     # Enregistrer le blueprint d'activation après les autres blueprints
     app.register_blueprint(activation.activation_bp) # Déplacé ici
 
@@ -76,6 +81,8 @@ def create_app():
         # L'e-mail de l'administrateur DOIT être correctement défini dans session['admin_email']
         # lors du processus de connexion (dans votre blueprint 'login').
         admin_email = session.get('admin_email', 'default_admin@example.com')
+        # Sondages légers (file d'attente, événements) : pas de rechargement des données patient
+        LIGHT_ENDPOINTS = {"rdv.queue_today", "events.stream"}
 
         # Ligne de débogage : Affiche l'e-mail utilisé pour les chemins de données
         print(f"DEBUG: L'application utilise le répertoire de données pour : {admin_email}")
@@ -84,7 +91,9 @@ def create_app():
         # Réinitialiser les utilitaires avec l'instance de l'application après que le chemin dynamique soit défini
         utils.init_app(app)
         # Charger les données du patient, ceci utilise maintenant les chemins définis dynamiquement
-        utils.load_patient_data()
+        # (sauf pour les sondages légers, qui n'en ont pas besoin)
+        if request.endpoint not in LIGHT_ENDPOINTS:
+            utils.load_patient_data()
 
         # Définir les points d'accès autorisés (devraient idéalement être gérés de manière plus évolutive si nombreux)
         # Par simplicité, listés ici.
@@ -127,7 +136,8 @@ def create_app():
                         # Tenter de construire l'URL ; ignorer si elle nécessite des arguments non fournis
                         # ou si c'est une route dynamique non destinée à la mise en cache générale.
                         url = url_for(rule.endpoint)
-                        offline_urls.append(url)
+                        if not pwa.network_only(url):  # données en direct : jamais en cache
+                            offline_urls.append(url)
                     except Exception as e:
                         # print(f"Ignorer l'URL pour le cache hors ligne PWA ({rule.endpoint}) : {e}")
                         pass # Ignorer les règles qui ne peuvent pas être construites sans paramètres
@@ -170,6 +180,7 @@ app = create_app()
 
 # ───────────── 12. Lancement pour le développement local
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # pool de facturation groupée dans l'exécutable Windows
     try:
         # Ouvrir dans le navigateur web seulement si pas dans un environnement conteneurisé (comme replit)
         # Ceci est une heuristique ; le déploiement réel pourrait différer.
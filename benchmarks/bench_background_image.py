@@ -0,0 +1,88 @@
+# bench_background_image.py
+
+"""
+Coût du fond image dans les PDF reportlab (ms / document, taille, images intégrées)
+• ancien chemin : drawImage(fichier) à chaque page, image pleine résolution décodée
+  puis recompressée pour chaque document
+• nouveau chemin : utils.apply_background (fond réduit à BACKGROUND_DPI et encodé
+  en JPEG une fois, intégré tel quel et partagé par toutes les pages)
+Fond photo A5 à 600 dpi (PNG) ; documents de 1 et 6 pages.
+Usage : python benchmarks/bench_background_image.py [nombre de documents]   (défaut : 10)
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+def make_background(path: str):
+    """Papier à en-tête « photo » : dégradés et motifs, 3496 x 4960 px."""
+    img = Image.new("RGB", (3496, 4960), "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, 4960, 4):
+        draw.line([(0, i), (3496, (i * 7) % 4960)], fill=(150 + i % 100, 200 - i % 60, 240 - i % 90), width=3)
+    draw.rectangle([0, 0, 3496, 520], fill=(30, 90, 160))
+    img.save(path)
+
+def legacy_background(c, width, height):
+    c.drawImage(utils.background_file, 0, 0, width=width, height=height)
+
+def make_document(draw_background, pages: int) -> bytes:
+    buf = io.BytesIO()
+    width, height = A5
+    c = canvas.Canvas(buf, pagesize=A5)
+    for p in range(pages):
+        draw_background(c, width, height)
+        c.setFont("Helvetica", 11)
+        for line in range(20):
+            c.drawString(50, 500 - line * 18, f"Page {p + 1} - ligne {line + 1}")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+def image_objects(pdf: bytes) -> int:
+    reader = PdfReader(io.BytesIO(pdf))
+    refs = set()
+    for page in reader.pages:
+        for ref in page['/Resources'].get('/XObject', {}).values():
+            refs.add(ref.idnum)
+    return len(refs)
+
+def ms_per_document(draw_background, pages: int, count: int) -> float:
+    make_document(draw_background, pages)  # échauffement (et réduction du fond pour le nouveau chemin)
+    t0 = time.perf_counter()
+    for _ in range(count):
+        make_document(draw_background, pages)
+    return (time.perf_counter() - t0) * 1000 / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        bg = os.path.join(tmp, "fond.png")
+        make_background(bg)
+        utils.background_file = bg
+        print(f"{'pages':>5} | {'ancien ms/doc':>13} | {'cache ms/doc':>12} | {'gain':>6} | "
+              f"{'ancien Ko':>9} | {'cache Ko':>8} | images (ancien/cache)")
+        for pages in (1, 6):
+            old = ms_per_document(legacy_background, pages, count)
+            new = ms_per_document(utils.apply_background, pages, count)
+            old_pdf = make_document(legacy_background, pages)
+            new_pdf = make_document(utils.apply_background, pages)
+            print(f"{pages:>5} | {old:>13.1f} | {new:>12.1f} | {old / new:>5.1f}x | "
+                  f"{len(old_pdf) // 1024:>9} | {len(new_pdf) // 1024:>8} | "
+                  f"{image_objects(old_pdf)}/{image_objects(new_pdf)}")
+
+if __name__ == "__main__":
+    main()
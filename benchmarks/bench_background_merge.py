@@ -0,0 +1,104 @@
+# bench_background_merge.py
+
+"""
+Temps de fusion avec le fond PDF, par page (ms / page)
+• ancien chemin : PdfReader sur le fond à chaque document, copie profonde de la
+  page de fond puis merge_page pour chaque page
+• nouveau chemin : utils.merge_background_pdf_bytes (fond analysé une fois, posé
+  sous forme de Form XObject mis en cache)
+Fond vectoriel chargé (en-tête, filets, filigrane) ; documents de 1, 4 et 16 pages.
+Usage : python benchmarks/bench_background_merge.py [nombre de documents]   (défaut : 50)
+"""
+
+import copy
+import io
+import os
+import sys
+import time
+import tempfile
+
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+def make_background(path: str):
+    """Papier à en-tête vectoriel : texte, ~1500 segments et courbes."""
+    c = canvas.Canvas(path, pagesize=A5)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, 560, "Cabinet médical - en-tête")
+    for i in range(1200):
+        c.line(10 + i % 400, 10 + (i * 7) % 580, 20 + (i * 13) % 400, 15 + (i * 3) % 580)
+    for i in range(300):
+        c.bezier(20, 20 + i, 120, 200 + i, 300, 10 + i, 400, 300 - i)
+    c.setFont("Helvetica", 9)
+    c.drawString(40, 30, "Adresse, téléphone, ICE")
+    c.save()
+
+def make_document(pages: int) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A5)
+    for p in range(pages):
+        c.setFont("Helvetica", 11)
+        for line in range(25):
+            c.drawString(50, 500 - line * 18, f"Page {p + 1} - ligne {line + 1} : posologie 1 cp matin et soir")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+def legacy_merge(foreground: bytes) -> bytes:
+    bg_reader = PdfReader(utils.background_file)
+    fg_reader = PdfReader(io.BytesIO(foreground))
+    writer = PdfWriter()
+    for i in range(len(fg_reader.pages)):
+        bg_page = copy.deepcopy(bg_reader.pages[i] if i < len(bg_reader.pages) else bg_reader.pages[-1])
+        bg_page.merge_page(fg_reader.pages[i])
+        writer.add_page(bg_page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+def ms_per_page(fn, document: bytes, pages: int, count: int) -> float:
+    fn(document)  # échauffement (et mise en cache du fond pour le nouveau chemin)
+    t0 = time.perf_counter()
+    for _ in range(count):
+        fn(document)
+    return (time.perf_counter() - t0) * 1000 / (count * pages)
+
+def same_rendering(a: bytes, b: bytes) -> str:
+    """Compare les deux rendus pixel à pixel si PyMuPDF est installé."""
+    try:
+        import fitz
+    except ImportError:
+        return "n/a"
+    docs = [fitz.open(stream=x, filetype="pdf") for x in (a, b)]
+    if len(docs[0]) != len(docs[1]):
+        return "non (nombre de pages)"
+    for pa, pb in zip(docs[0], docs[1]):
+        pix = [pa.get_pixmap(dpi=72).samples, pb.get_pixmap(dpi=72).samples]
+        diff = sum(1 for p, q in zip(pix[0], pix[1]) if abs(p - q) > 8)
+        if diff > len(pix[0]) // 1000:
+            return f"non ({diff} octets)"
+    return "oui"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        bg = os.path.join(tmp, "fond.pdf")
+        make_background(bg)
+        utils.background_file = bg
+        print(f"{'pages':>5} | {'ancien ms/page':>14} | {'cache ms/page':>13} | {'gain':>6} | rendu identique")
+        for pages in (1, 4, 16):
+            document = make_document(pages)
+            old = ms_per_page(legacy_merge, document, pages, count)
+            new = ms_per_page(utils.merge_background_pdf_bytes, document, pages, count)
+            check = same_rendering(legacy_merge(document), utils.merge_background_pdf_bytes(document))
+            print(f"{pages:>5} | {old:>14.2f} | {new:>13.2f} | {old / new:>5.1f}x | {check}")
+
+if __name__ == "__main__":
+    main()
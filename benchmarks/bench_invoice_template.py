@@ -0,0 +1,110 @@
+# bench_invoice_template.py
+
+"""
+Débit de génération des factures PDF (factures / seconde)
+• ancien chemin : fond image décodé par fpdf à chaque facture, puis
+  utils.merge_with_background_pdf (fond PDF en cache, voir bench_background_merge.py)
+• nouveau chemin : gabarit invoice_template (couche statique rendue une fois),
+  seul le contenu variable est dessiné
+Trois fonds : image seule, PDF seul, image + PDF.
+Usage : python benchmarks/bench_invoice_template.py [nombre de factures]   (défaut : 200)
+"""
+
+import os
+import sys
+import time
+import tempfile
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils             # noqa: E402
+import invoice_template  # noqa: E402
+from facturation import PDFInvoice  # noqa: E402
+
+SERVICES = [{'name': f"Acte {i} - consultation de contrôle", 'price': 15000 + 100 * i} for i in range(4)]  # centimes
+
+
+def make_backgrounds(tmp: str) -> tuple:
+    """Fond image A5 à 300 dpi (en-tête, pied, filigrane) et fond PDF vectoriel."""
+    img = Image.new("RGB", (1748, 2480), "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, 2480, 6):
+        draw.line([(0, i), (1748, (i * 7) % 2480)], fill=(200 + i % 50, 220, 240 - i % 40), width=2)
+    draw.rectangle([0, 0, 1748, 260], fill=(30, 90, 160))
+    png = os.path.join(tmp, "fond.png")
+    img.save(png)
+
+    pdf = os.path.join(tmp, "fond.pdf")
+    c = canvas.Canvas(pdf, pagesize=A5)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, 560, "Cabinet médical — en-tête")
+    for i in range(60):
+        c.line(20, 20 + i * 9, 400, 30 + i * 9)
+    c.drawString(40, 30, "Adresse, téléphone, ICE")
+    c.save()
+    return png, pdf
+
+def legacy_invoice(app, n: int, path: str):
+    pdf = PDFInvoice(app, f"20240105-{n:03d}", "Patient Test", "0612345678", "2024-01-05",
+                     SERVICES, "MAD", 20)
+    pdf.add_invoice_details()
+    pdf.add_invoice_table()
+    pdf.output(path)
+    utils.merge_with_background_pdf(path)
+    with open(path, "rb") as fh:
+        return fh.read()
+
+def template_invoice(app, n: int, path: str):
+    template = invoice_template.get_template(*invoice_template.background_paths(app))
+    pdf = PDFInvoice(app, f"20240105-{n:03d}", "Patient Test", "0612345678", "2024-01-05",
+                     SERVICES, "MAD", 20, static_layer=template is None)
+    pdf.add_invoice_details()
+    pdf.add_invoice_table()
+    content = bytes(pdf.output())
+    if template is not None:
+        content = template.apply(content)
+    with open(path, "wb") as fh:
+        fh.write(content)
+    return content
+
+def throughput(fn, app, count: int, tmp: str) -> float:
+    path = os.path.join(tmp, "facture.pdf")
+    fn(app, 0, path)  # échauffement (et rendu du gabarit pour le nouveau chemin)
+    t0 = time.perf_counter()
+    for n in range(count):
+        fn(app, n, path)
+    return count / (time.perf_counter() - t0)
+
+def same_rendering(a: bytes, b: bytes) -> str:
+    """Compare les deux rendus pixel à pixel si PyMuPDF est installé."""
+    try:
+        import fitz
+    except ImportError:
+        return "n/a"
+    pix = [fitz.open(stream=x, filetype="pdf")[0].get_pixmap(dpi=72).samples for x in (a, b)]
+    diff = sum(1 for p, q in zip(pix[0], pix[1]) if abs(p - q) > 8)
+    return "oui" if diff <= len(pix[0]) // 1000 else f"non ({diff} octets)"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        png, pdf = make_backgrounds(tmp)
+        utils.BACKGROUND_FOLDER = tmp
+        print(f"{'fond':>12} | {'ancien fact/s':>13} | {'gabarit fact/s':>14} | {'gain':>6} | rendu identique")
+        for label, image_bg, pdf_bg in [("image", png, None), ("pdf", None, pdf), ("image + pdf", png, pdf)]:
+            app = SimpleNamespace(background_path=image_bg)
+            utils.background_file = pdf_bg
+            old = throughput(legacy_invoice, app, count, tmp)
+            new = throughput(template_invoice, app, count, tmp)
+            check = same_rendering(legacy_invoice(app, 1, os.path.join(tmp, "a.pdf")),
+                                   template_invoice(app, 1, os.path.join(tmp, "b.pdf")))
+            print(f"{label:>12} | {old:>13.1f} | {new:>14.1f} | {new / old:>5.1f}x | {check}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# bench_merge_backends.py
+
+"""
+Moteurs de fusion avec le fond PDF (ms / page, taille du résultat)
+• merge_page : ancien chemin PyPDF2 (copie profonde de la page de fond + merge_page)
+• pypdf2     : utils.merge_background_pdf_bytes(..., "pypdf2") (Form XObject en cache)
+• pymupdf    : utils.merge_background_pdf_bytes(..., "pymupdf") (show_pdf_page)
+Fond vectoriel chargé ; documents de 1, 10 et 100 pages. Rendu comparé pixel à
+pixel avec l'ancien chemin.
+Usage : python benchmarks/bench_merge_backends.py [nombre de documents]   (défaut : 10)
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+from bench_background_merge import make_background, make_document, legacy_merge, same_rendering  # noqa: E402
+
+
+def ms_per_page(fn, document: bytes, pages: int, count: int) -> float:
+    fn(document)  # échauffement (fond analysé et mis en cache)
+    t0 = time.perf_counter()
+    for _ in range(count):
+        fn(document)
+    return (time.perf_counter() - t0) * 1000 / (count * pages)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if utils.pymupdf is None:
+        print("PyMuPDF n'est pas installé : seuls merge_page et pypdf2 sont mesurés.")
+    backends = {"merge_page": legacy_merge}
+    for name in ("pypdf2", "pymupdf"):
+        if utils.merge_backend(name) == name:
+            backends[name] = lambda doc, name=name: utils.merge_background_pdf_bytes(doc, name)
+    with tempfile.TemporaryDirectory() as tmp:
+        bg = os.path.join(tmp, "fond.pdf")
+        make_background(bg)
+        utils.background_file = bg
+        print(f"{'pages':>5} | " + " | ".join(f"{n + ' ms/p':>15}" for n in backends)
+              + " | " + " | ".join(f"{n + ' Ko':>13}" for n in backends) + " | rendu identique")
+        for pages in (1, 10, 100):
+            document = make_document(pages)
+            n = max(1, count // max(1, pages // 10))
+            with contextlib.redirect_stdout(io.StringIO()):
+                times = [ms_per_page(fn, document, pages, n) for fn in backends.values()]
+                outputs = [fn(document) for fn in backends.values()]
+            checks = [same_rendering(outputs[0], out) for out in outputs[1:]]
+            print(f"{pages:>5} | " + " | ".join(f"{t:>15.2f}" for t in times)
+                  + " | " + " | ".join(f"{len(o) // 1024:>13}" for o in outputs)
+                  + " | " + " / ".join(checks))
+
+if __name__ == "__main__":
+    main()
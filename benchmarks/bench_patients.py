@@ -0,0 +1,95 @@
+# bench_patients.py
+
+"""
+Micro-benchmark : construction du dictionnaire patients de rdv
+• ancien chemin : df.iterrows() (une Series par ligne)
+• nouveau chemin à froid : to_dict('records') + _patient_entry
+• nouveau chemin à chaud : rdv.load_base_patients() servi par l'index patient_store
+Usage : python benchmarks/bench_patients.py [tailles...]   (défaut : 1000 10000 100000)
+"""
+
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rdv            # noqa: E402
+import patient_store  # noqa: E402
+
+
+def legacy_load_base_patients(df: pd.DataFrame) -> dict:
+    """Ancienne implémentation de rdv.load_base_patients (boucle iterrows)."""
+    patients = {}
+    for _, row in df.iterrows():
+        pid = str(row["ID"]).strip()
+        if not pid:
+            continue
+        patients[pid] = {
+            "name":          f"{row['Nom']} {row['Prenom']}".strip(),
+            "nom":           str(row["Nom"]).strip(),
+            "prenom":        str(row["Prenom"]).strip(),
+            "date_of_birth": str(row["DateNaissance"]),
+            "gender":        str(row["Sexe"]),
+            "age":           str(row["Âge"]),
+            "antecedents":   str(row["Antécédents"]),
+            "phone":         str(row["Téléphone"]),
+        }
+    return patients
+
+def columnar_build(df: pd.DataFrame) -> dict:
+    return {rec["ID"]: rdv._patient_entry(rec) for rec in df.to_dict("records") if rec["ID"]}
+
+def make_patients(n: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "ID":            [f"P{i:06d}" for i in range(n)],
+        "Nom":           [f"Nom{i}" for i in range(n)],
+        "Prenom":        [f"Prenom{i}" for i in range(n)],
+        "DateNaissance": ["1980-05-17"] * n,
+        "Sexe":          ["Féminin" if i % 2 else "Masculin" for i in range(n)],
+        "Âge":           ["45 ans 5 mois"] * n,
+        "Antécédents":   ["RAS"] * n,
+        "Téléphone":     ["0612345678"] * n,
+    }, columns=patient_store.PATIENT_COLUMNS)
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(n: int, tmp: str):
+    df = make_patients(n)
+    repeat = 3 if n >= 100_000 else 5
+    t_legacy = best_of(lambda: legacy_load_base_patients(df), repeat)
+    t_columnar = best_of(lambda: columnar_build(df), repeat)
+    assert legacy_load_base_patients(df) == columnar_build(df)
+
+    path = Path(tmp) / f"info_Base_patient_{n}.xlsx"
+    df.to_excel(path, index=False, engine="xlsxwriter")
+    rdv.BASE_PATIENT_FILE = path
+    t0 = time.perf_counter()
+    rdv.load_base_patients()  # lecture du classeur + index + dictionnaire
+    t_cold = time.perf_counter() - t0
+    t_warm = best_of(rdv.load_base_patients, 20)
+
+    print(f"{n:>8} | {t_legacy * 1e3:>12.1f} | {t_columnar * 1e3:>12.1f} | "
+          f"{t_legacy / t_columnar:>6.1f}x | {t_warm * 1e3:>10.3f} | {t_cold:>9.2f}")
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    print(f"{'patients':>8} | {'iterrows ms':>12} | {'columnar ms':>12} | {'gain':>7} | "
+          f"{'cached ms':>10} | {'cold xlsx s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            run(n, tmp)
+
+if __name__ == "__main__":
+    main()
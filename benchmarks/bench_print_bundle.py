@@ -0,0 +1,103 @@
+# bench_print_bundle.py
+
+"""
+Impression de plusieurs patients : appels séparés contre dossier d'impression (ms / patient)
+• séparé : un utils.render_pdf_bytes par patient (nouveau canvas, fond intégré et
+  fusion avec le fond PDF à chaque fois), comme des appels successifs à
+  /generate_pdf_route, puis réunion des PDF avec PyPDF2 pour une seule impression
+• dossier : utils.render_bundle_bytes (un canvas, une fusion pour tout le lot)
+Fond image et fond PDF ; 1, 10 et 40 patients (ordonnance + analyses + certificat).
+Usage : python benchmarks/bench_print_bundle.py [répétitions]   (défaut : 3)
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+SECTIONS = ["ordonnance", "analyses", "certificat"]
+
+
+def make_backgrounds(tmp: str) -> dict:
+    img_path = os.path.join(tmp, "fond.png")
+    img = Image.new("RGB", (1748, 2480), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, 1748, 300], fill=(30, 90, 160))
+    for i in range(0, 2480, 6):
+        draw.line([(0, i), (1748, (i * 5) % 2480)], fill=(220, 230, 245), width=2)
+    img.save(img_path)
+    pdf_path = os.path.join(tmp, "fond.pdf")
+    c = canvas.Canvas(pdf_path, pagesize=A5)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, 560, "Cabinet médical - en-tête")
+    for i in range(800):
+        c.line(10 + i % 400, 10 + (i * 7) % 580, 20 + (i * 13) % 400, 15 + (i * 3) % 580)
+    c.save()
+    return {"image": img_path, "pdf": pdf_path}
+
+def make_documents(count: int) -> list:
+    return [{
+        "form": {
+            "doctor_name": "Dr Alaoui", "patient_name": f"Patient {i}", "patient_age": "42",
+            "gender": "F", "location": "Rabat", "include_certificate": "on",
+            "certificate_content": "Je soussigné [Nom du Médecin] certifie avoir examiné "
+                                   "[Nom du Patient] et prescrit un repos de 3 jours. " * 3,
+        },
+        "medications": [f"Médicament {k} : 1 cp matin et soir pendant 7 jours" for k in range(6)],
+        "analyses": ["NFS", "CRP", "Glycémie à jeun"],
+        "radiologies": [],
+    } for i in range(count)]
+
+def separate(documents: list) -> bytes:
+    writer = PdfWriter()
+    for doc in documents:
+        pdf = utils.render_pdf_bytes(doc["form"], doc["medications"], doc["analyses"],
+                                     doc["radiologies"], SECTIONS)
+        for page in PdfReader(io.BytesIO(pdf)).pages:
+            writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+def bundle(documents: list) -> bytes:
+    return utils.render_bundle_bytes(documents, SECTIONS)
+
+def ms_per_patient(fn, documents: list, repeat: int) -> float:
+    fn(documents)  # échauffement (fonds mis en cache)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(documents)
+    return (time.perf_counter() - t0) * 1000 / (repeat * len(documents))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with tempfile.TemporaryDirectory() as tmp:
+        backgrounds = make_backgrounds(tmp)
+        print(f"{'fond':>5} | {'patients':>8} | {'séparé ms/pat.':>14} | {'dossier ms/pat.':>15} | "
+              f"{'gain':>6} | {'séparé Ko':>9} | {'dossier Ko':>10} | pages")
+        for kind, path in backgrounds.items():
+            utils.background_file = path
+            for count in (1, 10, 40):
+                documents = make_documents(count)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    old = ms_per_patient(separate, documents, repeat)
+                    new = ms_per_patient(bundle, documents, repeat)
+                    old_pdf, new_pdf = separate(documents), bundle(documents)
+                pages = len(PdfReader(io.BytesIO(new_pdf)).pages)
+                print(f"{kind:>5} | {count:>8} | {old:>14.1f} | {new:>15.1f} | {old / new:>5.1f}x | "
+                      f"{len(old_pdf) // 1024:>9} | {len(new_pdf) // 1024:>10} | {pages}")
+
+if __name__ == "__main__":
+    main()
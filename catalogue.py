@@ -0,0 +1,150 @@
+# catalogue.py
+
+"""
+Catalogue livré Liste_Medications_Analyses_Radiologies.xlsx, partagé par tout le processus
+• Lu une seule fois, puis relu uniquement si son empreinte (mtime, taille) change
+• Feuille 0 : listes de la consultation (médicaments, analyses, radiologies)
+• Feuille 1 : services facturables par catégorie, avec les prix des colonnes Prix_<catégorie>
+• Les services ajoutés depuis la facturation vont dans un fichier d'ajouts
+  (MEDICALINK_DATA/catalogue_ajouts.jsonl) : le classeur livré n'est plus réécrit
+"""
+
+import os
+import json
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+import pandas as pd
+
+import utils
+
+SERVICE_CATEGORIES = ['Consultation', 'Analyses', 'Radiologies', 'Autre_Acte']
+CONSULTATION_LISTS = ['Medications', 'Analyses', 'Radiologies']
+OVERLAY_PATH = os.path.join(utils.application_path, "MEDICALINK_DATA", "catalogue_ajouts.jsonl")
+
+_LOCK = threading.RLock()
+_STATE = None   # _Catalogue courant
+
+
+class _Catalogue:
+    def __init__(self):
+        self.stamp = None           # empreinte du classeur chargé
+        self.sheet0 = pd.DataFrame()
+        self.lists = {}             # feuille 0 : colonne → liste de libellés
+        self.services = {}          # feuille 1 : catégorie → [(nom, prix Decimal ou None)]
+        self.overlay_offset = 0     # octets du fichier d'ajouts déjà appliqués
+
+
+def _parse_price(value) -> Optional[Decimal]:
+    text = str(value).strip().replace(',', '.')
+    if text in ('', 'nan', 'None'):
+        return None
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+def _split_entry(raw: str, price) -> tuple:
+    """Ligne de catégorie → (nom, prix). Les anciens ajouts sont stockés 'nom|prix'."""
+    if '|' in raw:
+        raw, price = raw.split('|', 1)
+    return raw.strip(), _parse_price(price)
+
+def _match_column(columns: list, cat: str) -> Optional[str]:
+    match = next((c for c in columns if c.strip().lower() == cat.lower()), None)
+    if not match:
+        match = next((c for c in columns if cat.lower() in c.strip().lower()), None)
+    return match
+
+def _load() -> _Catalogue:
+    cat = _Catalogue()
+    cat.stamp = utils.file_stamp(utils.LISTS_FILE)
+    if cat.stamp is None:
+        print(f"DEBUG: Catalogue {utils.LISTS_FILE} non trouvé.")
+        return cat
+    sheets = pd.read_excel(utils.LISTS_FILE, sheet_name=[0, 1], dtype=str)
+    cat.sheet0 = sheets[0].fillna('')
+    # Même contenu que l'ancienne lecture de la consultation (dtype=str puis fillna(''))
+    cat.lists = {col: cat.sheet0[col].tolist() for col in CONSULTATION_LISTS if col in cat.sheet0.columns}
+
+    df = sheets[1]
+    cols = list(df.columns)
+    for name in SERVICE_CATEGORIES:
+        match = _match_column(cols, name)
+        entries = []
+        if match:
+            price_col = next((c for c in cols if c.strip().lower() == f"prix_{match.strip().lower()}"), None)
+            prices = df[price_col] if price_col else pd.Series([None] * len(df), index=df.index)
+            for raw, price in zip(df[match], prices):
+                if pd.isna(raw):
+                    continue
+                entries.append(_split_entry(str(raw), price))
+        cat.services[name] = entries
+    print(f"DEBUG: Catalogue chargé ({len(cat.sheet0)} lignes, "
+          f"{sum(len(v) for v in cat.services.values())} services).")
+    return cat
+
+def _apply_overlay(cat: _Catalogue):
+    """Applique les ajouts écrits depuis la dernière lecture (y compris par d'autres processus)."""
+    if not os.path.exists(OVERLAY_PATH):
+        return
+    with open(OVERLAY_PATH, "rb") as fh:
+        fh.seek(cat.overlay_offset)
+        chunk = fh.read()
+    consumed = chunk.rfind(b"\n") + 1
+    for line in chunk[:consumed].splitlines():
+        try:
+            entry = json.loads(line.decode("utf-8"))
+        except ValueError:
+            continue
+        cat.services.setdefault(entry["category"], []).append(
+            (entry["name"], _parse_price(entry.get("price", ""))))
+    cat.overlay_offset += consumed
+
+def _current() -> _Catalogue:
+    global _STATE
+    with _LOCK:
+        if _STATE is None or _STATE.stamp != utils.file_stamp(utils.LISTS_FILE):
+            _STATE = _load()
+        _apply_overlay(_STATE)
+        return _STATE
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+def consultation_lists() -> Optional[dict]:
+    """Listes de la feuille 0 ('Medications', 'Analyses', 'Radiologies'), None si le classeur manque."""
+    cat = _current()
+    return None if cat.stamp is None else {k: list(v) for k, v in cat.lists.items()}
+
+def services_by_category() -> dict:
+    """Services par catégorie au format du formulaire de facturation : 'nom|prix' ou 'nom'."""
+    cat = _current()
+    out = {}
+    for name in SERVICE_CATEGORIES:
+        out[name] = [f"{n}|{p}" if p is not None else n for n, p in cat.services.get(name, [])]
+    return out
+
+def sheet_records() -> list:
+    """Lignes de la feuille 0 sous forme de dictionnaires."""
+    return _current().sheet0.to_dict("records")
+
+def version() -> tuple:
+    """Identifiant de version du catalogue (classeur + ajouts déjà appliqués)."""
+    cat = _current()
+    return (cat.stamp, cat.overlay_offset)
+
+
+# ---------------------------------------------------------------------------
+# Ajout
+# ---------------------------------------------------------------------------
+def add_service(category: str, name: str, price: str):
+    """Ajoute un service au catalogue : une ligne dans le fichier d'ajouts, O(1)."""
+    entry = {"category": category, "name": name, "price": str(price)}
+    os.makedirs(os.path.dirname(OVERLAY_PATH), exist_ok=True)
+    with _LOCK, utils.file_lock(OVERLAY_PATH):
+        with open(OVERLAY_PATH, "ab") as fh:
+            fh.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+    _current()  # l'ajout est relu comme ceux des autres processus
@@ -0,0 +1,144 @@
+# events.py
+
+"""
+Canal d'événements en direct (Server-Sent Events) par administrateur
+• publish() est appelé depuis les chemins d'écriture : RDV pris / modifié / supprimé,
+  file d'attente, consultation enregistrée, facture créée / supprimée
+• Les événements sont ajoutés à events.jsonl dans le dossier de l'administrateur :
+  tous les processus (workers Gunicorn) et tous les postes les voient
+• /events/stream : réponse SSE courte avec reprise via Last-Event-ID ; elle envoie les
+  événements en attente puis se ferme, et le navigateur se reconnecte après RETRY_MS.
+  Aucun worker n'est retenu par un onglet ouvert (workers Gunicorn synchrones)
+"""
+
+import os
+import json
+import time
+from typing import Optional
+
+from flask import Blueprint, request, session, current_app
+
+import utils
+
+events_bp = Blueprint("events", __name__, url_prefix="/events")
+
+EVENTS_FILENAME = "events.jsonl"
+MAX_LOG_BYTES = 256 * 1024    # au-delà, le journal est réduit à ses KEEP_EVENTS dernières lignes
+KEEP_EVENTS = 200
+RETRY_MS = 5000               # délai de reconnexion annoncé au navigateur
+
+_LAST_IDS: dict = {}          # chemin du journal → (empreinte, dernier id)
+
+
+def _log_path(base_dir: Optional[str] = None) -> Optional[str]:
+    base_dir = base_dir or utils.DYNAMIC_BASE_DIR
+    return os.path.join(base_dir, EVENTS_FILENAME) if base_dir else None
+
+def _read_tail_id(path: str) -> int:
+    """Id du dernier événement du journal (lecture des derniers octets seulement)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(0, fh.tell() - 4096))
+        lines = fh.read().splitlines()
+    for line in reversed(lines):
+        try:
+            return int(json.loads(line.decode("utf-8"))["id"])
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+def _rotate(path: str):
+    with open(path, "rb") as fh:
+        lines = fh.read().splitlines(keepends=True)[-KEEP_EVENTS:]
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.writelines(lines)
+    os.replace(tmp, path)
+
+
+def publish(event_type: str, data: Optional[dict] = None, base_dir: Optional[str] = None) -> Optional[int]:
+    """Diffuse un événement aux postes de l'administrateur courant. Renvoie son id."""
+    path = _log_path(base_dir)
+    if path is None:
+        print("ERROR: DYNAMIC_BASE_DIR not set. Cannot publish event.")
+        return None
+    try:
+        with utils.file_lock(path):
+            cached = _LAST_IDS.get(path)
+            stamp = utils.file_stamp(path)
+            last_id = cached[1] if cached and cached[0] == stamp else _read_tail_id(path)
+            event = {"id": last_id + 1, "type": event_type, "data": data or {}, "ts": time.time()}
+            with open(path, "ab") as fh:
+                fh.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            if os.path.getsize(path) > MAX_LOG_BYTES:
+                _rotate(path)
+            _LAST_IDS[path] = (utils.file_stamp(path), event["id"])
+    except OSError as e:
+        # Un événement perdu ne doit jamais faire échouer l'écriture qui l'a produit
+        print(f"ERROR: Publication de l'événement {event_type} impossible : {e}")
+        return None
+    return event["id"]
+
+def read_since(path: str, offset: int, last_id: int) -> tuple:
+    """
+    Événements d'id > last_id ajoutés après `offset` octets. Renvoie (événements, nouvel offset).
+    Si le journal a été réduit entre-temps, il est relu depuis le début.
+    """
+    if not os.path.exists(path):
+        return [], 0
+    if os.path.getsize(path) < offset:
+        offset = 0
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        chunk = fh.read()
+    consumed = chunk.rfind(b"\n") + 1
+    events = []
+    for line in chunk[:consumed].splitlines():
+        try:
+            event = json.loads(line.decode("utf-8"))
+        except ValueError:
+            continue
+        if event.get("id", 0) > last_id:
+            events.append(event)
+    return events, offset + consumed
+
+
+def _format(event: dict) -> str:
+    return (f"id: {event['id']}\n"
+            f"event: {event['type']}\n"
+            f"data: {json.dumps(event['data'], ensure_ascii=False)}\n\n")
+
+def _tail_id(path: str) -> int:
+    """Dernier id du journal, sans relecture tant que le fichier n'a pas changé."""
+    stamp = utils.file_stamp(path)
+    cached = _LAST_IDS.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    last_id = _read_tail_id(path)
+    _LAST_IDS[path] = (stamp, last_id)
+    return last_id
+
+def _poll(path: str, last_id: Optional[int]) -> str:
+    if last_id is None:
+        # Nouvelle connexion : seuls les événements à venir seront envoyés ; l'id seul
+        # fixe le Last-Event-ID de la prochaine reconnexion
+        return f"retry: {RETRY_MS}\nid: {_tail_id(path)}\n\n"
+    body = f"retry: {RETRY_MS}\n\n"
+    if _tail_id(path) > last_id:
+        events, _ = read_since(path, 0, last_id)
+        body += "".join(_format(event) for event in events)
+    return body
+
+@events_bp.route("/stream")
+def stream():
+    admin_email = session.get('admin_email', 'default_admin@example.com')
+    utils.set_dynamic_base_dir(admin_email)
+    path = _log_path()
+    header = request.headers.get("Last-Event-ID", "").strip()
+    last_id = int(header) if header.isdigit() else None
+    resp = current_app.response_class(_poll(path, last_id), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # pas de mise en tampon derrière nginx
+    return resp
@@ -1,22 +1,34 @@
+import io
 import os
 import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, date, time
+from functools import lru_cache
+from types import SimpleNamespace
 import json
 
 import pandas as pd
 import qrcode
 from flask import (
     Blueprint, request, render_template_string, redirect, url_for,
-    flash, send_file, current_app, jsonify, session
+    flash, send_file, current_app, jsonify, session, Response
 )
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
-from PIL import Image
+from jinja2.utils import htmlsafe_json_dumps
 import utils
+import money
 import theme
+import patient_store
+import invoice_store
+import pdf_store
+import catalogue
+import events
+import invoice_template
 from rdv import load_patients # This load_patients will now implicitly use dynamic paths from utils
-from routes import LISTS_FILE
-from utils import merge_with_background_pdf # Import added
 
 facturation_bp = Blueprint('facturation', __name__, url_prefix='/facturation')
 
@@ -25,38 +37,66 @@ facturation_bp = Blueprint('facturation', __name__, url_prefix='/facturation')
 
 def _json_default(obj):
     """
-    Makes datetime/date/time objects serializable for Jinja |tojson.
+    Single typed serialization path for the page payloads.
     • datetime → 'YYYY-MM-DD HH:MM:SS'
     • date     → 'YYYY-MM-DD'
     • time     → 'HH:MM'
     All other non-JSON-compatible types are converted to str().
     """
     if isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%d %H:%MM:%S')
+        return obj.strftime('%Y-%m-%d %H:%M:%S')
     if isinstance(obj, date):
         return obj.isoformat()
     if isinstance(obj, time):
         return obj.strftime('%H:%M')
     return str(obj)
 
-def _to_json_safe(obj):
+_JSON_BLOBS      = {}   # (nom, fichier source) → (version, Markup)
+_JSON_BLOBS_LOCK = threading.Lock()
+
+def _json_blob(name: str, source, version, build):
     """
-    Makes date/time objects serializable for Flask|tojson.
-    • datetime  → 'YYYY-MM-DD HH:MM:SS'
-    • date      → 'YYYY-MM-DD'
-    • time      → 'HH:MM'
+    JSON prêt à être inséré dans la page (même échappement HTML que |tojson),
+    sérialisé une seule fois par version des données : `build()` n'est appelé
+    que lorsque la version du fichier source change.
     """
-    if isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
-    if isinstance(obj, date):
-        return obj.strftime('%Y-%m-%d')
-    if isinstance(obj, time):
-        return obj.strftime('%H:%M')
-    raise TypeError(f"Non-serializable type: {type(obj)}")
+    key = (name, str(source))
+    with _JSON_BLOBS_LOCK:
+        hit = _JSON_BLOBS.get(key)
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    blob = htmlsafe_json_dumps(build(), dumps=json.dumps, default=_json_default, sort_keys=True)
+    with _JSON_BLOBS_LOCK:
+        _JSON_BLOBS[key] = (version, blob)
+    return blob
   
+QR_TARGET_PX = 100  # side of the embedded QR image (20 mm on the invoice)
+
+@lru_cache(maxsize=256)
+def qr_png(data: str) -> bytes:
+    """
+    PNG bytes of the QR code for `data`, memoized by payload.
+    The box size is chosen so the image is ~QR_TARGET_PX wide without any resampling.
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=1,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    modules = qr.modules_count + 2 * qr.border
+    qr.box_size = max(1, -(-QR_TARGET_PX // modules))  # integer pixels per module
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
 class PDFInvoice(FPDF):
-    def __init__(self, app, numero, patient, phone, date_str, services, currency, vat):
-        super().__init__(orientation='P', unit='mm', format='A5')  # A5 for compactness
+    def __init__(self, app, numero, patient, phone, date_str, services, currency, vat,
+                 static_layer=True):
+        super().__init__(orientation='P', unit='mm', format=invoice_template.PAGE_FORMAT)  # A5 for compactness
         self.app      = app
         self.numero   = numero
         self.patient  = patient
@@ -65,33 +105,17 @@ class PDFInvoice(FPDF):
         self.services = services
         self.currency = currency
         self.vat      = float(vat)
-        self.set_left_margin(20)
-        self.set_right_margin(20)
-        self.set_top_margin(17)
-        self.set_auto_page_break(auto=False)
-        self.add_page()
+        # False : fond et titre viennent du gabarit (invoice_template), seul le variable est dessiné
+        self.static_layer = static_layer
+        invoice_template.new_page(self)
 
     def header(self):
-        # Utiliser utils.background_file qui est mis à jour dynamiquement
-        bg = getattr(self.app, 'background_path', None) or getattr(utils, 'background_file', None)
-        if bg and not os.path.isabs(bg):
-            # Assurez-vous que BACKGROUND_FOLDER est défini avant d'y accéder
-            if utils.BACKGROUND_FOLDER:
-                bg = os.path.join(utils.BACKGROUND_FOLDER, bg)
-            else:
-                print("WARNING: utils.BACKGROUND_FOLDER not set. Cannot load background image.")
-                bg = None # Prevent errors if path is not defined
-        
-        if bg and os.path.isfile(bg) and bg.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-            try:
-                self.image(bg, x=0, y=0, w=self.w, h=self.h)
-            except Exception:
-                pass
-        self.set_font('Helvetica', 'B', 18)
+        if self.static_layer:
+            image_bg, _ = invoice_template.background_paths(self.app)
+            invoice_template.draw_static_layer(self, image_bg)
+        else:
+            invoice_template.skip_static_layer(self)
         self.set_text_color(0, 0, 0)
-        self.ln(15)
-        self.cell(0, 8, 'Facture', align='C')
-        self.ln(8)
         y_numero = self.get_y()
         self.set_font('Helvetica', '', 10)
         self.cell(0, 6, f"Numéro : {self.numero}", align='C')
@@ -99,28 +123,12 @@ class PDFInvoice(FPDF):
         self.cell(0, 6, f"Date : {self.date_str}", align='C')
 
         qr_data = f"Facture {self.numero} le {self.date_str}"
-        qr_img = self._generate_qr(qr_data)
-        tmp_qr = "temp_qr.png"
-        qr_img.save(tmp_qr)
-        self.image(tmp_qr, x=self.w - self.r_margin - 20, y=y_numero, w=20, h=20)
-        os.remove(tmp_qr)
+        self.image(io.BytesIO(qr_png(qr_data)), x=self.w - self.r_margin - 20, y=y_numero, w=20, h=20)
         self.ln(15)
 
     def footer(self):
         pass
 
-    def _generate_qr(self, data):
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        return img.resize((100, 100), Image.Resampling.LANCZOS)
-
     def add_invoice_details(self):
         self.set_font('Helvetica', 'B', 12)
         lh = 8
@@ -152,9 +160,8 @@ class PDFInvoice(FPDF):
         self.cell(w_price,   10, f'PRIX ({self.currency})', border=1, align='C', fill=True)
         self.ln()
 
-        # Body preparation
+        # Body preparation (prices in integer cents, see money)
         line_height = self.font_size * 1.5
-        total_ht    = 0.0
         fill        = False
 
         # Colors for alternation
@@ -167,7 +174,7 @@ class PDFInvoice(FPDF):
         for svc in self.services:
             # Text cleanup
             name  = svc['name']
-            price = f"{svc['price']:.2f}"
+            price = money.fmt(svc['price'])
 
             # Choose line background
             self.set_fill_color(*(color_light if fill else color_dark))
@@ -190,7 +197,6 @@ class PDFInvoice(FPDF):
 
             # Go to next line
             self.ln(cell_h)
-            total_ht += svc['price']
             fill = not fill
 
         # === Separator line before totals ===
@@ -201,8 +207,8 @@ class PDFInvoice(FPDF):
         self.ln(6)
 
         # Bold totals
-        tva_amount = total_ht * (self.vat / 100)
-        total_ttc  = total_ht + tva_amount
+        total_ht, tva_amount, total_ttc = money.invoice_totals(
+            (s['price'] for s in self.services), self.vat)
 
         self.set_font('Helvetica', 'B', 12)
         labels = [('Sous-total HT', total_ht),
@@ -210,24 +216,108 @@ class PDFInvoice(FPDF):
                   ('TOTAL TTC', total_ttc)]
         for label, amt in labels:
             self.cell(w_service, 8, label, border=1, align='R')
-            self.cell(w_price,   8, f"{amt:.2f}", border=1, align='R')
+            self.cell(w_price,   8, money.fmt(amt), border=1, align='R')
             self.ln()
 
+def render_invoice(numero, patient, phone, date_str, services, currency, vat, backgrounds) -> bytes:
+    """
+    PDF complet d'une facture. services : [{'name', 'price' en centimes}],
+    backgrounds = invoice_template.background_paths(...).
+    Fonction de module (sérialisable) : exécutée telle quelle par le pool de la facturation groupée.
+    """
+    template = invoice_template.get_template(*backgrounds)
+    pdf = PDFInvoice(
+        app      = SimpleNamespace(background_path=backgrounds[0]),
+        numero   = numero,
+        patient  = patient,
+        phone    = phone,
+        date_str = date_str,
+        services = services,
+        currency = currency,
+        vat      = vat,
+        static_layer = template is None
+    )
+    pdf.add_invoice_details()
+    pdf.add_invoice_table()
+    content = bytes(pdf.output())
+    if template is not None:
+        content = template.apply(content)
+    return content
+
+# ---------- Facturation groupée : pool de processus partagé ----------------
+BATCH_MAX_INVOICES = 500
+BATCH_WORKERS      = max(1, min(4, (os.cpu_count() or 1) - 1))
+_BATCH_POOL        = None
+_BATCH_POOL_LOCK   = threading.Lock()
+
+def _batch_pool() -> ProcessPoolExecutor:
+    """Pool créé au premier lot puis réutilisé (forkserver/spawn : pas de fork d'un worker multi-thread)."""
+    global _BATCH_POOL
+    with _BATCH_POOL_LOCK:
+        if _BATCH_POOL is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _BATCH_POOL = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                              mp_context=multiprocessing.get_context(method))
+        return _BATCH_POOL
+
+def _render_batch(jobs: list, backgrounds: tuple):
+    """Rend les factures dans le pool ; produit (job, pdf) dans l'ordre de fin de rendu."""
+    def args(job):
+        return (job['numero'], job['patient'], job['phone'], job['date'],
+                job['services'], job['currency'], job['vat'], backgrounds)
+
+    done = set()
+    if len(jobs) > 1:
+        try:
+            pool = _batch_pool()
+            futures = {pool.submit(render_invoice, *args(job)): job for job in jobs}
+            for fut in as_completed(futures):
+                job = futures[fut]
+                content = fut.result()
+                done.add(job['numero'])
+                yield job, content
+        except BrokenProcessPool as e:
+            global _BATCH_POOL
+            print(f"ERROR: Pool de facturation indisponible, rendu dans le processus : {e}")
+            with _BATCH_POOL_LOCK:
+                _BATCH_POOL = None
+    for job in jobs:
+        if job['numero'] not in done:
+            yield job, render_invoice(*args(job))
+
+def _batch_job(spec: dict, by_id: dict, currency: str, vat: float) -> dict:
+    """Une entrée du lot → facture à rendre (ValueError si elle est invalide)."""
+    if not isinstance(spec, dict):
+        raise ValueError("objet attendu")
+    rec = by_id.get(str(spec.get('patient_id', '')).strip())
+    if rec is not None:
+        patient = f"{rec.get('Nom','')} {rec.get('Prenom','')}".strip()
+        phone   = rec.get('Téléphone', '')
+    elif spec.get('patient'):
+        patient, phone = str(spec['patient']).strip(), str(spec.get('phone', '')).strip()
+    else:
+        raise ValueError("patient_id inconnu et aucun nom de patient")
+    date_str = str(spec.get('date') or date.today().isoformat())
+    datetime.strptime(date_str, '%Y-%m-%d')
+    services = []
+    for svc in spec.get('services') or []:
+        if isinstance(svc, dict):
+            name, price = svc.get('name', ''), svc.get('price')
+        else:
+            name, price = str(svc).split('|')
+        services.append({'name': str(name), 'price': money.parse_cents(price)})
+    if not services:
+        raise ValueError("aucun service")
+    return {'patient': patient, 'phone': phone, 'date': date_str, 'services': services,
+            'currency': currency, 'vat': vat,
+            'totals': money.invoice_totals((s['price'] for s in services), vat)}
+
 @facturation_bp.route('/new_patient', methods=['GET', 'POST'])
 def new_patient():
     # Ensure utils.EXCEL_FOLDER is defined before use
     if utils.EXCEL_FOLDER is None:
         return "Erreur: Les chemins de dossier ne sont pas définis. Veuillez vous connecter.", 500
 
-    excel_path = os.path.join(utils.EXCEL_FOLDER, 'info_Base_patient.xlsx')
-    
-    # Ensure patient file exists
-    if not os.path.exists(excel_path):
-        os.makedirs(utils.EXCEL_FOLDER, exist_ok=True)
-        # Required columns for listing patients
-        df_empty = pd.DataFrame(columns=['ID', 'Nom', 'Prenom', 'Téléphone'])
-        df_empty.to_excel(excel_path, index=False)
-        
     if request.method == 'POST':
         id_     = request.form.get('ID')
         nom     = request.form.get('Nom')
@@ -236,9 +326,10 @@ def new_patient():
         if not (id_ and nom and prenom):
             flash('Veuillez remplir ID, Nom et Prénom', 'danger')
             return redirect(url_for('facturation.new_patient'))
-        df = pd.read_excel(excel_path)
-        df = pd.concat([df, pd.DataFrame([{'ID': id_, 'Nom': nom, 'Prenom': prenom, 'Téléphone': tel}])], ignore_index=True)
-        df.to_excel(excel_path, index=False)
+        # Upsert by ID: the other fields of an existing patient are kept
+        rec = dict(patient_store.get(id_) or {})
+        rec.update({'ID': id_, 'Nom': nom, 'Prenom': prenom, 'Téléphone': tel})
+        patient_store.upsert(rec)
         flash('Patient ajouté ✔', 'success')
         return redirect(url_for('facturation.facturation_home'))
     return render_template_string(new_patient_template)
@@ -246,19 +337,19 @@ def new_patient():
 @facturation_bp.route('/download/<path:filename>')
 def download_invoice(filename):
     """
-    Serves the requested PDF file if present in utils.PDF_FOLDER,
-    otherwise returns 404/flash.
+    Serves the requested PDF file from utils.PDF_FOLDER, or from its monthly
+    archive (PDF/Archives) for older invoices, otherwise returns 404/flash.
     """
     # Ensure utils.PDF_FOLDER is defined before use
     if utils.PDF_FOLDER is None:
         return "Erreur: Les chemins de dossier ne sont pas définis. Veuillez vous connecter.", 500
-    file_path = os.path.join(utils.PDF_FOLDER, filename)
-    if not os.path.isfile(file_path):
+    source = pdf_store.document(os.path.basename(filename))
+    if source is None:
         flash("Fichier introuvable !", "danger")
         return redirect(url_for('facturation.facturation_home'))
 
     return send_file(
-        file_path,
+        io.BytesIO(source) if isinstance(source, bytes) else source,
         as_attachment=True,
         download_name=filename,
         mimetype='application/pdf'
@@ -267,35 +358,26 @@ def download_invoice(filename):
 @facturation_bp.route('/delete/<invoice_number>', methods=['DELETE'])
 def delete_invoice(invoice_number):
     """
-    Deletes an invoice entry from 'factures.xlsx' and its corresponding PDF file.
+    Deletes an invoice from the ledger (tombstone, purged in the background)
+    and its corresponding PDF file.
     """
-    # Ensure utils.EXCEL_FOLDER and utils.PDF_FOLDER are defined before use
-    if utils.EXCEL_FOLDER is None or utils.PDF_FOLDER is None:
+    # Ensure utils.SQLITE_DB_PATH and utils.PDF_FOLDER are defined before use
+    if utils.SQLITE_DB_PATH is None or utils.PDF_FOLDER is None:
         return jsonify(success=False, error="Les chemins de dossier ne sont pas définis."), 500
 
-    factures_path = os.path.join(utils.EXCEL_FOLDER, 'factures.xlsx')
     pdf_file_name = f"Facture_{invoice_number}.pdf"
-    pdf_path = os.path.join(utils.PDF_FOLDER, pdf_file_name)
 
     try:
-        # Delete from Excel
-        if os.path.exists(factures_path):
-            df = pd.read_excel(factures_path, dtype={'Numero': str})
-            # Filter out the invoice to be deleted
-            df_filtered = df[df['Numero'] != invoice_number]
-            if len(df_filtered) < len(df): # If an invoice was actually removed
-                df_filtered.to_excel(factures_path, index=False)
-            else:
-                return jsonify(success=False, error="Facture non trouvée dans l'Excel."), 404
+        # Delete from the ledger
+        if invoice_store.delete_invoice(invoice_number):
+            events.publish("invoice.deleted", {"numero": invoice_number})
         else:
-            return jsonify(success=False, error="Fichier Excel des factures introuvable."), 404
+            return jsonify(success=False, error="Facture non trouvée."), 404
 
-        # Delete PDF file
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
-        else:
+        # Delete PDF file (PDF folder or monthly archive) and its catalogue entry
+        if not pdf_store.forget(pdf_file_name):
             # It's not a critical error if PDF is already gone, but log it
-            print(f"PDF file not found for deletion: {pdf_path}")
+            print(f"PDF file not found for deletion: {pdf_file_name}")
 
         return jsonify(success=True), 200
 
@@ -324,33 +406,13 @@ def facturation_home():
     current_app.background_path = config.get('background_file_path')
 
     # ---------- 1. Available services/acts ---------------------------
-    # LISTS_FILE est statique, donc son chemin n'est pas affecté
-    df_lists = pd.read_excel(LISTS_FILE, sheet_name=1)
-    cols     = list(df_lists.columns)
-    services_by_category = {}
-    for cat in ['Consultation', 'Analyses', 'Radiologies', 'Autre_Acte']:
-        match = next((c for c in cols if c.strip().lower() == cat.lower()), None)
-        if not match:
-            match = next((c for c in cols if cat.lower() in c.strip().lower()), None)
-        services_by_category[cat] = (
-            df_lists[match].dropna().astype(str).tolist() if match else []
-        )
+    # Catalogue partagé (chargé une fois, prix des colonnes Prix_* inclus)
+    services_by_category = catalogue.services_by_category()
 
     # ---------- 2. Patient database ------------------------------------------
-    # Utilise utils.EXCEL_FOLDER qui est maintenant dynamique
-    info_path = os.path.join(utils.EXCEL_FOLDER, 'info_Base_patient.xlsx')
-    # Initialize last_patient outside the if-else block
-    patients_info = []
-    last_patient  = {} 
-    
-    if os.path.exists(info_path):
-        df_pat        = pd.read_excel(info_path, dtype=str)
-        patients_info = df_pat.to_dict(orient='records')
-        last_patient  = df_pat.iloc[-1].to_dict() if not df_pat.empty else {}
-    # Moved initialization here:
-    # else:
-    #     patients_info = []
-    #     last_patient  = {}
+    # Index patient en mémoire (patient_store), sans relecture du classeur à chaque requête
+    patients_info = patient_store.records()
+    last_patient  = dict(patients_info[-1]) if patients_info else {}
 
 
     # ---------- 3. POST : invoice creation --------------------------------
@@ -393,83 +455,45 @@ def facturation_home():
         patient_name = f"{rec.get('Nom','')} {rec.get('Prenom','')}".strip()
         phone        = rec.get('Téléphone', '')
 
-        # 3-D. Invoice number
+        # 3-D. Invoice number (compteur SQLite par jour, atomique)
         date_str = request.form.get('date')
-        date_key = date_str.replace('-', '')
-        
-        # Utilise utils.PDF_FOLDER qui est maintenant dynamique
-        existing = []
-        if utils.PDF_FOLDER and os.path.exists(utils.PDF_FOLDER): # Added check for utils.PDF_FOLDER existence
-            existing = [
-                fn for fn in os.listdir(utils.PDF_FOLDER)
-                if fn.startswith(f"Facture_{date_key}")
-            ]
-        numero = f"{date_key}-{len(existing)+1:03d}"
 
         # 3-E. Selected services
         services = []
         for svc in request.form.getlist('services[]'):
             name, price = svc.split('|')
-            services.append({'name': name, 'price': float(price)})
+            services.append({'name': name, 'price': money.parse_cents(price)})
         if not services:
             flash('Veuillez sélectionner au moins un service', 'danger')
             return redirect(url_for('facturation.facturation_home'))
+        numero = invoice_store.next_invoice_number(date_str)
 
-        # 3-F. Totals
-        total_ht   = sum(s['price'] for s in services)
-        tva_amount = total_ht * (config.get('vat', 20) / 100)
-        total_ttc  = total_ht + tva_amount
+        # 3-F. Totals (centimes entiers, TVA arrondie au centime)
+        total_ht, tva_amount, total_ttc = money.invoice_totals(
+            (s['price'] for s in services), config.get('vat', 20))
 
         # 3-G. Currency
         selected_currency   = request.form.get('currency', config.get('currency', 'EUR'))
         config['currency']  = selected_currency
         utils.save_config(config)
 
-        # 3-H. PDF Creation
-        pdf = PDFInvoice(
-            app      = current_app,
-            numero   = numero,
-            patient  = patient_name,
-            phone    = phone,
-            date_str = date_str,
-            services = services,
-            currency = selected_currency,
-            vat      = config.get('vat', 20)
-        )
-        pdf.add_invoice_details()
-        pdf.add_invoice_table()
-        
+        # 3-H/I. PDF Creation (couche statique servie par le gabarit du cabinet)
+        content = render_invoice(numero, patient_name, phone, date_str, services,
+                                 selected_currency, config.get('vat', 20),
+                                 invoice_template.background_paths(current_app))
         # Utilise utils.PDF_FOLDER qui est maintenant dynamique
         output_path = os.path.join(utils.PDF_FOLDER, f"Facture_{numero}.pdf")
-        pdf.output(output_path)
-
-        # 3-I. Background merge
-        merge_with_background_pdf(output_path)
-
-        # 3-J. Excel Save
-        # Utilise utils.EXCEL_FOLDER qui est maintenant dynamique
-        factures_path = os.path.join(utils.EXCEL_FOLDER, 'factures.xlsx')
-        if os.path.exists(factures_path):
-            df_fact = pd.read_excel(factures_path, dtype={'Numero': str})
-        else:
-            df_fact = pd.DataFrame(columns=[
-                'Numero', 'Patient', 'Téléphone', 'Date',
-                'Services', 'Sous-total', 'TVA', 'Total'
-            ])
-        df_fact = pd.concat([
-            df_fact,
-            pd.DataFrame([{
-                'Numero'    : numero,
-                'Patient'   : patient_name,
-                'Téléphone' : phone,
-                'Date'      : date_str,
-                'Services'  : "; ".join(f"{s['name']}({s['price']:.2f})" for s in services),
-                'Sous-total': total_ht,
-                'TVA'       : tva_amount,
-                'Total'     : total_ttc
-            }])
-        ], ignore_index=True)
-        df_fact.to_excel(factures_path, index=False)
+        utils.write_file_atomic(output_path, content)
+        pdf_store.record(output_path, patient_name)
+
+        # 3-J. Ledger append (une ligne, sans relire les autres factures)
+        invoice_store.append_invoice(
+            numero, date_str, patient_name, phone,
+            "; ".join(f"{s['name']}({money.fmt(s['price'])})" for s in services),
+            total_ht, tva_amount, total_ttc, currency=selected_currency
+        )
+        events.publish("invoice.created", {"numero": numero, "patient": patient_name,
+                                           "total": float(money.from_cents(total_ttc))})
 
         flash('Facture générée et enregistrée ✔', 'success')
         return redirect(url_for(
@@ -480,16 +504,7 @@ def facturation_home():
     # ---------- 4. GET variables (default form) -------------------------
     from datetime import date # ensure date is imported
     today_iso         = date.today().isoformat()
-    date_key          = today_iso.replace('-', '')
-    
-    # Utilise utils.PDF_FOLDER qui est maintenant dynamique
-    existing_pdf      = []
-    if utils.PDF_FOLDER and os.path.exists(utils.PDF_FOLDER): # Added check for utils.PDF_FOLDER existence
-        existing_pdf = [
-            fn for fn in os.listdir(utils.PDF_FOLDER)
-            if fn.startswith(f"Facture_{date_key}")
-        ]
-    numero_default    = f"{date_key}-{len(existing_pdf)+1:03d}"
+    numero_default    = invoice_store.peek_invoice_number(today_iso)
     vat_default       = config.get('vat', 20.0)
     selected_currency = config.get('currency', 'EUR')
 
@@ -497,13 +512,15 @@ def facturation_home():
     factures        = load_invoices() # load_invoices utilise utils.EXCEL_FOLDER/factures.xlsx
     report_summary  = generate_report_summary() # utilise load_invoices
 
-    services_json       = json.loads(json.dumps(services_by_category, default=_json_default))
-    patients_json       = json.loads(json.dumps(patients_info,       default=_json_default))
-    factures_json       = json.loads(json.dumps(factures,            default=_json_default))
-    report_summary_json = json.loads(json.dumps(report_summary,      default=_json_default))
+    # Les factures et le résumé sont déjà typés (str / float) et ne servent qu'aux boucles Jinja ;
+    # patients et services sont insérés dans le JS sous forme de JSON mis en cache par version
+    services_json = _json_blob('services', utils.LISTS_FILE, catalogue.version(),
+                               lambda: services_by_category)
+    patients_json = _json_blob('patients', utils.PATIENT_BASE_FILE, patient_store.version(),
+                               lambda: patients_info)
 
     # ---------- Display message if no invoice ---------------------
-    if not factures_json:
+    if not factures:
         flash("Aucune donnée de facturation disponible.", "warning")
 
     # ---------- 6. Render ---------------------------------------------------
@@ -512,118 +529,221 @@ def facturation_home():
         config               = config,
         theme_vars           = theme_vars,
         theme_names          = list(theme.THEMES.keys()),
-        services_by_category = services_json,
-        patients_info        = patients_json,
+        services_by_category = services_by_category,
+        services_json        = services_json,
+        patients_info        = patients_info,
+        patients_json        = patients_json,
         last_patient         = last_patient,
         today                = today_iso,
         numero_default       = numero_default,
         vat_default          = vat_default,
         currency             = selected_currency,
         background_files     = background_files,
-        factures             = factures_json,
-        report_summary       = report_summary_json
+        factures             = factures,
+        report_summary       = report_summary
     )
 
 @facturation_bp.route('/add_service', methods=['POST'])
 def add_service():
-    # LISTS_FILE est statique, donc son chemin n'est pas affecté
+    # Ajout dans le fichier d'ajouts du catalogue, le classeur livré n'est pas réécrit
     data = request.get_json() or {}
     cat = data.get('category', '').strip()
     name = data.get('name', '').strip()
     price = data.get('price', '').strip()
     if not (cat and name and price):
         return jsonify(success=False, error="Données incomplètes"), 400
-    xls = pd.read_excel(LISTS_FILE, sheet_name=None)
-    sheet_name = list(xls.keys())[1]
-    df = xls[sheet_name]
-    col = next((c for c in df.columns if c.strip().lower() == cat.lower()), None)
-    if col is None:
-        col = cat
-        df[col] = pd.NA
-    df.loc[len(df), col] = f"{name}|{price}"
-    with pd.ExcelWriter(LISTS_FILE, engine='openpyxl') as writer:
-        for sname, sheet_df in xls.items():
-            if sname == sheet_name:
-                sheet_df = df
-            sheet_df.to_excel(writer, sheet_name=sname, index=False)
+    catalogue.add_service(cat, name, price)
     return jsonify(success=True)
 
+@facturation_bp.route('/export')
+def export_invoices():
+    """XLSX export of the ledger, generated on demand (optional ?start=&end=)."""
+    start = request.args.get('start') or None
+    end   = request.args.get('end')   or None
+    return send_file(
+        io.BytesIO(invoice_store.export_xlsx(start, end)),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=f"export_factures_{date.today().isoformat()}.xlsx"
+    )
+
+@facturation_bp.route('/archive')
+def archive_invoices():
+    """
+    ZIP des factures PDF d'une période (?from=AAAA-MM-JJ&to=AAAA-MM-JJ, bornes incluses,
+    facultatives) suivi du relevé XLSX correspondant. Sélection par l'index du registre
+    (pas de parcours du dossier), PDF lus par blocs et envoyés en flux (chunked).
+    """
+    start = request.args.get('from') or None
+    end   = request.args.get('to')   or None
+    try:
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify(success=False, error="Dates attendues au format AAAA-MM-JJ"), 400
+
+    # Chemins du cabinet figés maintenant : le flux est lu après la fin de la requête
+    pdf_folder, db_path = utils.PDF_FOLDER, utils.SQLITE_DB_PATH
+    def entries():
+        for numero in invoice_store.iter_invoice_numbers(start, end, db_path):
+            # Factures anciennes lues dans leur archive mensuelle
+            source = pdf_store.document(f"Facture_{numero}.pdf", pdf_folder, db_path)
+            if source is not None:
+                yield f"Facture_{numero}.pdf", source
+        yield "factures.xlsx", invoice_store.export_xlsx(start, end, db_path)
+
+    filename = f"factures_{start or 'debut'}_{end or date.today().isoformat()}.zip"
+    return Response(
+        utils.zip_stream(entries()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@facturation_bp.route('/batch', methods=['POST'])
+def batch_invoices():
+    """
+    Facturation groupée (fin de mois). Corps JSON :
+      {"invoices": [{"patient_id": "P1", "date": "AAAA-MM-JJ", "services": ["Nom|prix", ...]}, ...],
+       "vat": 20, "currency": "MAD", "batch_id": "..."}
+    "patient" / "phone" peuvent remplacer patient_id ; vat, currency et date reprennent la
+    configuration et le jour courant. PDF rendus en parallèle ; numéros et registre
+    validés en une transaction (annulée si un rendu échoue), réponse : ZIP des PDF.
+    Avancement : événements SSE 'invoice.batch'.
+    """
+    payload = request.get_json(silent=True) or {}
+    specs   = payload.get('invoices')
+    if not isinstance(specs, list) or not specs:
+        return jsonify(success=False, error="Aucune facture dans le lot"), 400
+    if len(specs) > BATCH_MAX_INVOICES:
+        return jsonify(success=False, error=f"Lot limité à {BATCH_MAX_INVOICES} factures"), 400
+
+    config = utils.load_config()
+    try:
+        vat = float(payload.get('vat', config.get('vat', 20)))
+        if not 0 <= vat <= 100:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Le taux de TVA doit être un nombre entre 0 et 100"), 400
+    currency = payload.get('currency') or config.get('currency', 'EUR')
+    by_id    = {str(p['ID']): p for p in patient_store.records()}
+
+    batch_jobs = []
+    for i, spec in enumerate(specs, 1):
+        try:
+            batch_jobs.append(_batch_job(spec, by_id, currency, vat))
+        except (ValueError, TypeError) as e:
+            return jsonify(success=False, error=f"Facture {i} : {e}"), 400
+
+    batch_id    = str(payload.get('batch_id') or uuid.uuid4().hex[:12])
+    total       = len(batch_jobs)
+    step        = max(1, total // 20)
+    backgrounds = invoice_template.background_paths(
+        SimpleNamespace(background_path=config.get('background_file_path')))
+    paths, patient_names = [], []
+    events.publish("invoice.batch", {"batch": batch_id, "done": 0, "total": total})
+    try:
+        # Numéros, PDF et registre dans la même transaction : si un rendu ou l'écriture
+        # échoue, les numéros réservés sont rendus et la séquence légale reste continue
+        with invoice_store.batch() as ledger:
+            by_day = {}
+            for job in batch_jobs:
+                by_day.setdefault(job['date'], []).append(job)
+            for day, day_jobs in by_day.items():
+                for job, numero in zip(day_jobs, ledger.reserve(day, len(day_jobs))):
+                    job['numero'] = numero
+            for done, (job, content) in enumerate(_render_batch(batch_jobs, backgrounds), 1):
+                path = os.path.join(utils.PDF_FOLDER, f"Facture_{job['numero']}.pdf")
+                utils.write_file_atomic(path, content)
+                paths.append(path)
+                patient_names.append(job['patient'])
+                if done % step == 0 and done < total:
+                    events.publish("invoice.batch", {"batch": batch_id, "done": done, "total": total})
+            ledger.append([
+                (job['numero'], job['date'], job['patient'], job['phone'],
+                 "; ".join(f"{s['name']}({money.fmt(s['price'])})" for s in job['services']),
+                 *job['totals'], job['currency'])
+                for job in batch_jobs
+            ])
+    except Exception as e:
+        # Rien n'est inscrit au registre : on retire les PDF déjà écrits
+        print(f"ERROR: Facturation groupée {batch_id} interrompue : {e}")
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        events.publish("invoice.batch", {"batch": batch_id, "done": 0, "total": total, "error": str(e)})
+        return jsonify(success=False, error=str(e)), 500
+
+    pdf_store.record_many(paths, patient_names)
+    # Fin du lot annoncée une fois le registre validé : les autres postes peuvent actualiser
+    events.publish("invoice.batch", {"batch": batch_id, "done": total, "total": total})
+
+    paths.sort()
+    return Response(
+        utils.zip_stream((os.path.basename(path), path) for path in paths),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=factures_{batch_id}.zip',
+                 'X-Batch-Id': batch_id}
+    )
+
 @facturation_bp.route('/report')
 def report():
     start = request.args.get('start') or None
     end   = request.args.get('end')   or None
-    summary = generate_report_summary(start, end)
-    count = summary['count']
-    summary['average'] = summary['total_ttc'] / count if count else 0.0
-    return jsonify(summary)
+    return jsonify(generate_report_summary(start, end))
 
 def load_invoices():
     """
-    Loads the 'factures.xlsx' workbook and returns a list of dictionaries
-    ready for display.
+    Returns the invoices of the ledger as a list of dictionaries ready for display.
 
-    • Forces the 'Numero' column to remain a **string** (dtype={'Numero': str})
-      to avoid any str + int concatenation in the template.
-    • Formats the 'Date' column to DD/MM/YYYY format.
-    • Returns records sorted from most recent to oldest.
+    • 'Numero' stays a string.
+    • 'Date' is formatted DD/MM/YYYY; amounts are floats for the template.
+    • Records are sorted from most recent to oldest (by the typed date).
     """
-    # Utilise utils.EXCEL_FOLDER qui est maintenant dynamique
-    if utils.EXCEL_FOLDER is None:
-        print("ERROR: utils.EXCEL_FOLDER is None in load_invoices.")
+    if utils.SQLITE_DB_PATH is None:
+        print("ERROR: utils.SQLITE_DB_PATH is None in load_invoices.")
         return []
-        
-    factures_path = os.path.join(utils.EXCEL_FOLDER, 'factures.xlsx')
-    if os.path.exists(factures_path):
-        df = pd.read_excel(factures_path, dtype={'Numero': str}).fillna("")
-
-        if 'Date' in df.columns:
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')\
-                             .dt.strftime('%d/%m/%Y')
-
-        return df.sort_values('Date', ascending=False, na_position='last')\
-                 .to_dict('records')
-
-    return []
+    factures = invoice_store.list_invoices()
+    for f in factures:
+        f['Date'] = f['Date'].strftime('%d/%m/%Y')
+        for col in ('Sous-total', 'TVA', 'Total'):
+            f[col] = float(f[col])
+    return factures
 
 def generate_report_summary(start=None, end=None):
-    factures = load_invoices()
     config = utils.load_config() # S'assurer que la config est chargée pour la devise
     currency = config.get('currency', 'EUR')
-    if not factures:
-        return {
-            'count': 0,
-            'total_ht': 0.0,
-            'total_tva': 0.0,
-            'total_ttc': 0.0,
-            'currency': currency
-        }
-    df = pd.DataFrame(factures)
-    df['Date_dt'] = pd.to_datetime(df['Date'], format='%d/%m/%Y')
-    if start:
-        df = df[df['Date_dt'] >= pd.to_datetime(start)]
-    if end:
-        df = df[df['Date_dt'] <= pd.to_datetime(end)]
-    count = len(df)
-    total_ht  = df['Sous-total'].sum()
-    total_tva = df['TVA'].sum()
-    total_ttc = df['Total'].sum()
+    # Un total par devise, lu dans les cumuls journaliers d'invoice_daily ; les lignes
+    # importées sans devise sont comptées dans la devise configurée
+    grouped = {}
+    for code, t in invoice_store.summary_by_currency(start, end).items():
+        acc = grouped.setdefault(code or currency, {'count': 0, 'total_ht': 0, 'total_tva': 0, 'total_ttc': 0})
+        for key in acc:
+            acc[key] += t[key]
+    if not grouped:
+        grouped[currency] = {'count': 0, 'total_ht': 0, 'total_tva': 0, 'total_ttc': 0}
+    totals = []
+    for code in sorted(grouped, key=lambda c: (c != currency, c)):  # devise configurée d'abord
+        t = grouped[code]
+        totals.append({
+            'currency': code,
+            'count': int(t['count']),
+            'total_ht': float(t['total_ht']),
+            'total_tva': float(t['total_tva']),
+            'total_ttc': float(t['total_ttc']),
+            'average': float(t['total_ttc']) / t['count'] if t['count'] else 0.0,
+        })
     return {
-        'count': int(count),
-        'total_ht': float(total_ht),
-        'total_tva': float(total_tva),
-        'total_ttc': float(total_ttc),
-        'currency': currency
+        'count': sum(t['count'] for t in totals),
+        'currency': currency,
+        'totals': totals
     }
     
 def load_services():
-    # LISTS_FILE est statique, donc son chemin n'est pas affecté
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), LISTS_FILE)
-    if not os.path.exists(path):
-        return []
-
-    df = pd.read_excel(path, dtype=str)
-    df = df.fillna("")
-    return df.to_dict("records")
+    # Première feuille du catalogue, servie depuis le cache partagé
+    return catalogue.sheet_records()
    
 facturation_template = r"""
 <!DOCTYPE html>
@@ -1441,7 +1561,9 @@ facturation_template = r"""
                   <div class="d-flex justify-content-between align-items-center">
                     <div>
                       <p class="mb-0">Total TTC</p>
-                      <h3 id="totalTTCCard" class="text-success">{{ "%.2f"|format(report_summary.total_ttc) }} {{ report_summary.currency }}</h3>
+                      <h3 id="totalTTCCard" class="text-success">
+                        {% for t in report_summary.totals %}<div>{{ "%.2f"|format(t.total_ttc) }} {{ t.currency }}</div>{% endfor %}
+                      </h3>
                     </div>
                     <i class="fas fa-chart-line fa-3x text-success"></i>
                   </div>
@@ -1457,7 +1579,7 @@ facturation_template = r"""
                   <div class="d-flex justify-content-between align-items-center">
                     <div>
                       <h4 id="totalHTCard" class="text-info">
-                        {{ "%.2f"|format(report_summary.total_ht) }} {{ report_summary.currency }}
+                        {% for t in report_summary.totals %}<div>{{ "%.2f"|format(t.total_ht) }} {{ t.currency }}</div>{% endfor %}
                       </h4>
                       <span class="text-muted small">Hors taxes</span>
                     </div>
@@ -1474,7 +1596,7 @@ facturation_template = r"""
                   <div class="d-flex justify-content-between align-items-center">
                     <div>
                       <h4 id="totalTVACard" class="text-danger">
-                        {{ "%.2f"|format(report_summary.total_tva) }} {{ report_summary.currency }}
+                        {% for t in report_summary.totals %}<div>{{ "%.2f"|format(t.total_tva) }} {{ t.currency }}</div>{% endfor %}
                       </h4>
                       <span class="text-muted small">TVA collectée</span>
                     </div>
@@ -1491,8 +1613,7 @@ facturation_template = r"""
                   <div class="d-flex justify-content-between align-items-center">
                     <div>
                       <h4 id="averageCard" class="text-warning">
-                        {{ "%.2f"|format(report_summary.total_ttc / report_summary.count if report_summary.count else 0) }}
-                        {{ report_summary.currency }}
+                        {% for t in report_summary.totals %}<div>{{ "%.2f"|format(t.average) }} {{ t.currency }}</div>{% endfor %}
                       </h4>
                       <span class="text-muted small">Montant moyen</span>
                     </div>
@@ -1513,11 +1634,16 @@ facturation_template = r"""
                 <input type="date" class="form-control" id="endDate" placeholder=" ">
                 <label for="endDate">Date de fin</label>
               </div>
-              <div class="col-md-4">
+              <div class="col-md-2">
                 <button class="btn btn-primary w-100" onclick="updateReport()">
                   <i class="fas fa-sync me-2"></i>Actualiser
                 </button>
               </div>
+              <div class="col-md-2">
+                <button class="btn btn-outline-primary w-100" onclick="downloadArchive()">
+                  <i class="fas fa-file-archive me-2"></i>Archive ZIP
+                </button>
+              </div>
             </div>
           </div>
         </div>
@@ -1651,6 +1777,39 @@ document.querySelectorAll('.delete-invoice').forEach(btn => {
   });
 });
 
+// Live updates from other workstations (server-sent events)
+if (window.EventSource) {
+  const source = new EventSource('/events/stream');
+  source.addEventListener('invoice.deleted', ev => {
+    const d = JSON.parse(ev.data);
+    document.querySelectorAll('.delete-invoice').forEach(btn => {
+      if (btn.dataset.id === d.numero) btn.closest('tr').remove();
+    });
+  });
+  source.addEventListener('invoice.batch', ev => {
+    const d = JSON.parse(ev.data);
+    if (d.error) {
+      Swal.fire({toast: true, position: 'bottom-end', icon: 'error', timer: 8000,
+                 title: `Facturation groupée interrompue : ${d.error}`, showConfirmButton: false});
+    } else if (d.done < d.total) {
+      Swal.fire({toast: true, position: 'bottom-end', icon: 'info', timer: 4000,
+                 title: `Facturation groupée : ${d.done}/${d.total}`, showConfirmButton: false});
+    } else {
+      Swal.fire({toast: true, position: 'bottom-end', icon: 'success', timer: 8000,
+                 title: `${d.total} factures générées`,
+                 showConfirmButton: true, confirmButtonText: 'Actualiser'})
+        .then(r => { if (r.isConfirmed) location.reload(); });
+    }
+  });
+  source.addEventListener('invoice.created', ev => {
+    const d = JSON.parse(ev.data);
+    Swal.fire({toast: true, position: 'bottom-end', icon: 'info', timer: 8000,
+               title: `Nouvelle facture ${d.numero}`,
+               showConfirmButton: true, confirmButtonText: 'Actualiser'})
+      .then(r => { if (r.isConfirmed) location.reload(); });
+  });
+}
+
 // Export Excel (unchanged)
 function exportToExcel() {
   fetch('/facturation/export')
@@ -1666,6 +1825,13 @@ function exportToExcel() {
     });
 }
 
+// Archive ZIP of the period (streamed download, no blob in memory)
+function downloadArchive() {
+  const start = document.getElementById('startDate').value;
+  const end   = document.getElementById('endDate').value;
+  window.location.href = `/facturation/archive?from=${start}&to=${end}`;
+}
+
 // Update report
 function updateReport() {
   const start = document.getElementById('startDate').value;
@@ -1674,17 +1840,20 @@ function updateReport() {
   fetch(`/facturation/report?start=${start}&end=${end}`)
     .then(res => res.json())
     .then(data => {
-      document.getElementById('invoiceCount' ).textContent = data.count;
-      document.getElementById('totalHTCard' ).textContent = data.total_ht.toFixed(2)  + ' ' + data.currency;
-      document.getElementById('totalTVACard').textContent = data.total_tva.toFixed(2) + ' ' + data.currency;
-      document.getElementById('totalTTCCard').textContent = data.total_ttc.toFixed(2) + ' ' + data.currency;
-      document.getElementById('averageCard').textContent = data.average.toFixed(2)   + ' ' + data.currency;
+      // Une ligne par devise
+      const lines = (id, key) => document.getElementById(id).replaceChildren(...data.totals.map(t =>
+        Object.assign(document.createElement('div'), {textContent: t[key].toFixed(2) + ' ' + t.currency})));
+      document.getElementById('invoiceCount').textContent = data.count;
+      lines('totalHTCard', 'total_ht');
+      lines('totalTVACard', 'total_tva');
+      lines('totalTTCCard', 'total_ttc');
+      lines('averageCard', 'average');
     })
     .catch(() => Swal.fire({icon:'error', title:'Erreur', text:'Erreur lors de la mise à jour du rapport.'}));
 }
 
 // Last patient
-const patientsInfo = {{ patients_info|tojson }};
+const patientsInfo = {{ patients_json }};
 const selP = document.getElementById('patientSelect');
 if (selP) { // Check if element exists before adding listener
   selP.addEventListener('change', () => {
@@ -1708,7 +1877,7 @@ const totalTVAElem  = document.getElementById('totalTVA');
 const totalTTCElem  = document.getElementById('totalTTC');
 const datalist      = document.getElementById('serviceList');
 const cards         = document.querySelectorAll('.service-card');
-const servicesByCategory = {{ services_by_category|tojson }};
+const servicesByCategory = {{ services_json }};
 
 // VAT validation
 vatInput.addEventListener('change', () => {
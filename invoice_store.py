@@ -0,0 +1,558 @@
+# invoice_store.py
+
+"""
+Base SQLite des factures (database.db dans le dossier de l'administrateur)
+• Compteur de numéros de facture par jour : allocation atomique en O(1),
+  unique même entre requêtes et processus concurrents
+• Le compteur d'un jour est amorcé une seule fois depuis les PDF déjà présents
+  (factures créées avant l'introduction du compteur)
+• Registre des factures : colonnes typées (date ISO, montants en centimes exposés
+  en Decimal), ajout en O(1), suppression par pierre tombale purgée en arrière-plan
+• Un ancien Excel/factures.xlsx est importé automatiquement puis déplacé dans
+  Excel/backups ; l'export XLSX est produit à la demande
+• Totaux journaliers par devise (invoice_daily) tenus à jour dans la même transaction
+  que chaque création / suppression ; les rapports sur une période sont calculés
+  par sommes préfixes en O(log jours)
+• Facturation groupée (batch) : numéros réservés et factures inscrites dans une même
+  transaction, annulée en bloc si le lot échoue
+"""
+
+import io
+import os
+import re
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Optional
+
+import pandas as pd
+
+import utils
+import pdf_store
+from money import to_cents, from_cents
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_counters (
+    day  TEXT PRIMARY KEY,      -- AAAAMMJJ
+    seq  INTEGER NOT NULL       -- dernier numéro attribué ce jour-là
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    numero      TEXT PRIMARY KEY,
+    day         TEXT NOT NULL,              -- date ISO AAAA-MM-JJ
+    patient     TEXT NOT NULL DEFAULT '',
+    telephone   TEXT NOT NULL DEFAULT '',
+    services    TEXT NOT NULL DEFAULT '',
+    sous_total  INTEGER NOT NULL DEFAULT 0, -- montants en centimes
+    tva         INTEGER NOT NULL DEFAULT 0,
+    total       INTEGER NOT NULL DEFAULT 0,
+    deleted     INTEGER NOT NULL DEFAULT 0, -- pierre tombale, purgée par compact()
+    currency    TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS invoices_day ON invoices (day);
+CREATE TABLE IF NOT EXISTS invoice_daily (
+    day         TEXT NOT NULL,
+    currency    TEXT NOT NULL,
+    count       INTEGER NOT NULL DEFAULT 0,
+    sous_total  INTEGER NOT NULL DEFAULT 0,
+    tva         INTEGER NOT NULL DEFAULT 0,
+    total       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, currency)
+);
+CREATE TABLE IF NOT EXISTS ledger_meta (
+    key    TEXT PRIMARY KEY,
+    value  INTEGER NOT NULL     -- 'version' : incrémentée à chaque écriture du registre
+);
+"""
+
+# En-têtes historiques de factures.xlsx (export, statistiques, export administrateur)
+LEDGER_COLUMNS = ['Numero', 'Patient', 'Téléphone', 'Date', 'Services', 'Sous-total', 'TVA', 'Total']
+AMOUNT_COLUMNS = ('Sous-total', 'TVA', 'Total')
+LEGACY_FILENAME = "factures.xlsx"
+COMPACT_MIN_TOMBSTONES = 50
+
+_COMPACTING: set = set()            # bases en cours de compactage
+_COMPACT_LOCK = threading.Lock()
+_READY: set = set()                 # bases dont le schéma est à jour dans ce processus
+_PREFIX: dict = {}                  # base → (version, {devise: (jours, cumuls)})
+_PREFIX_LOCK = threading.Lock()
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Connexion en mode autocommit (transactions explicites), schéma créé au besoin."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    if db_path is None:
+        raise RuntimeError("SQLITE_DB_PATH not set. Call set_dynamic_base_dir first.")
+    if db_path in _READY and not os.path.exists(db_path):
+        _READY.discard(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if db_path not in _READY:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _upgrade_schema(conn, db_path)
+        _READY.add(db_path)
+    return conn
+
+def _upgrade_schema(conn: sqlite3.Connection, db_path: str):
+    """Bases créées avant les totaux journaliers : colonne devise et totaux recalculés."""
+    conn.execute("BEGIN IMMEDIATE")  # plusieurs workers peuvent ouvrir l'ancienne base en même temps
+    try:
+        cols = {row[1] for row in conn.execute("PRAGMA table_info(invoices)")}
+        if 'currency' not in cols:
+            conn.execute("ALTER TABLE invoices ADD COLUMN currency TEXT NOT NULL DEFAULT ''")
+            conn.execute("UPDATE invoices SET currency = ?", (_configured_currency(db_path),))
+        has_daily = conn.execute("SELECT 1 FROM invoice_daily LIMIT 1").fetchone()
+        has_invoices = conn.execute("SELECT 1 FROM invoices WHERE deleted = 0 LIMIT 1").fetchone()
+        if has_invoices and not has_daily:
+            conn.execute(
+                "INSERT INTO invoice_daily (day, currency, count, sous_total, tva, total)"
+                " SELECT day, currency, COUNT(*), SUM(sous_total), SUM(tva), SUM(total)"
+                " FROM invoices WHERE deleted = 0 GROUP BY day, currency")
+            _bump_version(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:  # BEGIN lui-même a pu échouer (base verrouillée)
+            conn.execute("ROLLBACK")
+        raise
+
+def _seed_from_pdfs(day: str, pdf_folder: Optional[str], db_path: Optional[str] = None) -> int:
+    """Plus grand numéro déjà utilisé ce jour-là parmi les PDF existants (dossier et archives)."""
+    if not pdf_folder or not os.path.isdir(pdf_folder):
+        return 0
+    pattern = re.compile(rf"^Facture_{day}-(\d+)\.pdf$")
+    names = os.listdir(pdf_folder)
+    names += pdf_store.archived_names("facture", f"{day[:4]}-{day[4:6]}-{day[6:]}", db_path)
+    found = [int(m.group(1)) for m in map(pattern.match, names) if m]
+    return max(found, default=0)
+
+def _format(day: str, seq: int) -> str:
+    return f"{day}-{seq:03d}"
+
+
+def next_invoice_number(date_str: str, db_path: Optional[str] = None,
+                        pdf_folder: Optional[str] = None) -> str:
+    """Attribue le prochain numéro 'AAAAMMJJ-NNN' pour la date 'AAAA-MM-JJ'."""
+    return next_invoice_numbers(date_str, 1, db_path, pdf_folder)[0]
+
+def next_invoice_numbers(date_str: str, count: int, db_path: Optional[str] = None,
+                         pdf_folder: Optional[str] = None) -> list:
+    """Réserve `count` numéros consécutifs pour la date, en une seule transaction."""
+    pdf_folder = pdf_folder or utils.PDF_FOLDER
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")  # verrou d'écriture : une seule allocation à la fois
+        numbers = _reserve(conn, date_str, count, pdf_folder, db_path)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return numbers
+
+def _reserve(conn: sqlite3.Connection, date_str: str, count: int,
+             pdf_folder: Optional[str], db_path: Optional[str]) -> list:
+    """Avance le compteur du jour (transaction ouverte par l'appelant)."""
+    day = date_str.replace('-', '')
+    row = conn.execute("SELECT seq FROM invoice_counters WHERE day = ?", (day,)).fetchone()
+    if row is None:
+        first = _seed_from_pdfs(day, pdf_folder, db_path) + 1
+        conn.execute("INSERT INTO invoice_counters (day, seq) VALUES (?, ?)", (day, first + count - 1))
+    else:
+        first = row[0] + 1
+        conn.execute("UPDATE invoice_counters SET seq = ? WHERE day = ?", (first + count - 1, day))
+    return [_format(day, seq) for seq in range(first, first + count)]
+
+def peek_invoice_number(date_str: str, db_path: Optional[str] = None,
+                        pdf_folder: Optional[str] = None) -> str:
+    """Numéro qui serait attribué maintenant (affichage du formulaire, sans réservation)."""
+    day = date_str.replace('-', '')
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT seq FROM invoice_counters WHERE day = ?", (day,)).fetchone()
+        if row is None:
+            # Amorçage du jour mémorisé : le dossier PDF n'est parcouru qu'une fois
+            last = _seed_from_pdfs(day, pdf_folder or utils.PDF_FOLDER, db_path)
+            conn.execute("INSERT OR IGNORE INTO invoice_counters (day, seq) VALUES (?, ?)", (day, last))
+            row = conn.execute("SELECT seq FROM invoice_counters WHERE day = ?", (day,)).fetchone()
+    finally:
+        conn.close()
+    return _format(day, row[0] + 1)
+
+
+# ---------------------------------------------------------------------------
+# Registre des factures
+# ---------------------------------------------------------------------------
+def _legacy_xlsx_path(db_path: str) -> str:
+    return os.path.join(os.path.dirname(db_path), "Excel", LEGACY_FILENAME)
+
+def _configured_currency(db_path: str) -> str:
+    """Devise du cabinet propriétaire de la base (Config/config.json à côté de database.db)."""
+    cfg = utils.load_config(os.path.join(os.path.dirname(db_path), "Config", "config.json"))
+    return cfg.get('currency', 'EUR')
+
+def _parse_day(value) -> Optional[str]:
+    ts = pd.to_datetime(str(value).strip(), errors='coerce', dayfirst='/' in str(value))
+    return None if pd.isna(ts) else ts.strftime('%Y-%m-%d')
+
+def _import_legacy_xlsx(conn: sqlite3.Connection, db_path: str):
+    """Importe un factures.xlsx (ancien format ou réimport) puis le range dans Excel/backups."""
+    xlsx = _legacy_xlsx_path(db_path)
+    if not os.path.exists(xlsx):
+        return
+    with utils.file_lock(xlsx):
+        if not os.path.exists(xlsx):  # importé entre-temps par un autre processus
+            return
+        df = pd.read_excel(xlsx, dtype={'Numero': str}).fillna('')
+        rows = []
+        for rec in df.to_dict('records'):
+            numero = str(rec.get('Numero', '')).strip()
+            day = _parse_day(rec.get('Date', ''))
+            if not numero or day is None:
+                print(f"WARNING: Facture ignorée lors de l'import de {LEGACY_FILENAME} : {rec}")
+                continue
+            try:
+                amounts = [to_cents(rec.get(col)) for col in AMOUNT_COLUMNS]
+            except ArithmeticError:
+                print(f"WARNING: Montants illisibles, facture {numero} importée à 0 : {rec}")
+                amounts = [0, 0, 0]
+            rows.append((numero, day, str(rec.get('Patient', '')), str(rec.get('Téléphone', '')),
+                         str(rec.get('Services', '')), *amounts))
+        currency = _configured_currency(db_path)
+        counts = {'ajoutées': 0, 'corrigées': 0, 'restaurées': 0}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for row in rows:
+                # Réimport d'un classeur corrigé : la ligne du registre est remplacée et
+                # les totaux journaliers ajustés (ancienne valeur retirée, nouvelle ajoutée)
+                old = conn.execute(
+                    "SELECT day, currency, sous_total, tva, total, deleted FROM invoices WHERE numero = ?",
+                    (row[0],)).fetchone()
+                if old is None:
+                    row_currency = currency
+                    conn.execute(
+                        "INSERT INTO invoices (numero, day, patient, telephone, services, sous_total, tva, total, currency)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (*row, row_currency))
+                    counts['ajoutées'] += 1
+                else:
+                    row_currency = old[1] or currency
+                    if old[5]:
+                        counts['restaurées'] += 1
+                    else:
+                        _add_to_daily(conn, old[0], old[1], -1, *old[2:5])
+                        counts['corrigées'] += 1
+                    conn.execute(
+                        "UPDATE invoices SET day = ?, patient = ?, telephone = ?, services = ?, sous_total = ?,"
+                        " tva = ?, total = ?, currency = ?, deleted = 0 WHERE numero = ?",
+                        (*row[1:], row_currency, row[0]))
+                _add_to_daily(conn, row[1], row_currency, 1, *row[5:8])
+            _bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        backup_dir = os.path.join(os.path.dirname(xlsx), "backups")
+        os.makedirs(backup_dir, exist_ok=True)
+        target = os.path.join(backup_dir, f"factures_importees_{datetime.now():%Y%m%d_%H%M%S}.xlsx")
+        os.replace(xlsx, target)
+        detail = ", ".join(f"{n} {label}" for label, n in counts.items())
+        print(f"DEBUG: Import de {LEGACY_FILENAME} : {detail} (original déplacé vers {target}).")
+
+def _ledger(db_path: Optional[str] = None) -> sqlite3.Connection:
+    db_path = db_path or utils.SQLITE_DB_PATH
+    conn = connect(db_path)
+    try:
+        _import_legacy_xlsx(conn, db_path)
+    except Exception as e:
+        print(f"ERROR: Import de {LEGACY_FILENAME} impossible : {e}")
+    return conn
+
+def _add_to_daily(conn: sqlite3.Connection, day: str, currency: str, sign: int,
+                  sous_total: int, tva: int, total: int):
+    conn.execute(
+        "INSERT INTO invoice_daily (day, currency, count, sous_total, tva, total) VALUES (?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (day, currency) DO UPDATE SET count = count + excluded.count,"
+        " sous_total = sous_total + excluded.sous_total, tva = tva + excluded.tva, total = total + excluded.total",
+        (day, currency, sign, sign * sous_total, sign * tva, sign * total))
+
+def _bump_version(conn: sqlite3.Connection):
+    conn.execute("INSERT INTO ledger_meta (key, value) VALUES ('version', 1)"
+                 " ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+def _where(start=None, end=None) -> tuple:
+    clauses, params = ["deleted = 0"], []
+    if start:
+        clauses.append("day >= ?")
+        params.append(str(start)[:10])
+    if end:
+        clauses.append("day <= ?")
+        params.append(str(end)[:10])
+    return " AND ".join(clauses), params
+
+def _row_to_record(row) -> dict:
+    numero, day, patient, telephone, services, sous_total, tva, total = row
+    return {
+        'Numero':     numero,
+        'Patient':    patient,
+        'Téléphone':  telephone,
+        'Date':       date.fromisoformat(day),
+        'Services':   services,
+        'Sous-total': from_cents(sous_total),
+        'TVA':        from_cents(tva),
+        'Total':      from_cents(total),
+    }
+
+
+def append_invoice(numero: str, day, patient: str, telephone: str, services: str,
+                   ht_cents: int, tva_cents: int, ttc_cents: int, currency: str = '',
+                   db_path: Optional[str] = None):
+    """Ajoute une facture au registre (une ligne insérée, totaux du jour mis à jour)."""
+    append_invoices([(numero, day, patient, telephone, services, ht_cents, tva_cents, ttc_cents, currency)],
+                    db_path)
+
+def append_invoices(rows: list, db_path: Optional[str] = None):
+    """
+    Ajoute plusieurs factures en une seule transaction : toutes ou aucune.
+    rows : tuples (numero, jour, patient, téléphone, services, HT, TVA, TTC, devise),
+    montants en centimes (int, voir money).
+    """
+    prepared = _prepare(rows)
+    conn = _ledger(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _insert(conn, prepared)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+def _prepare(rows: list) -> list:
+    prepared = []
+    for numero, day, patient, telephone, services, ht, tva, ttc, currency in rows:
+        day = day.isoformat() if isinstance(day, date) else _parse_day(day)
+        prepared.append((numero, day, patient or '', telephone or '', services or '',
+                         int(ht), int(tva), int(ttc), currency or ''))
+    return prepared
+
+def _insert(conn: sqlite3.Connection, prepared: list):
+    conn.executemany(
+        "INSERT INTO invoices (numero, day, patient, telephone, services, sous_total, tva, total, currency)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", prepared)
+    for row in prepared:
+        _add_to_daily(conn, row[1], row[8], 1, *row[5:8])
+    _bump_version(conn)
+
+
+class _InvoiceBatch:
+    """Lot ouvert par batch() : réservation des numéros et inscription au registre."""
+
+    def __init__(self, conn: sqlite3.Connection, db_path: str, pdf_folder: Optional[str]):
+        self._conn = conn
+        self._db_path = db_path
+        self._pdf_folder = pdf_folder
+
+    def reserve(self, date_str: str, count: int) -> list:
+        return _reserve(self._conn, date_str, count, self._pdf_folder, self._db_path)
+
+    def append(self, rows: list):
+        _insert(self._conn, _prepare(rows))
+
+@contextmanager
+def batch(db_path: Optional[str] = None, pdf_folder: Optional[str] = None):
+    """
+    Facturation groupée tout-ou-rien : les numéros réservés et les lignes ajoutées dans
+    le bloc sont validés ensemble à la sortie. Si le bloc lève une exception, les
+    compteurs reviennent en arrière : aucun numéro n'est consommé, la séquence reste
+    sans trou. Le verrou d'écriture est tenu pendant tout le bloc (les autres créations
+    de facture attendent, les lectures continuent grâce au WAL).
+    """
+    db_path = db_path or utils.SQLITE_DB_PATH
+    conn = _ledger(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield _InvoiceBatch(conn, db_path, pdf_folder or utils.PDF_FOLDER)
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+def delete_invoice(numero: str, db_path: Optional[str] = None) -> bool:
+    """Pose une pierre tombale sur la facture. Renvoie False si elle n'existe pas."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    conn = _ledger(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT day, currency, sous_total, tva, total FROM invoices WHERE numero = ? AND deleted = 0",
+                (numero,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE invoices SET deleted = 1 WHERE numero = ?", (numero,))
+                _add_to_daily(conn, row[0], row[1], -1, *row[2:])
+                _bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        tombstones = conn.execute("SELECT COUNT(*) FROM invoices WHERE deleted = 1").fetchone()[0]
+    finally:
+        conn.close()
+    if tombstones >= COMPACT_MIN_TOMBSTONES:
+        compact_in_background(db_path)
+    return row is not None
+
+def list_invoices(start=None, end=None, db_path: Optional[str] = None) -> list:
+    """Factures actives (date typée, montants Decimal), de la plus récente à la plus ancienne."""
+    where, params = _where(start, end)
+    conn = _ledger(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT numero, day, patient, telephone, services, sous_total, tva, total"
+            f" FROM invoices WHERE {where} ORDER BY day DESC, numero DESC", params).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_record(r) for r in rows]
+
+def iter_invoice_numbers(start=None, end=None, db_path: Optional[str] = None):
+    """Numéros des factures actives de la période, par date croissante, lus au fil du curseur."""
+    where, params = _where(start, end)
+    conn = _ledger(db_path)
+    try:
+        for (numero,) in conn.execute(
+                f"SELECT numero FROM invoices WHERE {where} ORDER BY day, numero", params):
+            yield numero
+    finally:
+        conn.close()
+
+def _prefix_sums(conn: sqlite3.Connection, db_path: str, currency: Optional[str]) -> tuple:
+    """
+    (jours triés, cumuls) pour une devise (None = toutes) : cumuls[i] = totaux
+    (nombre, HT, TVA, TTC) des jours[:i]. Reconstruit seulement si le registre a changé.
+    """
+    row = conn.execute("SELECT value FROM ledger_meta WHERE key = 'version'").fetchone()
+    version = row[0] if row else 0
+    with _PREFIX_LOCK:
+        entry = _PREFIX.get(db_path)
+        if entry is None or entry[0] != version:
+            entry = (version, {})
+            _PREFIX[db_path] = entry
+        sums = entry[1].get(currency)
+    if sums is not None:
+        return sums
+    where, params = ("WHERE currency = ?", [currency]) if currency is not None else ("", [])
+    rows = conn.execute(
+        "SELECT day, SUM(count), SUM(sous_total), SUM(tva), SUM(total) FROM invoice_daily"
+        f" {where} GROUP BY day HAVING SUM(count) != 0 ORDER BY day", params).fetchall()
+    days, cumul = [], [(0, 0, 0, 0)]
+    for day, *values in rows:
+        days.append(day)
+        cumul.append(tuple(a + b for a, b in zip(cumul[-1], values)))
+    sums = (days, cumul)
+    with _PREFIX_LOCK:
+        entry[1][currency] = sums
+    return sums
+
+def _range_totals(sums: tuple, start, end) -> dict:
+    days, cumul = sums
+    i = bisect_left(days, str(start)[:10]) if start else 0
+    j = bisect_right(days, str(end)[:10]) if end else len(days)
+    count, ht, tva, ttc = (b - a for a, b in zip(cumul[i], cumul[max(i, j)]))
+    return {'count': count, 'total_ht': from_cents(ht), 'total_tva': from_cents(tva), 'total_ttc': from_cents(ttc)}
+
+def summary(start=None, end=None, currency: Optional[str] = None,
+            db_path: Optional[str] = None) -> dict:
+    """Nombre de factures et totaux HT / TVA / TTC (Decimal) sur la période, toutes devises par défaut."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    conn = _ledger(db_path)
+    try:
+        sums = _prefix_sums(conn, db_path, currency)
+    finally:
+        conn.close()
+    return _range_totals(sums, start, end)
+
+def summary_by_currency(start=None, end=None, db_path: Optional[str] = None) -> dict:
+    """
+    Totaux de la période par devise : {devise: summary}. Les devises sans facture sur
+    la période sont omises ; '' regroupe les lignes importées sans devise.
+    """
+    db_path = db_path or utils.SQLITE_DB_PATH
+    conn = _ledger(db_path)
+    try:
+        currencies = [c for (c,) in conn.execute("SELECT DISTINCT currency FROM invoice_daily ORDER BY currency")]
+        totals = {c: _range_totals(_prefix_sums(conn, db_path, c), start, end) for c in currencies}
+    finally:
+        conn.close()
+    return {c: t for c, t in totals.items() if t['count']}
+
+def dataframe(start=None, end=None, db_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Registre en DataFrame (statistiques) : colonnes de factures.xlsx, Date ISO, montants
+    en centimes entiers int64 dans 'Sous-total_cents', 'TVA_cents', 'Total_cents'.
+    """
+    where, params = _where(start, end)
+    conn = _ledger(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT numero, patient, telephone, day, services, sous_total, tva, total"
+            f" FROM invoices WHERE {where} ORDER BY day DESC, numero DESC", params).fetchall()
+    finally:
+        conn.close()
+    df = pd.DataFrame(rows, columns=LEDGER_COLUMNS[:5] + [f"{col}_cents" for col in AMOUNT_COLUMNS])
+    return df.astype({f"{col}_cents": 'int64' for col in AMOUNT_COLUMNS})
+
+def export_xlsx(start=None, end=None, db_path: Optional[str] = None) -> bytes:
+    """Classeur XLSX des factures, généré en mémoire (dates Excel, montants numériques)."""
+    df = dataframe(start, end, db_path)
+    df['Date'] = pd.to_datetime(df['Date'])
+    for col in AMOUNT_COLUMNS:
+        df[col] = df.pop(f"{col}_cents") / 100  # unités, pour l'affichage dans Excel seulement
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine='xlsxwriter', datetime_format='dd/mm/yyyy') as writer:
+        df[LEDGER_COLUMNS].sort_values(['Date', 'Numero']).to_excel(writer, sheet_name='Factures', index=False)
+        writer.sheets['Factures'].set_column(0, len(LEDGER_COLUMNS) - 1, 16)
+    return buf.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Compactage des pierres tombales
+# ---------------------------------------------------------------------------
+def compact(db_path: Optional[str] = None) -> int:
+    """Purge les factures supprimées. Renvoie le nombre de lignes retirées."""
+    conn = connect(db_path or utils.SQLITE_DB_PATH)
+    try:
+        removed = conn.execute("DELETE FROM invoices WHERE deleted = 1").rowcount
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    print(f"DEBUG: Registre des factures compacté ({removed} pierres tombales purgées).")
+    return removed
+
+def compact_in_background(db_path: str):
+    """Lance compact() dans un thread démon (un seul compactage à la fois par base)."""
+    with _COMPACT_LOCK:
+        if db_path in _COMPACTING:
+            return
+        _COMPACTING.add(db_path)
+
+    def run():
+        try:
+            compact(db_path)
+        except Exception as e:
+            print(f"ERROR: Compactage du registre des factures impossible : {e}")
+        finally:
+            with _COMPACT_LOCK:
+                _COMPACTING.discard(db_path)
+
+    threading.Thread(target=run, name="invoice-ledger-compact", daemon=True).start()
@@ -0,0 +1,157 @@
+# invoice_template.py
+
+"""
+Gabarit des factures PDF, par cabinet
+• Couche statique (fond image, fond PDF et titre « Facture ») rendue une seule fois
+  puis conservée sous forme de Form XObject PDF
+• Invalidée dès que le fond choisi, son fichier ou la mise en page changent
+• Pour chaque facture, fpdf ne dessine que le contenu variable, posé ensuite sur le
+  gabarit (plus de décodage de l'image ni de copie profonde de la page de fond)
+• Le fond image est celui, déjà réduit en JPEG, de utils.background_image
+"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from fpdf import FPDF
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, NameObject
+
+import utils
+
+# Mise en page partagée par PDFInvoice et la couche statique
+PAGE_FORMAT = 'A5'
+LEFT_MARGIN, TOP_MARGIN, RIGHT_MARGIN = 20, 17, 20
+LAYOUT_VERSION = 2          # à incrémenter si draw_static_layer change
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+MAX_TEMPLATES = 16          # gabarits gardés en mémoire (tous cabinets confondus)
+FORM_NAME = NameObject('/TplStatic')
+
+_LOCK = threading.Lock()
+_TEMPLATES: "OrderedDict[tuple, InvoiceTemplate]" = OrderedDict()
+
+
+def new_page(pdf: FPDF):
+    """Marges et première page communes à la facture et à sa couche statique."""
+    pdf.set_left_margin(LEFT_MARGIN)
+    pdf.set_right_margin(RIGHT_MARGIN)
+    pdf.set_top_margin(TOP_MARGIN)
+    pdf.set_auto_page_break(auto=False)
+    pdf.add_page()
+
+def background_paths(app) -> tuple:
+    """
+    (fond image, fond PDF) à appliquer aux factures.
+    Le fond image vient du choix de la facturation (app.background_path) ou de la
+    configuration ; le fond PDF uniquement de la configuration (utils.background_file).
+    """
+    bg = getattr(app, 'background_path', None) or getattr(utils, 'background_file', None)
+    if bg and not os.path.isabs(bg):
+        if utils.BACKGROUND_FOLDER:
+            bg = os.path.join(utils.BACKGROUND_FOLDER, bg)
+        else:
+            print("WARNING: utils.BACKGROUND_FOLDER not set. Cannot load background image.")
+            bg = None
+    image_bg = bg if bg and os.path.isfile(bg) and bg.lower().endswith(IMAGE_EXTENSIONS) else None
+
+    pdf_bg = utils.background_file
+    if not (pdf_bg and os.path.exists(pdf_bg) and pdf_bg.lower().endswith('.pdf')):
+        pdf_bg = None
+    return image_bg, pdf_bg
+
+def draw_static_layer(pdf: FPDF, image_bg: Optional[str]):
+    """Fond image et titre ; laisse le curseur là où commence l'en-tête variable."""
+    bg = utils.background_image(image_bg, pdf.w_pt, pdf.h_pt) if image_bg else None
+    if bg is not None:
+        try:
+            pdf.image(io.BytesIO(bg.jpeg), x=0, y=0, w=pdf.w, h=pdf.h)
+        except Exception:
+            pass
+    pdf.set_font('Helvetica', 'B', 18)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(15)
+    pdf.cell(0, 8, 'Facture', align='C')
+    pdf.ln(8)
+
+def skip_static_layer(pdf: FPDF):
+    """Même déplacement du curseur que draw_static_layer, sans rien dessiner."""
+    pdf.ln(15)
+    pdf.ln(8)
+
+
+class InvoiceTemplate:
+    """Couche statique d'un cabinet, prête à être posée sous chaque facture."""
+
+    def __init__(self, layer_pdf: bytes):
+        page = PdfReader(io.BytesIO(layer_pdf)).pages[0]
+        # Copie entièrement résolue : les factures la clonent sans relire le PDF source,
+        # ce qui permet de partager le gabarit entre threads
+        self._holder = PdfWriter()
+        self._form = utils.page_to_form(page).clone(self._holder)
+        self.geometry = utils.page_geometry(page)
+
+    def apply(self, invoice_pdf: bytes) -> bytes:
+        """Pose le contenu variable (PDF produit par fpdf) sur le gabarit."""
+        writer = PdfWriter()
+        form_ref = self._form.clone(writer).indirect_reference
+        prefix = DecodedStreamObject()
+        prefix.set_data(b"q " + FORM_NAME.encode() + b" Do Q\n")
+        prefix_ref = writer._add_object(prefix)
+
+        for fg_page in PdfReader(io.BytesIO(invoice_pdf)).pages:
+            page = writer.add_page(fg_page)
+            utils.stamp_under(page, FORM_NAME, form_ref, prefix_ref)
+            utils.set_geometry(page, self.geometry)
+
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+
+def _render_layer(image_bg: Optional[str], pdf_bg: Optional[str]) -> bytes:
+    pdf = FPDF(orientation='P', unit='mm', format=PAGE_FORMAT)
+    new_page(pdf)
+    draw_static_layer(pdf, image_bg)
+    layer = bytes(pdf.output())
+    if not pdf_bg:
+        return layer
+    # Même superposition que utils.merge_with_background_pdf, faite une seule fois
+    bg_page = PdfReader(pdf_bg).pages[0]
+    bg_page.merge_page(PdfReader(io.BytesIO(layer)).pages[0])
+    writer = PdfWriter()
+    writer.add_page(bg_page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+def get_template(image_bg: Optional[str], pdf_bg: Optional[str]) -> Optional[InvoiceTemplate]:
+    """
+    Gabarit pour ce couple de fonds, rendu au premier appel puis réutilisé.
+    None sans fond (rien à mettre en cache) ou si le fond est illisible :
+    la facture est alors dessinée entièrement par fpdf.
+    """
+    if not image_bg and not pdf_bg:
+        return None
+    key = (image_bg, utils.file_stamp(image_bg) if image_bg else None,
+           pdf_bg, utils.file_stamp(pdf_bg) if pdf_bg else None,
+           PAGE_FORMAT, LAYOUT_VERSION)
+    with _LOCK:
+        template = _TEMPLATES.get(key)
+        if template is not None:
+            _TEMPLATES.move_to_end(key)
+            return template
+    try:
+        template = InvoiceTemplate(_render_layer(image_bg, pdf_bg))
+    except Exception as e:
+        print(f"ERROR: Gabarit de facture impossible ({image_bg}, {pdf_bg}): {e}")
+        return None
+    print(f"DEBUG: Gabarit de facture rendu pour {image_bg or pdf_bg}")
+    with _LOCK:
+        _TEMPLATES[key] = template
+        _TEMPLATES.move_to_end(key)
+        while len(_TEMPLATES) > MAX_TEMPLATES:
+            _TEMPLATES.popitem(last=False)
+    return template
@@ -0,0 +1,260 @@
+# jobs.py
+
+"""
+File de rendu des documents en arrière-plan, par administrateur (cabinet)
+• Les routes PDF appelées avec ?async=1 (ou l'en-tête « Prefer: respond-async »)
+  déposent un job et répondent aussitôt 202 + son id, sans bloquer de worker HTTP
+• Table jobs dans database.db du cabinet : l'état est visible depuis tous les
+  workers Gunicorn ; /jobs/<id> donne l'état, /jobs/<id>/download le document
+• Exécution dans un pool de threads du processus, au plus MAX_JOBS_PER_TENANT rendus
+  simultanés par cabinet : les jobs en trop attendent leur tour sans occuper de thread
+• Fin de chaque job annoncée par l'événement SSE « job.done » ; les résultats sont
+  supprimés après JOB_RESULT_TTL secondes
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from flask import Blueprint, current_app, jsonify, request, send_file, url_for
+
+import utils
+import events
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id             TEXT PRIMARY KEY,
+    kind           TEXT NOT NULL,              -- 'ordonnance', 'historique', ...
+    status         TEXT NOT NULL,              -- queued / running / done / empty / error
+    download_name  TEXT NOT NULL DEFAULT '',
+    mimetype       TEXT NOT NULL DEFAULT 'application/pdf',
+    result_path    TEXT,
+    message        TEXT NOT NULL DEFAULT '',
+    created        REAL NOT NULL,
+    started        REAL,
+    finished       REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+
+JOB_WORKERS = 4                 # threads de rendu par processus
+MAX_JOBS_PER_TENANT = 2         # rendus simultanés par cabinet (et par processus)
+JOB_RESULT_TTL = 3600           # secondes de conservation d'un résultat
+JOB_STALE_SECONDS = 900         # job jamais terminé (processus arrêté) : signalé en erreur
+RESULTS_DIRNAME = os.path.join("Cache", "Jobs")
+
+_READY: set = set()
+_LOCK = threading.Lock()
+_POOL: Optional[ThreadPoolExecutor] = None
+_RUNNING: dict = {}             # cabinet → nombre de jobs en cours dans ce processus
+_WAITING: dict = {}             # cabinet → deque de jobs en attente d'un créneau
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Connexion en mode autocommit, schéma créé au besoin (comme invoice_store)."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    if db_path is None:
+        raise RuntimeError("SQLITE_DB_PATH not set. Call set_dynamic_base_dir first.")
+    if db_path in _READY and not os.path.exists(db_path):
+        _READY.discard(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if db_path not in _READY:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _READY.add(db_path)
+    return conn
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="render-job")
+        return _POOL
+
+def wants_async() -> bool:
+    """La requête demande un rendu en arrière-plan."""
+    return request.args.get("async") == "1" or "respond-async" in request.headers.get("Prefer", "")
+
+
+# ---------------------------------------------------------------------------
+# Dépôt et exécution
+# ---------------------------------------------------------------------------
+def submit(kind: str, produce, download_name: str, mimetype: str = "application/pdf",
+           empty_message="") -> str:
+    """
+    Dépose un job pour le cabinet de la session et renvoie son id.
+    produce() s'exécute dans un thread de rendu, pendant que d'autres requêtes (d'autres
+    cabinets) repositionnent les globales de utils : il ne doit utiliser que des chemins
+    figés par la requête (utils.tenant_context()). Il renvoie les octets du document, le chemin d'un fichier (copié : un fichier du
+    cache peut être évincé avant le téléchargement) ou None s'il n'y a rien à produire
+    (le job se termine alors à l'état 'empty' avec empty_message, texte ou fonction
+    appelée à ce moment-là pour préciser la cause).
+    """
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "produce": produce,
+        "empty_message": empty_message,
+        "base_dir": utils.DYNAMIC_BASE_DIR,
+        "db_path": utils.SQLITE_DB_PATH,
+        "app": current_app._get_current_object(),
+    }
+    conn = connect(job["db_path"])
+    try:
+        _purge(conn, job["base_dir"])
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, download_name, mimetype, created)"
+            " VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job["id"], kind, download_name, mimetype, time.time()))
+    finally:
+        conn.close()
+
+    tenant = job["base_dir"]
+    with _LOCK:
+        if _RUNNING.get(tenant, 0) < MAX_JOBS_PER_TENANT:
+            _RUNNING[tenant] = _RUNNING.get(tenant, 0) + 1
+            start = True
+        else:
+            _WAITING.setdefault(tenant, deque()).append(job)
+            start = False
+    if start:
+        _pool().submit(_run, job)
+    print(f"DEBUG: Job {kind} {job['id']} déposé ({'démarré' if start else 'en attente'})")
+    return job["id"]
+
+def _run(job: dict):
+    conn = connect(job["db_path"])
+    status, result_path, message = "error", None, ""
+    claimed = False
+    try:
+        # Un job resté trop longtemps en file a pu être déclaré interrompu (get) : on ne le rend plus
+        claimed = conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                               (time.time(), job["id"])).rowcount > 0
+        if not claimed:
+            print(f"WARNING: Job {job['kind']} {job['id']} abandonné avant son démarrage")
+            return
+        with job["app"].app_context():
+            result = job["produce"]()
+        if result is None:
+            empty = job["empty_message"]
+            status, message = "empty", empty() if callable(empty) else empty
+        else:
+            folder = os.path.join(job["base_dir"], RESULTS_DIRNAME)
+            os.makedirs(folder, exist_ok=True)
+            result_path = os.path.join(folder, job["id"])
+            if isinstance(result, (bytes, bytearray)):
+                utils.write_file_atomic(result_path, bytes(result))
+            else:
+                shutil.copyfile(result, result_path)
+            status = "done"
+    except Exception as e:
+        print(f"ERROR: Job {job['kind']} {job['id']} en échec : {e}")
+        message = str(e)
+    finally:
+        try:
+            if claimed:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, result_path = ?, message = ?, finished = ?"
+                    " WHERE id = ? AND status = 'running'",
+                    (status, result_path, message, time.time(), job["id"]))
+        finally:
+            conn.close()
+        if claimed:
+            events.publish("job.done", {"id": job["id"], "kind": job["kind"], "status": status},
+                           base_dir=job["base_dir"])
+        _release(job["base_dir"])
+
+def _release(tenant: str):
+    """Libère le créneau du cabinet et démarre son job suivant, s'il y en a un."""
+    with _LOCK:
+        waiting = _WAITING.get(tenant)
+        if waiting:
+            nxt = waiting.popleft()
+        else:
+            nxt = None
+            _RUNNING[tenant] = max(0, _RUNNING.get(tenant, 1) - 1)
+    if nxt is not None:
+        _pool().submit(_run, nxt)
+
+def _purge(conn: sqlite3.Connection, base_dir: str):
+    """Supprime les jobs terminés depuis plus de JOB_RESULT_TTL, et leurs fichiers."""
+    limit = time.time() - JOB_RESULT_TTL
+    old = conn.execute("SELECT id, result_path FROM jobs WHERE finished < ?", (limit,)).fetchall()
+    for _, path in old:
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    if old:
+        conn.execute("DELETE FROM jobs WHERE finished < ?", (limit,))
+
+
+# ---------------------------------------------------------------------------
+# Consultation
+# ---------------------------------------------------------------------------
+def _is_stale(job: dict) -> bool:
+    """Rendu en cours depuis plus de JOB_STALE_SECONDS, ou en file sans processus pour le lancer."""
+    if job["status"] == "running":
+        return time.time() - (job["started"] or job["created"]) > JOB_STALE_SECONDS
+    if job["status"] != "queued" or time.time() - job["created"] <= JOB_STALE_SECONDS:
+        return False
+    with _LOCK:  # encore en attente d'un créneau dans ce processus : il démarrera
+        return not any(w["id"] == job["id"] for waiting in _WAITING.values() for w in waiting)
+
+def get(job_id: str, db_path: Optional[str] = None) -> Optional[dict]:
+    conn = connect(db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if _is_stale(job):
+            # Processus arrêté avant la fin du rendu : le job ne se terminera plus
+            job.update(status="error", message="Rendu interrompu", finished=time.time())
+            conn.execute("UPDATE jobs SET status = ?, message = ?, finished = ? WHERE id = ? AND status = ?",
+                         (job["status"], job["message"], job["finished"], job_id, row["status"]))
+        return job
+    finally:
+        conn.close()
+
+def accepted(job_id: str):
+    """Réponse 202 d'une route PDF appelée en mode asynchrone."""
+    body = {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for("jobs.job_status", job_id=job_id),
+        "download_url": url_for("jobs.job_download", job_id=job_id),
+    }
+    return jsonify(body), 202, {"Location": body["status_url"]}
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get(job_id)
+    if job is None:
+        return jsonify({"error": "Job introuvable"}), 404
+    body = {"job_id": job_id, "kind": job["kind"], "status": job["status"], "message": job["message"]}
+    if job["status"] == "done":
+        body["download_url"] = url_for("jobs.job_download", job_id=job_id)
+    return jsonify(body)
+
+@jobs_bp.route("/<job_id>/download", methods=["GET"])
+def job_download(job_id):
+    job = get(job_id)
+    if job is None:
+        return jsonify({"error": "Job introuvable"}), 404
+    if job["status"] != "done":
+        return jsonify({"job_id": job_id, "status": job["status"], "message": job["message"]}), 409
+    if not job["result_path"] or not os.path.exists(job["result_path"]):
+        return jsonify({"error": "Résultat expiré"}), 410
+    return send_file(job["result_path"], mimetype=job["mimetype"], as_attachment=True,
+                     download_name=job["download_name"])
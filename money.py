@@ -0,0 +1,94 @@
+# money.py
+
+"""
+Montants en virgule fixe : un montant est un int de centimes
+• De la saisie des services au registre et aux statistiques, plus aucun float
+  intermédiaire (pas de dérive sur les totaux mensuels)
+• Conversion unique depuis les saisies : float, Decimal, texte « 1 234,50 MAD »
+• TVA arrondie au centime (demi vers le haut), comme le registre
+• Colonnes pandas converties en int64 de façon vectorisée : sommes et regroupements
+  en arithmétique entière
+"""
+
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+_UNIT = Decimal('1')
+_NOT_AMOUNT = re.compile(r"[^\d,.\-]")           # devise, espaces, insécables…
+_THOUSANDS = r"[,.](?=.*[,.])"                   # tout séparateur suivi d'un autre
+
+
+def _clean(text: str) -> str:
+    """Le dernier ',' ou '.' est le séparateur décimal, les précédents des milliers."""
+    text = _NOT_AMOUNT.sub("", text)
+    return re.sub(_THOUSANDS, "", text).replace(",", ".")
+
+def parse_cents(value) -> int:
+    """Montant saisi → centimes. ValueError si la valeur n'est pas un montant."""
+    if isinstance(value, bool):
+        raise ValueError(f"Montant invalide : {value!r}")
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        if value != value:  # NaN
+            raise ValueError("Montant invalide : NaN")
+        amount = Decimal(repr(value))
+    elif isinstance(value, Decimal):
+        amount = value
+    else:
+        text = _clean(str(value))
+        try:
+            amount = Decimal(text)
+        except InvalidOperation:
+            raise ValueError(f"Montant invalide : {value!r}") from None
+    return int((amount * 100).quantize(_UNIT, rounding=ROUND_HALF_UP))
+
+def to_cents(value) -> int:
+    """Comme parse_cents, mais 0 pour une valeur vide ou illisible (anciens classeurs)."""
+    if value is None:
+        return 0
+    try:
+        return parse_cents(value)
+    except ValueError:
+        return 0
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(int(cents or 0)) / 100
+
+def fmt(cents: int) -> str:
+    """Centimes → '1234.50' (affichage PDF et libellés du registre)."""
+    return f"{from_cents(cents):.2f}"
+
+def vat_cents(ht_cents: int, rate) -> int:
+    """TVA au taux `rate` (%), arrondie au centime."""
+    amount = Decimal(int(ht_cents)) * Decimal(str(rate)) / 100
+    return int(amount.quantize(_UNIT, rounding=ROUND_HALF_UP))
+
+def invoice_totals(prices_cents, rate) -> tuple:
+    """(HT, TVA, TTC) en centimes pour des prix de services en centimes."""
+    ht = sum(int(p) for p in prices_cents)
+    tva = vat_cents(ht, rate)
+    return ht, tva, ht + tva
+
+def cents_series(series: pd.Series) -> pd.Series:
+    """
+    Colonne de montants (float, int en unités, ou texte d'un ancien classeur) → int64
+    de centimes, sans boucle Python. Les valeurs illisibles comptent pour 0.
+    """
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype('int64') * 100
+    if pd.api.types.is_numeric_dtype(series):
+        values = series.astype('float64')
+    else:
+        text = (series.astype(str)
+                .str.replace(_NOT_AMOUNT.pattern, "", regex=True)
+                .str.replace(_THOUSANDS, "", regex=True)
+                .str.replace(",", ".", regex=False))
+        values = pd.to_numeric(text, errors="coerce")
+    values = values.fillna(0.0)
+    # Arrondi demi vers le haut (en valeur absolue), comme vat_cents
+    cents = np.sign(values) * np.floor(np.abs(values) * 100 + 0.5)
+    return cents.astype('int64')
@@ -0,0 +1,265 @@
+# patient_store.py
+
+"""
+Registre des patients (info_Base_patient.xlsx) par administrateur
+• Index en mémoire ID → fiche, relu uniquement quand le classeur ou le journal change
+• upsert() : une ligne JSON ajoutée au journal, sans relire ni réécrire le classeur
+• Compactage : le journal est fusionné dans le classeur quand il dépasse la moitié du
+  nombre de patients, ce qui garde un coût amorti O(1) par écriture
+• Sauvegardes : rotation bornée dans Excel/backups avant chaque réécriture du classeur
+• Les lecteurs qui ouvrent directement le classeur (statistiques, export admin)
+  appellent flush() avant lecture
+"""
+
+import io
+import os
+import json
+import shutil
+import threading
+from typing import Optional
+
+import pandas as pd
+
+import utils
+
+PATIENT_COLUMNS = [
+    "ID", "Nom", "Prenom", "DateNaissance", "Sexe", "Âge",
+    "Antécédents", "Téléphone"
+]
+
+BACKUP_DIRNAME = "backups"
+BACKUP_KEEP = 5               # nombre de sauvegardes conservées
+JOURNAL_MIN_ENTRIES = 50      # pas de compactage en dessous de ce nombre d'entrées
+
+_LOCK = threading.RLock()
+_INDEXES: dict = {}           # chemin du classeur → _PatientIndex
+
+
+class _PatientIndex:
+    def __init__(self):
+        self.records = {}         # ID → fiche (colonnes PATIENT_COLUMNS)
+        self.xlsx_stamp = None    # empreinte du classeur chargé
+        self.journal_offset = 0   # octets du journal déjà rejoués
+        self.journal_entries = 0  # entrées du journal non encore compactées
+        self.journal_stale = False  # journal écrit pour une autre version du classeur
+
+
+def _base_path(path: Optional[str] = None) -> Optional[str]:
+    return str(path) if path else utils.PATIENT_BASE_FILE
+
+def _journal_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".journal.jsonl"
+
+def _normalize(record: dict) -> dict:
+    return {col: str(record.get(col, "") or "").strip() for col in PATIENT_COLUMNS}
+
+def _write_xlsx(path: str, records: dict):
+    # Fichier temporaire puis os.replace : un lecteur ne voit jamais de classeur à moitié écrit
+    buf = io.BytesIO()
+    pd.DataFrame(list(records.values()), columns=PATIENT_COLUMNS).to_excel(buf, index=False)
+    utils.write_file_atomic(path, buf.getvalue())
+
+def _write_journal_header(path: str):
+    """Le journal commence par l'empreinte du classeur sur lequel il s'applique."""
+    header = json.dumps({"_base": list(utils.file_stamp(path))}) + "\n"
+    utils.write_file_atomic(_journal_path(path), header.encode("utf-8"))
+
+def _journal_base(path: str) -> Optional[tuple]:
+    """Empreinte du classeur inscrite en tête du journal (None si absente ou illisible)."""
+    try:
+        with open(_journal_path(path), "rb") as fh:
+            return tuple(json.loads(fh.readline().decode("utf-8"))["_base"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _rebuild(path: str) -> _PatientIndex:
+    """Chargement à froid : lecture colonnaire du classeur puis rejeu du journal."""
+    idx = _PatientIndex()
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_xlsx(path, {})
+    df = pd.read_excel(path, dtype=str).fillna("")
+    df = df.reindex(columns=PATIENT_COLUMNS, fill_value="")
+    for rec in df.to_dict("records"):
+        rec = _normalize(rec)
+        if rec["ID"]:
+            idx.records.pop(rec["ID"], None)  # la dernière occurrence d'un ID l'emporte
+            idx.records[rec["ID"]] = rec
+    idx.xlsx_stamp = utils.file_stamp(path)
+    return idx
+
+def _replay_journal(path: str, idx: _PatientIndex) -> bool:
+    """
+    Rejoue les entrées du journal ajoutées depuis la dernière lecture.
+    Renvoie False si le journal ne correspond plus au classeur (réimport, compactage ailleurs).
+    """
+    jpath = _journal_path(path)
+    if not os.path.exists(jpath):
+        return idx.journal_offset == 0
+    if os.path.getsize(jpath) < idx.journal_offset:
+        return False
+    with open(jpath, "rb") as fh:
+        fh.seek(idx.journal_offset)
+        chunk = fh.read()
+    consumed = chunk.rfind(b"\n") + 1  # seules les lignes complètes sont rejouées
+    for line in chunk[:consumed].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            # Ligne tronquée (écriture interrompue) ou corrompue : ignorée, les suivantes
+            # restent valables ; la fiche concernée reste celle du classeur
+            print(f"ERROR: Ligne illisible ignorée dans {os.path.basename(jpath)} : {e}")
+            continue
+        if not isinstance(entry, dict):
+            print(f"ERROR: Entrée inattendue ignorée dans {os.path.basename(jpath)} : {entry!r}")
+            continue
+        if "_base" in entry:
+            if tuple(entry["_base"]) != idx.xlsx_stamp:
+                # Journal écrit pour une autre version du classeur (fichier réimporté) :
+                # il est obsolète, on l'ignore jusqu'à la prochaine écriture.
+                idx.journal_offset = os.path.getsize(jpath)
+                idx.journal_entries = 0
+                idx.journal_stale = True
+                return True
+            continue
+        rec = _normalize(entry)
+        if not rec["ID"]:
+            continue
+        idx.records.pop(rec["ID"], None)
+        idx.records[rec["ID"]] = rec
+        idx.journal_entries += 1
+    idx.journal_offset += consumed
+    return True
+
+def _index(path: Optional[str] = None) -> Optional[_PatientIndex]:
+    """Index à jour pour le classeur donné (par défaut celui de l'administrateur courant)."""
+    path = _base_path(path)
+    if path is None:
+        print("ERROR: PATIENT_BASE_FILE not set. Call set_dynamic_base_dir first.")
+        return None
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)  # le verrou est créé à côté
+    # Sous le verrou fichier : classeur et en-tête du journal sont lus dans le même état
+    # que celui laissé par l'écrivain (compactage d'un autre worker terminé ou pas commencé)
+    with _LOCK, utils.file_lock(path):
+        return _refresh(path)
+
+def _refresh(path: str) -> _PatientIndex:
+    """Met l'index à jour ; l'appelant détient _LOCK et utils.file_lock(path)."""
+    idx = _INDEXES.get(path)
+    if idx is None or idx.xlsx_stamp != utils.file_stamp(path):
+        idx = _rebuild(path)
+    elif idx.journal_stale and _journal_base(path) == idx.xlsx_stamp:
+        # Un autre worker a réécrit l'en-tête (et peut-être ajouté des entrées) depuis
+        idx = _rebuild(path)
+    if not _replay_journal(path, idx):
+        idx = _rebuild(path)
+        _replay_journal(path, idx)
+    _INDEXES[path] = idx
+    return idx
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+def get(pid: str, path: Optional[str] = None) -> Optional[dict]:
+    idx = _index(path)
+    return idx.records.get(str(pid).strip()) if idx else None
+
+def records(path: Optional[str] = None) -> list:
+    """Fiches patients dans l'ordre du classeur (ne pas modifier les dictionnaires renvoyés)."""
+    idx = _index(path)
+    return list(idx.records.values()) if idx else []
+
+def dataframe(path: Optional[str] = None) -> pd.DataFrame:
+    return pd.DataFrame(records(path), columns=PATIENT_COLUMNS)
+
+def version(path: Optional[str] = None) -> Optional[tuple]:
+    """Identifiant de version des données (change à chaque écriture, dans tout processus)."""
+    idx = _index(path)
+    return (idx.xlsx_stamp, idx.journal_offset) if idx else None
+
+
+# ---------------------------------------------------------------------------
+# Écriture
+# ---------------------------------------------------------------------------
+def upsert(record: dict, path: Optional[str] = None) -> bool:
+    """
+    Ajoute ou met à jour une fiche par ID. Renvoie False si la fiche est identique
+    à celle déjà enregistrée (aucune écriture).
+    """
+    rec = _normalize(record)
+    if not rec["ID"]:
+        raise ValueError("ID patient manquant")
+    path = _base_path(path)
+    if path is None:
+        print("ERROR: PATIENT_BASE_FILE not set. Cannot save patient.")
+        return False
+    with _LOCK, utils.file_lock(path):
+        idx = _refresh(path)
+        if idx.records.get(rec["ID"]) == rec:
+            return False
+        jpath = _journal_path(path)
+        if idx.journal_stale or not os.path.exists(jpath):
+            _write_journal_header(path)
+            idx.journal_offset = os.path.getsize(jpath)
+            idx.journal_entries = 0
+            idx.journal_stale = False
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(jpath, "ab") as fh:
+            if os.path.getsize(jpath) > idx.journal_offset:
+                # Fin de ligne tronquée (processus arrêté pendant un ajout) : on la termine
+                # pour que cette entrée ne soit pas collée à elle et reste lisible
+                fh.write(b"\n")
+            fh.write(line)
+        idx.journal_offset = os.path.getsize(jpath)
+        idx.journal_entries += 1
+        idx.records.pop(rec["ID"], None)
+        idx.records[rec["ID"]] = rec
+        if idx.journal_entries > max(JOURNAL_MIN_ENTRIES, len(idx.records) // 2):
+            _compact(path, idx)
+    return True
+
+def flush(path: Optional[str] = None):
+    """Fusionne le journal dans le classeur (avant une lecture directe du fichier Excel)."""
+    path = _base_path(path)
+    if path is None or not os.path.exists(_journal_path(path)):
+        return
+    with _LOCK, utils.file_lock(path):
+        idx = _refresh(path)
+        if idx.journal_entries:
+            _compact(path, idx)
+
+def _compact(path: str, idx: _PatientIndex):
+    rotate_backups(path)
+    _write_xlsx(path, idx.records)
+    idx.xlsx_stamp = utils.file_stamp(path)
+    _write_journal_header(path)
+    idx.journal_offset = os.path.getsize(_journal_path(path))
+    idx.journal_entries = 0
+    idx.journal_stale = False
+    print(f"DEBUG: Journal patient compacté dans {os.path.basename(path)} ({len(idx.records)} patients).")
+
+def rotate_backups(path: Optional[str] = None, keep: int = BACKUP_KEEP):
+    """
+    Copie le classeur dans Excel/backups/ en rotation bornée :
+    backup_info_Base_patient.1.xlsx (le plus récent) … .<keep>.xlsx (le plus ancien).
+    """
+    path = _base_path(path)
+    if path is None or not os.path.exists(path):
+        return
+    folder = os.path.join(os.path.dirname(path), BACKUP_DIRNAME)
+    os.makedirs(folder, exist_ok=True)
+    stem = "backup_" + os.path.splitext(os.path.basename(path))[0]
+
+    def slot(n: int) -> str:
+        return os.path.join(folder, f"{stem}.{n}.xlsx")
+
+    if os.path.exists(slot(keep)):
+        os.remove(slot(keep))
+    for n in range(keep - 1, 0, -1):
+        if os.path.exists(slot(n)):
+            os.replace(slot(n), slot(n + 1))
+    shutil.copy2(path, slot(1))
@@ -0,0 +1,397 @@
+# pdf_store.py
+
+"""
+Catalogue et rétention des PDF générés (dossier PDF de l'administrateur)
+• Table documents dans database.db : nom, type, patient, date, taille, archive ;
+  chaque PDF écrit y est inscrit, les fichiers plus anciens sont indexés au premier entretien
+• Documents régénérables (ordonnances, historiques, plannings RDV) supprimés après
+  « pdf_retention_days » jours (configuration, RETENTION_DAYS par défaut, 0 = jamais)
+• Factures jamais supprimées : celles des mois clos depuis plus de « invoice_archive_months »
+  mois sont rangées dans PDF/Archives/Factures_AAAA-MM.zip (compressé) et restent
+  téléchargeables ; le dossier PDF ne garde ainsi que les documents récents
+• Entretien au plus une fois par jour et par cabinet, dans un thread démon
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import zipfile
+from datetime import date, datetime, timedelta
+from typing import Optional, Union
+
+import utils
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name     TEXT PRIMARY KEY,          -- nom du fichier dans le dossier PDF
+    kind     TEXT NOT NULL,             -- facture / ordonnance / historique / planning / autre
+    patient  TEXT NOT NULL DEFAULT '',
+    day      TEXT NOT NULL,             -- date ISO AAAA-MM-JJ du document
+    size     INTEGER NOT NULL DEFAULT 0,
+    archive  TEXT                       -- archive mensuelle qui le contient, NULL s'il est dans le dossier
+);
+CREATE INDEX IF NOT EXISTS documents_kind_day ON documents (kind, day);
+CREATE TABLE IF NOT EXISTS documents_meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT NOT NULL        -- 'last_maintenance' : date ISO du dernier entretien
+);
+"""
+
+RETENTION_DAYS = 90             # conservation par défaut des documents régénérables
+INVOICE_ARCHIVE_MONTHS = 3      # mois clos gardés en clair dans le dossier PDF
+ARCHIVE_DIRNAME = "Archives"
+REGENERABLE_KINDS = ("ordonnance", "historique", "planning")
+
+# Nom de fichier → (type, groupes donnant la date)
+_NAME_PATTERNS = [
+    ("facture",    re.compile(r"^Facture_(\d{4})(\d{2})(\d{2})-\d+\.pdf$")),
+    ("ordonnance", re.compile(r"^Ordonnance_(\d{4})(\d{2})(\d{2})\d{6}(?:_\w+)?\.pdf$")),
+    ("historique", re.compile(r"^Historique_(\d{4})(\d{2})(\d{2})\d{6}(?:_\w+)?\.pdf$")),
+    ("planning",   re.compile(r"^RDV_du_(\d{2})(\d{2})(\d{4})\.pdf$")),
+]
+
+_READY: set = set()
+_LOCK = threading.Lock()
+_MAINTAINED: dict = {}          # base → date ISO du dernier entretien lancé par ce processus
+_RUNNING: set = set()           # bases en cours d'entretien
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Connexion en mode autocommit, schéma créé au besoin (comme invoice_store)."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    if db_path is None:
+        raise RuntimeError("SQLITE_DB_PATH not set. Call set_dynamic_base_dir first.")
+    if db_path in _READY and not os.path.exists(db_path):
+        _READY.discard(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if db_path not in _READY:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _READY.add(db_path)
+    return conn
+
+def classify(name: str, mtime: Optional[float] = None) -> tuple:
+    """(type, date ISO) d'un PDF d'après son nom ; date de modification à défaut."""
+    for kind, pattern in _NAME_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            parts = m.groups()
+            if kind == "planning":  # RDV_du_JJMMAAAA
+                parts = parts[::-1]
+            try:
+                return kind, date(*map(int, parts)).isoformat()
+            except ValueError:
+                break
+    day = datetime.fromtimestamp(mtime).date() if mtime is not None else date.today()
+    return "autre", day.isoformat()
+
+def archive_name(day: str) -> str:
+    return f"Factures_{day[:7]}.zip"
+
+
+# ---------------------------------------------------------------------------
+# Inscription et accès
+# ---------------------------------------------------------------------------
+def record(path: str, patient: str = "", db_path: Optional[str] = None,
+           config_file: Optional[str] = None):
+    """
+    Inscrit (ou met à jour) un PDF qui vient d'être écrit dans le dossier PDF,
+    puis lance l'entretien du jour s'il n'a pas encore eu lieu. Hors requête (jobs.py),
+    db_path et config_file désignent le cabinet du document.
+    """
+    db_path = db_path or utils.SQLITE_DB_PATH
+    st = os.stat(path)
+    name = os.path.basename(path)
+    kind, day = classify(name, st.st_mtime)
+    conn = connect(db_path)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (name, kind, patient, day, size, archive)"
+            " VALUES (?, ?, ?, ?, ?, NULL)", (name, kind, patient or "", day, st.st_size))
+    finally:
+        conn.close()
+    _maintain_if_due(os.path.dirname(path), db_path, config_file)
+
+def record_many(paths, patients=None, db_path: Optional[str] = None):
+    """record() pour un lot (facturation groupée), en une transaction."""
+    db_path = db_path or utils.SQLITE_DB_PATH
+    patients = patients or [""] * len(paths)
+    rows = []
+    for path, patient in zip(paths, patients):
+        st = os.stat(path)
+        name = os.path.basename(path)
+        kind, day = classify(name, st.st_mtime)
+        rows.append((name, kind, patient or "", day, st.st_size))
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR REPLACE INTO documents (name, kind, patient, day, size, archive)"
+            " VALUES (?, ?, ?, ?, ?, NULL)", rows)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:  # BEGIN lui-même a pu échouer (base verrouillée)
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    if paths:
+        _maintain_if_due(os.path.dirname(paths[0]), db_path)
+
+def _maintain_if_due(pdf_folder: str, db_path: str, config_file: Optional[str] = None):
+    cfg = utils.load_config(config_file)
+    maintain_in_background(pdf_folder, db_path,
+                           cfg.get("pdf_retention_days", RETENTION_DAYS),
+                           cfg.get("invoice_archive_months", INVOICE_ARCHIVE_MONTHS))
+
+def document(name: str, pdf_folder: Optional[str] = None,
+             db_path: Optional[str] = None) -> Union[str, bytes, None]:
+    """Chemin du PDF s'il est dans le dossier, son contenu s'il est archivé, None sinon."""
+    pdf_folder = pdf_folder or utils.PDF_FOLDER
+    path = os.path.join(pdf_folder, name)
+    if os.path.isfile(path):
+        return path
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT archive FROM documents WHERE name = ?", (name,)).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0]:
+        return None
+    try:
+        with zipfile.ZipFile(os.path.join(pdf_folder, ARCHIVE_DIRNAME, row[0])) as zf:
+            return zf.read(name)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        print(f"ERROR: {name} introuvable dans l'archive {row[0]} : {e}")
+        return None
+
+def forget(name: str, pdf_folder: Optional[str] = None, db_path: Optional[str] = None) -> bool:
+    """
+    Supprime un PDF (dossier ou archive mensuelle, réécrite sans lui) et sa ligne du
+    catalogue. Renvoie False si le document n'existait nulle part.
+    """
+    pdf_folder = pdf_folder or utils.PDF_FOLDER
+    path = os.path.join(pdf_folder, name)
+    found = False
+    if os.path.exists(path):
+        os.remove(path)
+        found = True
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT archive FROM documents WHERE name = ?", (name,)).fetchone()
+        if row and row[0]:
+            archive_dir = os.path.join(pdf_folder, ARCHIVE_DIRNAME)
+            with utils.file_lock(os.path.join(archive_dir, "maintenance")):
+                found = _rewrite_archive(os.path.join(archive_dir, row[0]), drop={name}) or found
+        conn.execute("DELETE FROM documents WHERE name = ?", (name,))
+    finally:
+        conn.close()
+    return found
+
+def summary(db_path: Optional[str] = None) -> list:
+    """[(type, nombre, octets, dont archivés)] du catalogue."""
+    conn = connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT kind, COUNT(*), SUM(size), SUM(archive IS NOT NULL) FROM documents"
+            " GROUP BY kind ORDER BY kind").fetchall()
+    finally:
+        conn.close()
+
+def archived_names(kind: str, day: str, db_path: Optional[str] = None) -> list:
+    """
+    Noms des documents d'un type et d'un jour rangés dans une archive.
+    Lecture seule, sans création du schéma : appelée par invoice_store pendant que la
+    transaction d'allocation des numéros détient le verrou d'écriture de la base.
+    """
+    conn = sqlite3.connect(db_path or utils.SQLITE_DB_PATH, timeout=30)
+    try:
+        rows = conn.execute("SELECT name FROM documents WHERE kind = ? AND day = ? AND archive IS NOT NULL",
+                            (kind, day)).fetchall()
+    except sqlite3.OperationalError:  # catalogue pas encore créé : rien d'archivé
+        rows = []
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
+
+# ---------------------------------------------------------------------------
+# Entretien : indexation, suppression des régénérables, archivage des factures
+# ---------------------------------------------------------------------------
+def _write_zip_atomic(path: str, members):
+    """Écrit l'archive à côté puis la met en place : une archive n'est jamais à moitié écrite."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            for name, source in members:
+                if isinstance(source, (bytes, bytearray)):
+                    zf.writestr(name, source)
+                else:
+                    zf.write(source, name)
+        with open(tmp, "rb") as fh:
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _existing_members(zip_path: str, drop=()):
+    if not os.path.exists(zip_path):
+        return
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            if info.filename not in drop:
+                yield info.filename, zf.read(info)
+
+def _rewrite_archive(zip_path: str, drop: set) -> bool:
+    if not os.path.exists(zip_path):
+        return False
+    members = list(_existing_members(zip_path, drop))
+    with zipfile.ZipFile(zip_path) as zf:
+        removed = len(zf.infolist()) - len(members)
+    if removed:
+        if members:
+            _write_zip_atomic(zip_path, members)
+        else:
+            os.remove(zip_path)
+    return removed > 0
+
+def sync(pdf_folder: str, db_path: str) -> int:
+    """
+    Indexe les PDF du dossier absents du catalogue (fichiers antérieurs au catalogue)
+    et retire les lignes des fichiers disparus. Renvoie le nombre de fichiers ajoutés.
+    """
+    on_disk = {}
+    with os.scandir(pdf_folder) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(".pdf"):
+                on_disk[entry.name] = entry.stat()
+    conn = connect(db_path)
+    try:
+        known = {name for name, in conn.execute("SELECT name FROM documents WHERE archive IS NULL")}
+        rows = []
+        for name in on_disk.keys() - known:
+            st = on_disk[name]
+            rows.append((name, *classify(name, st.st_mtime), st.st_size))
+        gone = [(name,) for name in known - on_disk.keys()]
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR REPLACE INTO documents (name, kind, day, size) VALUES (?, ?, ?, ?)", rows)
+        conn.executemany("DELETE FROM documents WHERE name = ? AND archive IS NULL", gone)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return len(rows)
+
+def prune(pdf_folder: str, db_path: str, retention_days: int, today: Optional[date] = None) -> int:
+    """Supprime les documents régénérables plus vieux que retention_days jours."""
+    if not retention_days or retention_days <= 0:
+        return 0
+    limit = ((today or date.today()) - timedelta(days=int(retention_days))).isoformat()
+    conn = connect(db_path)
+    try:
+        marks = ",".join("?" * len(REGENERABLE_KINDS))
+        names = [name for name, in conn.execute(
+            f"SELECT name FROM documents WHERE kind IN ({marks}) AND day < ? AND archive IS NULL",
+            (*REGENERABLE_KINDS, limit))]
+        for name in names:
+            try:
+                os.remove(os.path.join(pdf_folder, name))
+            except FileNotFoundError:
+                pass
+        conn.executemany("DELETE FROM documents WHERE name = ?", [(n,) for n in names])
+    finally:
+        conn.close()
+    return len(names)
+
+def archive_invoices(pdf_folder: str, db_path: str, months: int, today: Optional[date] = None) -> int:
+    """
+    Range dans PDF/Archives/Factures_AAAA-MM.zip les factures des mois clos depuis plus de
+    `months` mois. L'archive est complète et en place avant que le catalogue ne la désigne
+    et que les fichiers ne soient retirés du dossier : une interruption ne perd rien.
+    """
+    if months is None or int(months) < 0:
+        return 0
+    today = today or date.today()
+    y, m = divmod(today.year * 12 + today.month - 1 - int(months), 12)
+    limit = date(y, m + 1, 1).isoformat()          # 1er jour du plus ancien mois gardé en clair
+    archive_dir = os.path.join(pdf_folder, ARCHIVE_DIRNAME)
+    conn = connect(db_path)
+    try:
+        by_archive = {}
+        for name, day in conn.execute(
+                "SELECT name, day FROM documents WHERE kind = 'facture' AND day < ? AND archive IS NULL",
+                (limit,)):
+            by_archive.setdefault(archive_name(day), []).append(name)
+        if not by_archive:
+            return 0
+        os.makedirs(archive_dir, exist_ok=True)
+        moved = 0
+        with utils.file_lock(os.path.join(archive_dir, "maintenance")):
+            for archive, names in sorted(by_archive.items()):
+                zip_path = os.path.join(archive_dir, archive)
+                present = [n for n in names if os.path.isfile(os.path.join(pdf_folder, n))]
+                members = dict(_existing_members(zip_path, drop=set(present)))
+                members.update((n, os.path.join(pdf_folder, n)) for n in present)
+                _write_zip_atomic(zip_path, sorted(members.items()))
+                conn.executemany("UPDATE documents SET archive = ? WHERE name = ?",
+                                 [(archive, n) for n in present])
+                for n in present:
+                    os.remove(os.path.join(pdf_folder, n))
+                moved += len(present)
+                print(f"DEBUG: {len(present)} facture(s) rangée(s) dans {archive}")
+        return moved
+    finally:
+        conn.close()
+
+def maintain(pdf_folder: str, db_path: str, retention_days: int = RETENTION_DAYS,
+             archive_months: int = INVOICE_ARCHIVE_MONTHS, today: Optional[date] = None) -> dict:
+    """Entretien complet du dossier PDF ; renvoie les compteurs de chaque étape."""
+    stats = {
+        "indexed": sync(pdf_folder, db_path),
+        "pruned": prune(pdf_folder, db_path, retention_days, today),
+        "archived": archive_invoices(pdf_folder, db_path, archive_months, today),
+    }
+    print(f"DEBUG: Entretien du dossier PDF {pdf_folder} : {stats}")
+    return stats
+
+def maintain_in_background(pdf_folder: str, db_path: str, retention_days: int = RETENTION_DAYS,
+                           archive_months: int = INVOICE_ARCHIVE_MONTHS):
+    """
+    Lance maintain() dans un thread démon si l'entretien du jour n'a pas encore eu lieu
+    pour ce cabinet (date partagée par les workers dans documents_meta).
+    """
+    today = date.today().isoformat()
+    with _LOCK:
+        if _MAINTAINED.get(db_path) == today or db_path in _RUNNING:
+            return
+        _RUNNING.add(db_path)
+
+    def run():
+        try:
+            conn = connect(db_path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT value FROM documents_meta WHERE key = 'last_maintenance'").fetchone()
+                due = row is None or row[0] != today
+                if due:
+                    conn.execute("INSERT OR REPLACE INTO documents_meta (key, value)"
+                                 " VALUES ('last_maintenance', ?)", (today,))
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            if due:
+                maintain(pdf_folder, db_path, retention_days, archive_months)
+            with _LOCK:
+                _MAINTAINED[db_path] = today
+        except Exception as e:
+            print(f"ERROR: Entretien du dossier PDF impossible : {e}")
+        finally:
+            with _LOCK:
+                _RUNNING.discard(db_path)
+
+    threading.Thread(target=run, name="pdf-retention", daemon=True).start()
@@ -19,6 +19,18 @@ BASE_DIR = pathlib.Path(__file__).resolve().parent
 ICON_DIR = BASE_DIR / "static" / "pwa"
 ICON_DIR.mkdir(parents=True, exist_ok=True)
 
+# Chemins toujours servis par le réseau : ni pré-chargés à l'installation du service
+# worker, ni servis depuis son cache (données en direct)
+NETWORK_ONLY_PATHS = [
+    "/rdv/queue",
+    "/events/stream",
+    "/facturation/export",
+    "/facturation/archive",
+]
+
+def network_only(url: str) -> bool:
+    return any(url == p or url.startswith(p + "/") for p in NETWORK_ONLY_PATHS)
+
 # Manifest dynamique
 def _manifest():
     return {
@@ -64,10 +76,12 @@ def sw():
         "/login"
     ]
     urls.extend(current_app.config.get("PWA_OFFLINE_URLS", []))
+    urls = [u for u in urls if not network_only(u)]
 
     sw_code = f"""
-const CACHE_NAME = 'em-cache-v2';
+const CACHE_NAME = 'em-cache-v3';
 const PRECACHE_URLS = {json.dumps(urls)};
+const NETWORK_ONLY = {json.dumps(NETWORK_ONLY_PATHS)};
 
 self.addEventListener('install', event => {{
   event.waitUntil(
@@ -90,6 +104,8 @@ self.addEventListener('activate', event => {{
 
 self.addEventListener('fetch', event => {{
   if (event.request.method !== 'GET') return;
+  const path = new URL(event.request.url).pathname;
+  if (NETWORK_ONLY.some(p => path === p || path.startsWith(p + '/'))) return;  // réseau seul
   event.respondWith(
     caches.match(event.request).then(cachedResponse => {{
       return cachedResponse || fetch(event.request).then(networkResponse => {{
@@ -14,13 +14,15 @@ Blueprint RDV – version mise à jour avec calcul automatique de l'âge
 • Correction de la visibilité des boutons blancs
 • Correction de l'affichage du nom et prénom du patient lors de la sélection d'un ID existant.
 • Ajout du menu des paramètres de la page d'accueil, y compris le message d'alerte.
+• File d'attente du jour (arrivé / en consultation / terminé) interrogée en JSON avec ETag
 """
 
+import io
 import os
 import re
 import uuid
-import shutil
 from datetime import datetime, timedelta, date
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -29,10 +31,16 @@ from fpdf import FPDF
 from openpyxl import Workbook
 from flask import (
     Blueprint, request, render_template_string,
-    redirect, url_for, session, jsonify, send_file
+    redirect, url_for, session, jsonify, send_file, current_app
 )
 import utils
 import theme
+import patient_store
+import waiting_room
+import events
+import text_layout
+import jobs
+import pdf_store
 
 # These variables will be dynamically defined once set_dynamic_base_dir is called
 EXCEL_DIR: Optional[Path] = None
@@ -65,19 +73,11 @@ def set_rdv_dirs():
 
 
 def backup_info_base_patient():
-    # Ensure BASE_PATIENT_FILE and EXCEL_FOLDER are set
-    if BASE_PATIENT_FILE is None or utils.EXCEL_FOLDER is None:
-        print("ERROR: BASE_PATIENT_FILE or utils.EXCEL_FOLDER not set. Cannot backup patient file.")
+    """Rotated, bounded backup of info_Base_patient.xlsx (Excel/backups/, see patient_store)."""
+    if BASE_PATIENT_FILE is None:
+        print("ERROR: BASE_PATIENT_FILE not set. Cannot backup patient file.")
         return
-
-    source_file = str(BASE_PATIENT_FILE) # Convert Path to string for os.path.join
-    if os.path.exists(source_file):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(
-            utils.EXCEL_FOLDER,
-            f"backup_info_Base_patient_{timestamp}.xlsx"
-        )
-        shutil.copy2(source_file, backup_file)
+    patient_store.rotate_backups(str(BASE_PATIENT_FILE))
 
 
 def initialize_base_patient_file():
@@ -100,37 +100,16 @@ def initialize_base_patient_file():
 
 
 def save_base_patient_df(df_new: pd.DataFrame):
-    """Saves or updates data in info_Base_patient.xlsx."""
+    """Saves or updates data in info_Base_patient.xlsx (upsert by ID through patient_store)."""
     if BASE_PATIENT_FILE is None:
         print("ERROR: BASE_PATIENT_FILE not set. Cannot save base patient dataframe.")
         return
 
-    if not BASE_PATIENT_FILE.exists():
-        initialize_base_patient_file()
-        df_existing = pd.DataFrame(columns=[
-            "ID", "Nom", "Prenom", "DateNaissance", "Sexe", "Âge",
-            "Antécédents", "Téléphone"
-        ]) # Ensure columns if file just created
-    else:
-        df_existing = pd.read_excel(BASE_PATIENT_FILE, dtype=str).fillna('')
-
-    # Ensure df_new has the expected columns for info_Base_patient
-    expected_cols = ["ID", "Nom", "Prenom", "DateNaissance", "Sexe", "Âge", "Antécédents", "Téléphone"]
-    for col in expected_cols:
-        if col not in df_new.columns:
-            df_new[col] = '' # Add column if missing
-
-    # Filter df_new to keep only relevant columns for info_Base_patient
-    df_new_filtered = df_new[expected_cols]
-
-    # Concatenate and remove duplicates based on ID
-    # Keep the last entry for a given ID (most recent)
-    df_combined = pd.concat([df_existing, df_new_filtered], ignore_index=True)
-    if "ID" in df_combined.columns:
-        df_combined.drop_duplicates(subset=["ID"], keep="last", inplace=True)
-    
-    df_combined.to_excel(BASE_PATIENT_FILE, index=False)
-    print(f"DEBUG: Données sauvegardées dans info_Base_patient.xlsx. Total d'entrées: {len(df_combined)}")
+    # Only the rows are upserted: the workbook is neither re-read nor rewritten here,
+    # the store journals the change and compacts it into the workbook later.
+    for rec in df_new.fillna('').to_dict("records"):
+        if str(rec.get("ID", "")).strip():
+            patient_store.upsert(rec, str(BASE_PATIENT_FILE))
 
 
 # ------------------------------------------------------------------
@@ -154,14 +133,29 @@ def initialize_excel_file():
     wb.save(EXCEL_FILE)
     print(f"DEBUG: Fichier DonneesRDV.xlsx initialisé avec les colonnes unifiées.")
 
-def load_df() -> pd.DataFrame:
-    """Loads the DataFrame from DonneesRDV.xlsx, adding missing columns if any."""
-    if EXCEL_FILE is None:
-        print("ERROR: EXCEL_FILE not set. Cannot load dataframe.")
-        return pd.DataFrame() # Return empty DataFrame to prevent further errors
+def _normalize_rdv_date(value) -> str:
+    """Ramène une valeur de la colonne 'Date' à la forme ISO 'YYYY-MM-DD'."""
+    text = str(value).strip()
+    if re.match(r"^\d{4}-\d{2}-\d{2}", text):
+        return text[:10]
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return text
+
+# Cache par processus de DonneesRDV.xlsx : chemin → (empreinte, DataFrame, index par date)
+_RDV_DF_CACHE: dict = {}
+
+def _load_rdv_cached():
+    """Renvoie (DataFrame, index date ISO → positions), relu seulement si le fichier a changé."""
+    key = str(EXCEL_FILE)
+    stamp = utils.file_stamp(EXCEL_FILE)
+    cached = _RDV_DF_CACHE.get(key)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1], cached[2]
 
-    if not EXCEL_FILE.exists():
-        initialize_excel_file()
     df = pd.read_excel(EXCEL_FILE, dtype=str).fillna('')
     # --- MODIFICATION: Ensure presence of Nom and Prenom columns ---
     if 'Nom' not in df.columns:
@@ -179,7 +173,33 @@ def load_df() -> pd.DataFrame:
     if 'Téléphone' not in df.columns: # Ensure Telephone column
         df.insert(loc=8, column='Téléphone', value='')
     # -------------------------------------------------------------------
-    return df
+    date_index = {}
+    if 'Date' in df.columns:
+        for pos, iso in enumerate(df['Date'].map(_normalize_rdv_date)):
+            date_index.setdefault(iso, []).append(pos)
+    _RDV_DF_CACHE[key] = (stamp, df, date_index)
+    return df, date_index
+
+def load_df() -> pd.DataFrame:
+    """Loads the DataFrame from DonneesRDV.xlsx, adding missing columns if any."""
+    if EXCEL_FILE is None:
+        print("ERROR: EXCEL_FILE not set. Cannot load dataframe.")
+        return pd.DataFrame() # Return empty DataFrame to prevent further errors
+
+    if not EXCEL_FILE.exists():
+        initialize_excel_file()
+    df, _ = _load_rdv_cached()
+    return df.copy()
+
+def rdv_rows_for_date(iso_date: str) -> pd.DataFrame:
+    """Rendez-vous d'une date ISO, sélectionnés via l'index par date (sans parser toute la colonne)."""
+    if EXCEL_FILE is None:
+        print("ERROR: EXCEL_FILE not set. Cannot load dataframe.")
+        return pd.DataFrame()
+    if not EXCEL_FILE.exists():
+        initialize_excel_file()
+    df, date_index = _load_rdv_cached()
+    return df.iloc[date_index.get(iso_date, [])].copy()
 
 def save_df(df: pd.DataFrame):
     """Saves the DataFrame to DonneesRDV.xlsx."""
@@ -187,30 +207,45 @@ def save_df(df: pd.DataFrame):
         print("ERROR: EXCEL_FILE not set. Cannot save dataframe.")
         return
     df.to_excel(EXCEL_FILE, index=False)
+    _RDV_DF_CACHE.pop(str(EXCEL_FILE), None)
+
+def _patient_entry(rec: dict) -> dict:
+    """Patient dict used by the datalist / auto-fill, from a record with unified column names."""
+    nom = str(rec.get("Nom", "")).strip()
+    prenom = str(rec.get("Prenom", "")).strip()
+    return {
+        "name":          f"{nom} {prenom}".strip(), # Full name
+        "nom":           nom,                       # Last name
+        "prenom":        prenom,                    # First name
+        "date_of_birth": str(rec.get("DateNaissance", "")),
+        "gender":        str(rec.get("Sexe", "")),
+        "age":           str(rec.get("Âge", "")),
+        "phone":         str(rec.get("Téléphone", "")),
+        "antecedents":   str(rec.get("Antécédents", "")),
+    }
+
+# Dictionnaires patients déjà construits : chemin → (version des données, dict)
+_PATIENTS_CACHE: dict = {}
 
 def load_patients() -> dict:
-    """Loads patients from DonneesRDV.xlsx for the datalist (patient_id)."""
+    """Loads patients from DonneesRDV.xlsx for the datalist (patient_id). Shared dict: do not modify."""
+    if EXCEL_FILE is None:
+        print("ERROR: EXCEL_FILE not set. Cannot load patients.")
+        return {}
+    if not EXCEL_FILE.exists():
+        initialize_excel_file()
+    df, _ = _load_rdv_cached()
+    key = ("rdv", str(EXCEL_FILE))
+    version = utils.file_stamp(EXCEL_FILE)
+    cached = _PATIENTS_CACHE.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
     patients = {}
-    df = load_df() # Uses load_df to ensure columns are present
-    for _, row in df.iterrows():
-        pid = str(row["ID"]).strip()
-        if not pid:
-            continue
-        # --- MODIFICATION: Use separate Nom and Prenom ---
-        nom = str(row.get('Nom', '')).strip()
-        prenom = str(row.get('Prenom', '')).strip()
-        full_name = f"{nom} {prenom}".strip()
-        # ---------------------------------------------------
-        patients[pid] = {
-            "name":          full_name, # Full name
-            "nom":           nom,       # Last name
-            "prenom":        prenom,    # First name
-            "date_of_birth": str(row.get("DateNaissance", "")),
-            "gender":        str(row.get("Sexe", "")),
-            "age":           str(row.get("Âge", "")),
-            "phone":         str(row.get("Téléphone", "")),
-            "antecedents":   str(row.get("Antécédents", "")),
-        }
+    for rec in df.to_dict("records"): # columnar build, no per-row Series
+        pid = str(rec.get("ID", "")).strip()
+        if pid:
+            patients[pid] = _patient_entry(rec)
+    _PATIENTS_CACHE[key] = (version, patients)
     return patients
 
 # ------------------------------------------------------------------
@@ -364,6 +399,8 @@ def consult_rdv(index):
 
     df_rdv = df_rdv.drop(df_rdv.index[index]).reset_index(drop=True)
     save_df(df_rdv)
+    events.publish("consultation.saved", {"patient_id": str(rdv_row["ID"])})
+    events.publish("rdv.deleted", {"date": str(rdv_row["Date"]), "heure": str(rdv_row["Heure"])})
 
     return render_template_string("""
     <!DOCTYPE html><html><head>
@@ -569,6 +606,7 @@ def rdv_home():
             "Téléphone": phone
         }])
         save_base_patient_df(patient_base_data) # Save info_Base_patient.xlsx
+        events.publish("rdv.created", {"date": date_rdv, "heure": time_rdv, "patient_id": pid})
 
         return render_template_string("""
         <!DOCTYPE html><html><head>
@@ -590,8 +628,8 @@ def rdv_home():
     df_view   = df[df["Date"] == filt_date] if filt_date else df
     df_view   = df_view.sort_values("Num Ordre", key=lambda s: pd.to_numeric(s, errors="coerce"))
 
-    # Prepare data for the new "Today's Appointments" section
-    today_rdv = df[(df["Date"] == iso_today)].sort_values("Num Ordre", key=lambda s: pd.to_numeric(s, errors="coerce")).to_dict(orient="records")
+    # Prepare data for the new "Today's Appointments" section (waiting-room queue)
+    today_rdv = today_queue().entries
 
     today     = datetime.now().strftime("%d/%m/%Y")
 
@@ -623,8 +661,10 @@ def delete_rdv(index):
 
     df = load_df()
     if 0 <= index < len(df):
+        removed = df.iloc[index]
         df = df.drop(df.index[index]).reset_index(drop=True)
         save_df(df)
+        events.publish("rdv.deleted", {"date": str(removed["Date"]), "heure": str(removed["Heure"])})
         return render_template_string("""
         <!DOCTYPE html><html><head>
           <script src="https://cdn.jsdelivr.net/npm/sweetalert2@11"></script>
@@ -654,42 +694,9 @@ def pdf_today():
     set_rdv_dirs()
 
     try:
-        df = load_df() # Load DonneesRDV.xlsx
-
-        # Add debug prints for the original 'Date' column
-        print(f"DEBUG: Original df['Date'] head:\n{df['Date'].head()}")
-
-        # Ensure 'Date' column is treated as strings before parsing
-        df["Date_str"] = df["Date"].astype(str)
-
-        # IMPORTANT FIX: Removed dayfirst=True as the format is`%Y-%m-%d`
-        df["Date_parsed"] = pd.to_datetime(
-            df["Date_str"], errors="coerce"
-        )
-        
-        # Add debug prints for the parsed 'Date_parsed' column
-        print(f"DEBUG: Parsed df['Date_parsed'] head:\n{df['Date_parsed'].head()}")
-
-        # Filter out NaT values (unparseable dates) before converting to date object
-        df_valid_dates = df.dropna(subset=["Date_parsed"])
-        df_valid_dates["Date_only"] = df_valid_dates["Date_parsed"].dt.date
-
         today = date.today()
-        # Add debug print for today's date
-        print(f"DEBUG: Today's date: {today} (type: {type(today)})")
-
-        # Add debug prints to compare types and values before filtering
-        if not df_valid_dates.empty:
-            print(f"DEBUG: First parsed date in df_valid_dates['Date_only']: {df_valid_dates['Date_only'].iloc[0]} (type: {type(df_valid_dates['Date_only'].iloc[0])})")
-            print(f"DEBUG: Comparison result for first row: {df_valid_dates['Date_only'].iloc[0] == today}")
-        else:
-            print("DEBUG: df_valid_dates is empty after parsing and dropping NaT.")
-
-
-        df_today = df_valid_dates[df_valid_dates["Date_only"] == today].copy()
-
-        # Add debug print for the shape of the filtered DataFrame
-        print(f"DEBUG: df_today shape after filtering for today: {df_today.shape}")
+        # Sélection des RDV du jour via l'index par date (pas de pd.to_datetime sur tout le fichier)
+        df_today = rdv_rows_for_date(today.isoformat())
 
         if df_today.empty:
             return render_template_string("""
@@ -717,19 +724,10 @@ def pdf_today():
 
         # --- MODIFICATION: Headers for the PDF, including First Name ---
         headers = ["ID", "Nom", "Prénom", "Âge", "Téléphone", "Antécédents", "Date", "Heure", "Num Ordre"]
-        data = []
-        for _, row in df_today.iterrows():
-            data.append([
-                row.get("ID", ""),
-                row.get("Nom", ""),
-                row.get("Prenom", ""), # Add First Name
-                row.get("Âge", ""),
-                row.get("Téléphone", ""),
-                row.get("Antécédents", ""),
-                row.get("Date", ""),
-                row.get("Heure", ""),
-                row.get("Num Ordre", "")
-            ])
+        data = (
+            df_today.reindex(columns=SCHEDULE_PDF_COLUMNS, fill_value="")
+                    .astype(str).values.tolist()
+        )
 
         today_str = today.strftime("%d-%m-%Y")
         
@@ -754,53 +752,16 @@ def pdf_today():
             """)
 
         pdf_path = PDF_DIR / f"RDV_du_{today_str.replace('-', '')}.pdf"
-        
-        pdf = FPDF(orientation='L', unit='mm', format='A4')
-        
-        # Try to add a Unicode-supporting font. If the path is incorrect or font is missing,
-        # FPDF will fall back to a default font (like Helvetica), which might not support all
-        # French characters, but it will prevent the PDF generation from crashing.
-        # IMPORTANT: Verify the path to 'arial.ttf' on your system.
-        # A common path on Windows is 'C:\\Windows\\Fonts\\arial.ttf'
-        # If you're on Linux/macOS, you might need to find a suitable font path or
-        # download a .ttf file (e.g., DejaVuSans) and place it in your project.
-        try:
-            # Check if the font file exists before adding it
-            font_path = 'C:\\Windows\\Fonts\\arial.ttf' # Default path for Arial on Windows
-            if not os.path.exists(font_path):
-                print(f"WARNING: Arial font file not found at {font_path}. Attempting to use default FPDF fonts.")
-                # If Arial is not found, you might want to try another common font or instruct user to provide one.
-                # For now, we'll just let FPDF fall back.
-                pdf.set_font("Helvetica", size=20) # Fallback font
-            else:
-                pdf.add_font('Arial', '', font_path, uni=True) 
-                pdf.set_font("Arial", size=20)
-        except Exception as font_e:
-            print(f"WARNING: Could not load Arial font from specified path. Falling back to default. Error: {font_e}")
-            pdf.set_font("Helvetica", size=20) # Fallback font
-
-        pdf.add_page()
-        pdf.set_font("Arial", size=20, style='B') # Use Arial if loaded, else Helvetica
-        pdf.cell(0, 10, txt=f"RDV du {today.strftime('%d/%m/%Y')}", ln=True, align='C')
-        pdf.ln(5)
-
-        col_widths = calculate_pdf_column_widths(headers, data, pdf)
-
-        pdf.set_font("Arial", size=12, style='B') # Use Arial if loaded, else Helvetica
-        for i, header in enumerate(headers):
-            pdf.cell(col_widths[i], 10, header, border=1, align='C')
-        pdf.ln()
+        excel_file = EXCEL_FILE
+        tenant = utils.tenant_context()
 
-        pdf.set_font("Arial", size=12) # Use Arial if loaded, else Helvetica
-        for row in data:
-            for i, item in enumerate(row):
-                text = str(item)
-                align = 'C' if headers[i] in ["ID", "Âge", "Téléphone", "Date", "Heure", "Num Ordre"] else 'L'
-                pdf.cell(col_widths[i], 8, text, border=1, align=align)
-            pdf.ln()
-
-        pdf.output(str(pdf_path), 'F')
-        return send_file(str(pdf_path), as_attachment=True, download_name=pdf_path.name)
+        if jobs.wants_async():
+            return jobs.accepted(jobs.submit(
+                "planning", lambda: schedule_pdf_bytes(excel_file, pdf_path, today, headers, data, tenant),
+                pdf_path.name))
+        pdf_bytes = schedule_pdf_bytes(excel_file, pdf_path, today, headers, data)
+        return send_file(io.BytesIO(pdf_bytes), as_attachment=True,
+                         download_name=pdf_path.name, mimetype="application/pdf")
 
     except Exception as e:
         print(f"ERROR: Full PDF generation error: {e}") # More detailed error logging
@@ -821,11 +782,102 @@ def pdf_today():
         </body></html>
         """, error_message=str(e))
 
-def calculate_pdf_column_widths(headers, data, pdf: FPDF):
-    col_widths = [pdf.get_string_width(h) + 8 for h in headers]
+# ------------------------------------------------------------------
+# SCHEDULE PDF RENDERING (font / width / output caches, per process)
+# ------------------------------------------------------------------
+SCHEDULE_PDF_COLUMNS = ["ID", "Nom", "Prenom", "Âge", "Téléphone", "Antécédents", "Date", "Heure", "Num Ordre"]
+
+# (chemin DonneesRDV.xlsx, date ISO) → (signature des lignes du jour, octets PDF)
+_SCHEDULE_PDF_CACHE: dict = {}
+
+# Candidates (regular, bold) for a Unicode TTF font. On Windows Arial is used;
+# elsewhere DejaVuSans is the usual system font.
+_SCHEDULE_FONT_CANDIDATES = [
+    ("C:\\Windows\\Fonts\\arial.ttf", "C:\\Windows\\Fonts\\arialbd.ttf"),
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/Library/Fonts/Arial.ttf", "/Library/Fonts/Arial Bold.ttf"),
+]
+
+@lru_cache(maxsize=1)
+def _schedule_font_files() -> Optional[tuple]:
+    """Résout une seule fois par processus les fichiers TTF (regular, bold) à utiliser."""
+    for regular, bold in _SCHEDULE_FONT_CANDIDATES:
+        if os.path.exists(regular):
+            return regular, (bold if os.path.exists(bold) else regular)
+    print("WARNING: No Unicode TTF font found. Falling back to the core Helvetica font.")
+    return None
+
+def _schedule_font_family(pdf: FPDF) -> str:
+    """Registers the cached TTF files on this document and returns the family to use."""
+    files = _schedule_font_files()
+    if files is None:
+        return "Helvetica"
+    try:
+        pdf.add_font("ScheduleFont", "", files[0])
+        pdf.add_font("ScheduleFont", "B", files[1])
+        return "ScheduleFont"
+    except Exception as font_e:
+        print(f"WARNING: Could not load TTF font. Falling back to default. Error: {font_e}")
+        return "Helvetica"
+
+def schedule_pdf_bytes(excel_file, pdf_path: Path, day: date, headers: list, data: list,
+                       tenant: Optional[dict] = None) -> bytes:
+    """
+    PDF du planning, conservé en mémoire tant que les RDV du jour ne changent pas.
+    tenant : utils.tenant_context() du cabinet, figé par la requête (rendu dans jobs.py).
+    """
+    tenant = tenant or utils.tenant_context()
+    cache_key = (str(excel_file), day.isoformat())
+    signature = tuple(tuple(row) for row in data)
+    cached = _SCHEDULE_PDF_CACHE.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    pdf_bytes = render_schedule_pdf(day, headers, data)
+    # Un seul jour conservé par fichier RDV : les jours précédents sont périmés
+    for key in [k for k in _SCHEDULE_PDF_CACHE if k[0] == cache_key[0]]:
+        del _SCHEDULE_PDF_CACHE[key]
+    _SCHEDULE_PDF_CACHE[cache_key] = (signature, pdf_bytes)
+    pdf_path.write_bytes(pdf_bytes)
+    pdf_store.record(str(pdf_path), db_path=tenant["db_path"], config_file=tenant["config_file"])
+    return pdf_bytes
+
+def render_schedule_pdf(day: date, headers: list, data: list) -> bytes:
+    """Renders the daily appointment schedule and returns the PDF bytes."""
+    pdf = FPDF(orientation='L', unit='mm', format='A4')
+    family = _schedule_font_family(pdf)
+
+    pdf.add_page()
+    pdf.set_font(family, size=20, style='B')
+    pdf.cell(0, 10, f"RDV du {day.strftime('%d/%m/%Y')}", new_x="LMARGIN", new_y="NEXT", align='C')
+    pdf.ln(5)
+
+    pdf.set_font(family, size=12, style='B')
+    header_widths = [text_layout.fpdf_width(pdf, h) for h in headers]
+    pdf.set_font(family, size=12)
+    col_widths = calculate_pdf_column_widths(headers, data, pdf, header_widths=header_widths)
+
+    pdf.set_font(family, size=12, style='B')
+    for i, header in enumerate(headers):
+        pdf.cell(col_widths[i], 10, header, border=1, align='C')
+    pdf.ln()
+
+    pdf.set_font(family, size=12)
     for row in data:
         for i, item in enumerate(row):
-            w = pdf.get_string_width(str(item)) + 8
+            text = str(item)
+            align = 'C' if headers[i] in ["ID", "Âge", "Téléphone", "Date", "Heure", "Num Ordre"] else 'L'
+            pdf.cell(col_widths[i], 8, text, border=1, align=align)
+        pdf.ln()
+
+    return bytes(pdf.output())
+
+def calculate_pdf_column_widths(headers, data, pdf: FPDF, header_widths=None):
+    if header_widths is None:
+        header_widths = [text_layout.fpdf_width(pdf, h) for h in headers]
+    col_widths = [w + 8 for w in header_widths]
+    for row in data:
+        for i, item in enumerate(row):
+            w = text_layout.fpdf_width(pdf, str(item)) + 8
             if w > col_widths[i]:
                 col_widths[i] = w
     page_width = pdf.w - pdf.l_margin - pdf.r_margin
@@ -928,6 +980,7 @@ def edit_rdv(index):
         df.at[index, "Num Ordre"]     = num_ord
 
         save_df(df)
+        events.publish("rdv.updated", {"date": f["rdv_date"], "heure": f["rdv_time"], "patient_id": f["patient_id"]})
         return render_template_string("""
         <!DOCTYPE html><html><head>
           <script src="https://cdn.jsdelivr.net/npm/sweetalert2@11"></script>
@@ -954,8 +1007,8 @@ def edit_rdv(index):
         if r["Date"] == edit_date and r["Heure"] != edit_row["Heure"]
     ]
 
-    # Prepare data for the new "Today's Appointments" section
-    today_rdv = df[(df["Date"] == iso_today)].sort_values("Num Ordre", key=lambda s: pd.to_numeric(s, errors="coerce")).to_dict(orient="records")
+    # Prepare data for the new "Today's Appointments" section (waiting-room queue)
+    today_rdv = today_queue().entries
 
     return render_template_string(
         rdv_template,
@@ -985,25 +1038,21 @@ def load_base_patient_df() -> pd.DataFrame:
         return pd.DataFrame()
     if not BASE_PATIENT_FILE.exists():
         initialize_base_patient_file()
-    return pd.read_excel(BASE_PATIENT_FILE, dtype=str)
+    return patient_store.dataframe(str(BASE_PATIENT_FILE))
 
 def load_base_patients() -> dict:
-    patients = {}
-    df = load_base_patient_df()
-    for _, row in df.iterrows():
-        pid = str(row["ID"]).strip()
-        if not pid:
-            continue
-        patients[pid] = {
-            "name":          f"{row['Nom']} {row['Prenom']}".strip(),
-            "nom":           str(row["Nom"]).strip(), # Explicitly add 'nom'
-            "prenom":        str(row["Prenom"]).strip(), # Explicitly add 'prenom'
-            "date_of_birth": str(row["DateNaissance"]),
-            "gender":        str(row["Sexe"]),
-            "age":           str(row["Âge"]),
-            "antecedents":   str(row["Antécédents"]),
-            "phone":         str(row["Téléphone"]),
-        }
+    """Patients of info_Base_patient.xlsx keyed by ID, from the shared patient index. Shared dict: do not modify."""
+    if BASE_PATIENT_FILE is None:
+        print("ERROR: BASE_PATIENT_FILE not set. Cannot load base patients.")
+        return {}
+    path = str(BASE_PATIENT_FILE)
+    key = ("base", path)
+    version = patient_store.version(path)
+    cached = _PATIENTS_CACHE.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    patients = {rec["ID"]: _patient_entry(rec) for rec in patient_store.records(path)}
+    _PATIENTS_CACHE[key] = (version, patients)
     return patients
 
 @rdv_bp.route("/patient_info/<patient_id>")
@@ -1037,6 +1086,46 @@ def get_reserved_slots():
     return jsonify({"reserved_slots": reserved_slots})
 
 
+# ------------------------------------------------------------------
+# WAITING-ROOM QUEUE (today's appointments, polled by the RDV page)
+# ------------------------------------------------------------------
+def today_queue() -> waiting_room.QueueSnapshot:
+    """Today's queue for the current admin; rebuilt only when DonneesRDV.xlsx or the states change."""
+    return waiting_room.snapshot(EXCEL_FILE, date.today().isoformat(), rdv_rows_for_date)
+
+@rdv_bp.route("/queue")
+def queue_today():
+    admin_email_from_session = session.get('admin_email', 'default_admin@example.com')
+    utils.set_dynamic_base_dir(admin_email_from_session)
+    set_rdv_dirs()
+
+    snap = today_queue()
+    if request.if_none_match.contains(snap.etag):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.response_class(snap.payload, mimetype="application/json")
+    resp.set_etag(snap.etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@rdv_bp.route("/queue/status", methods=["POST"])
+def queue_set_status():
+    admin_email_from_session = session.get('admin_email', 'default_admin@example.com')
+    utils.set_dynamic_base_dir(admin_email_from_session)
+    set_rdv_dirs()
+
+    data = request.get_json(silent=True) or request.form
+    key = str(data.get("key", "")).strip()
+    status = str(data.get("status", "")).strip()
+    if status not in waiting_room.STATUSES:
+        return jsonify({"status": "error", "message": "État inconnu."}), 400
+    snap = waiting_room.set_status(EXCEL_FILE, date.today().isoformat(), key, status, rdv_rows_for_date)
+    if snap is None:
+        return jsonify({"status": "error", "message": "Rendez-vous introuvable aujourd'hui."}), 404
+    events.publish("queue.updated", {"key": key, "status": status})
+    return jsonify({"status": "success", "etag": snap.etag})
+
+
 # ------------------------------------------------------------------
 # JINJA TEMPLATE (responsive interface + theme menu + cards)
 # ------------------------------------------------------------------
@@ -1523,6 +1612,12 @@ rdv_template = r"""
   .calendar-slot .btn-consult {
     flex-shrink: 0;
   }
+  .calendar-slot .queue-badge {
+    background-color: rgba(var(--primary-color-rgb), 0.6);
+  }
+  .calendar-slot.status-arrive .queue-badge { background-color: #f0ad4e; }
+  .calendar-slot.status-en_consultation .queue-badge { background-color: #198754; }
+  .calendar-slot.status-termine { opacity: 0.55; }
 
 
   /* Responsive adjustments */
@@ -1798,13 +1893,27 @@ rdv_template = r"""
         <h4 class="text-primary m-0 mb-3">
           <i class="fas fa-calendar-alt me-2"></i>Rendez-vous du Jour ({{ today }})
         </h4>
+        <div id="todayQueue">
         {% if today_rdv %}
           {% for r in today_rdv %}
-            <div class="calendar-slot">
-              <span class="time">{{ r["Heure"] }}</span>
-              <span class="patient-info">{{ r["Nom"] }} {{ r["Prenom"] }}</span>
-              <a href="{{ url_for('rdv.consult_rdv', index=loop.index0) }}"
-                 class="btn btn-sm btn-success btn-consult" title="Passer à la consultation" data-bs-toggle="tooltip">
+            <div class="calendar-slot status-{{ r.status }}">
+              <span class="time">{{ r.heure }}</span>
+              <span class="patient-info">{{ r.nom }} {{ r.prenom }}</span>
+              <span class="badge queue-badge me-2">{{ r.label }}{% if r.rang %} #{{ r.rang }}{% endif %}</span>
+              {% if r.status == 'prevu' %}
+              <button type="button" class="btn btn-sm btn-outline-primary me-1 queue-btn"
+                      data-key="{{ r.key }}" data-status="arrive" title="Patient arrivé">
+                <i class="fas fa-user-check"></i>
+              </button>
+              {% elif r.status == 'en_consultation' %}
+              <button type="button" class="btn btn-sm btn-outline-secondary me-1 queue-btn"
+                      data-key="{{ r.key }}" data-status="termine" title="Consultation terminée">
+                <i class="fas fa-check-double"></i>
+              </button>
+              {% endif %}
+              <a href="{{ url_for('rdv.consult_rdv', index=r.index) }}"
+                 class="btn btn-sm btn-success btn-consult queue-consult" data-key="{{ r.key }}"
+                 title="Passer à la consultation" data-bs-toggle="tooltip">
                 <i class="fas fa-stethoscope me-1"></i>Consultation
               </a>
             </div>
@@ -1812,6 +1921,7 @@ rdv_template = r"""
         {% else %}
           <p class="text-center text-muted">Aucun rendez-vous pour aujourd'hui.</p>
         {% endif %}
+        </div>
       </div>
     </div>
   </div>
@@ -2053,6 +2163,85 @@ document.getElementById('patient_id').addEventListener('change',function(){
     });
 });
 </script>
+
+<script>
+/* Waiting-room queue: refreshed on server-sent events (polling with If-None-Match as fallback),
+   the card is redrawn only when the ETag changes */
+(function(){
+  const box = document.getElementById('todayQueue');
+  if (!box) return;
+  let etag = null;
+  const esc = v => String(v == null ? '' : v).replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+  const actions = {
+    prevu:           ['arrive',  'btn-outline-primary',   'fa-user-check',   'Patient arrivé'],
+    en_consultation: ['termine', 'btn-outline-secondary', 'fa-check-double', 'Consultation terminée']
+  };
+
+  function render(data){
+    if (!data.entries.length){
+      box.innerHTML = '<p class="text-center text-muted">Aucun rendez-vous pour aujourd\'hui.</p>';
+      return;
+    }
+    box.innerHTML = data.entries.map(e => {
+      const a = actions[e.status];
+      return `<div class="calendar-slot status-${esc(e.status)}">
+        <span class="time">${esc(e.heure)}</span>
+        <span class="patient-info">${esc(e.nom)} ${esc(e.prenom)}</span>
+        <span class="badge queue-badge me-2">${esc(e.label)}${e.rang ? ' #' + e.rang : ''}</span>
+        ${a ? `<button type="button" class="btn btn-sm ${a[1]} me-1 queue-btn" data-key="${esc(e.key)}" data-status="${a[0]}" title="${a[3]}"><i class="fas ${a[2]}"></i></button>` : ''}
+        <a href="/rdv/consult/${e.index}" class="btn btn-sm btn-success btn-consult queue-consult" data-key="${esc(e.key)}" title="Passer à la consultation">
+          <i class="fas fa-stethoscope me-1"></i>Consultation
+        </a>
+      </div>`;
+    }).join('');
+  }
+
+  function poll(){
+    const headers = etag ? {'If-None-Match': etag} : {};
+    return fetch('/rdv/queue', {headers, cache: 'no-store'})
+      .then(r => {
+        if (r.status === 304 || !r.ok) return;
+        etag = r.headers.get('ETag');
+        return r.json().then(render);
+      })
+      .catch(() => {});
+  }
+
+  function setStatus(key, status){
+    return fetch('/rdv/queue/status', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({key, status})
+    }).then(poll);
+  }
+
+  box.addEventListener('click', ev => {
+    const btn = ev.target.closest('.queue-btn');
+    if (btn){ setStatus(btn.dataset.key, btn.dataset.status); return; }
+    const consult = ev.target.closest('.queue-consult');
+    if (consult){
+      ev.preventDefault();
+      setStatus(consult.dataset.key, 'en_consultation').finally(() => { window.location.href = consult.href; });
+    }
+  });
+
+  poll();
+  let pollEvery = 10000;
+  if (window.EventSource){
+    pollEvery = 60000;
+    const source = new EventSource('/events/stream');
+    ['rdv.created', 'rdv.updated', 'rdv.deleted', 'queue.updated', 'consultation.saved']
+      .forEach(type => source.addEventListener(type, poll));
+    ['rdv.created', 'rdv.updated', 'rdv.deleted'].forEach(type => source.addEventListener(type, () => {
+      Swal.fire({toast: true, position: 'bottom-end', icon: 'info', timer: 8000,
+                 title: 'Rendez-vous modifiés sur un autre poste',
+                 showConfirmButton: true, confirmButtonText: 'Actualiser'})
+        .then(r => { if (r.isConfirmed) location.reload(); });
+    }));
+  }
+  setInterval(() => { if (!document.hidden) poll(); }, pollEvery);
+})();
+</script>
 </body>
 </html>
 """
@@ -1,6 +1,7 @@
 # routes.py
 from __future__ import annotations
 
+import io
 import os
 import pandas as pd
 import uuid
@@ -11,6 +12,10 @@ from pathlib import Path
 # Dépendances internes
 import utils
 import theme
+import events
+import jobs
+import pdf_store
+import catalogue
 from templates import (
     main_template,
     settings_template,
@@ -25,6 +30,14 @@ from flask import (
 # Ce chemin est relatif au fichier routes.py
 LISTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Liste_Medications_Analyses_Radiologies.xlsx')
 
+# Champs du formulaire imprimés sur l'ordonnance / le dossier d'impression
+PRINT_FIELDS = [
+    "doctor_name", "patient_name", "patient_age", "date_of_birth", "gender",
+    "location", "clinical_signs", "bp", "temperature", "heart_rate",
+    "respiratory_rate", "diagnosis", "certificate_content",
+]
+BUNDLE_MAX_DOCUMENTS = 100
+
 # ---------------------------------------------------------------------------
 #  HELPERS INTERNES AU MODULE
 # ---------------------------------------------------------------------------
@@ -37,6 +50,21 @@ def _config() -> Dict:
     print(f"DEBUG (routes.py - _config): Config chargée: {cfg.keys()}")
     return cfg
 
+def _print_sections(value):
+    """Liste (ou "a,b") de sections d'impression validée ; None si absente."""
+    if value is None or value == "" or value == []:
+        return None
+    sections = [s.strip() for s in (value.split(",") if isinstance(value, str) else value)]
+    unknown = [s for s in sections if s not in utils.PRINT_SECTIONS]
+    if unknown:
+        raise ValueError(f"Section(s) inconnue(s) : {', '.join(map(str, unknown))}")
+    return sections
+
+def _print_items(value) -> list:
+    """Éléments d'une liste (médicaments, analyses…) : liste JSON ou texte ligne par ligne."""
+    items = value.split("\n") if isinstance(value, str) else list(value or [])
+    return [str(item).strip() for item in items if str(item).strip()]
+
 # ---------------------------------------------------------------------------
 #  ENREGISTREMENT DES ROUTES D'APPLICATION
 # ---------------------------------------------------------------------------
@@ -62,20 +90,17 @@ def register_routes(app):
         base_analyses = utils.default_analyses_options
         base_radios = utils.default_radiologies_options
 
-        if os.path.exists(LISTS_FILE):
-            try:
-                df_lists = pd.read_excel(LISTS_FILE, sheet_name=0, dtype=str).fillna('')
-                if 'Medications' in df_lists.columns:
-                    base_meds = df_lists['Medications'].dropna().astype(str).tolist()
-                if 'Analyses' in df_lists.columns:
-                    base_analyses = df_lists['Analyses'].dropna().astype(str).tolist()
-                if 'Radiologies' in df_lists.columns:
-                    base_radios = df_lists['Radiologies'].dropna().astype(str).tolist()
-                print(f"DEBUG (routes.py - index): Listes par défaut chargées depuis {LISTS_FILE}")
-            except Exception as e:
-                print(f"ERREUR (routes.py - index): Erreur lors du chargement de {LISTS_FILE}: {e}")
-        else:
-            print(f"DEBUG (routes.py - index): Fichier {LISTS_FILE} non trouvé. Utilisation des listes par défaut intégrées.")
+        try:
+            # Catalogue partagé : le classeur n'est relu que s'il a changé sur le disque
+            lists = catalogue.consultation_lists()
+            if lists is None:
+                print(f"DEBUG (routes.py - index): Fichier {LISTS_FILE} non trouvé. Utilisation des listes par défaut intégrées.")
+            else:
+                base_meds = lists.get('Medications', base_meds)
+                base_analyses = lists.get('Analyses', base_analyses)
+                base_radios = lists.get('Radiologies', base_radios)
+        except Exception as e:
+            print(f"ERREUR (routes.py - index): Erreur lors du chargement de {LISTS_FILE}: {e}")
 
 
         # 2️⃣ Récupérer les ajouts du menu Paramètres
@@ -287,6 +312,8 @@ def register_routes(app):
             session['prefill_suivi_patient_id'] = patient_id
             session['prefill_suivi_patient_name'] = patient_name
 
+            events.publish("consultation.saved", {"patient_id": patient_id})
+
             # Recharger les données patient après modification
             utils.load_patient_data()
             saved_medications, saved_analyses, saved_radiologies = medication_list, analyses_list, radiologies_list
@@ -434,6 +461,7 @@ def register_routes(app):
                 df = df[df["consultation_id"] != cid]
                 if len(df) < original_rows:
                     df.to_excel(utils.EXCEL_FILE_PATH, index=False)
+                    events.publish("consultation.deleted", {"consultation_id": cid})
                     print(f"DEBUG (routes.py - delete_consultation): Consultation {cid} supprimée avec succès.")
                     return "OK", 200
                 else:
@@ -451,13 +479,7 @@ def register_routes(app):
     @app.route("/generate_pdf_route")
     def generate_pdf_route():
         print(f"DEBUG (routes.py): Accès à la route /generate_pdf_route.")
-        form_data = {
-            k: request.args.get(k, "") for k in [
-                "doctor_name", "patient_name", "patient_age", "date_of_birth", "gender",
-                "location", "clinical_signs", "bp", "temperature", "heart_rate",
-                "respiratory_rate", "diagnosis", "certificate_content",
-            ]
-        }
+        form_data = {k: request.args.get(k, "") for k in PRINT_FIELDS}
         form_data["include_certificate"] = request.args.get("include_certificate", "off")
         medications = request.args.get("medications_list", "").split("\n")
         analyses    = request.args.get("analyses_list", "").split("\n")
@@ -472,19 +494,121 @@ def register_routes(app):
         admin_email = session.get('admin_email', 'default_admin@example.com')
         utils.set_dynamic_base_dir(admin_email)
 
-        # Utilise utils.PDF_FOLDER qui est maintenant dynamique
+        # Rendu servi depuis le cache disque (mêmes données, même fond, même jour → même
+        # fichier) ; copie dans utils.PDF_FOLDER seulement sur demande
+        # (?save=on ou "save_prescriptions" dans la configuration), sous un nom unique
         pdf_filename = f"Ordonnance_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        pdf_path = os.path.join(utils.PDF_FOLDER, pdf_filename)
-        print(f"DEBUG (routes.py - generate_pdf_route): Génération du PDF vers {pdf_path}")
+        persist = request.args.get("save") == "on" or utils.load_config().get("save_prescriptions", False)
+        # ?sections=ordonnance,analyses : réimpression d'une partie seulement
+        try:
+            sections = _print_sections(request.args.get("sections"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        payload = {
+            "form": form_data, "medications": medications, "analyses": analyses,
+            "radiologies": radiologies,
+            "date": datetime.now().strftime("%Y-%m-%d"),  # date imprimée et âge calculé
+        }
+        if sections is not None:
+            payload["sections"] = sections
+
+        # Cabinet figé ici : le rendu peut s'exécuter dans un thread de jobs.py
+        tenant = utils.tenant_context()
+
+        def render(path):
+            utils.generate_pdf_file(path, form_data, medications, analyses, radiologies, sections,
+                                    tenant["background"], tenant["merge_backend"])
+            return True
+
+        def produce():
+            return utils.cached_pdf("ordonnance", utils.PRESCRIPTION_LAYOUT_VERSION, payload, render,
+                                    tenant["cache_dir"], tenant["background"])
+
+        if jobs.wants_async():
+            return jobs.accepted(jobs.submit("ordonnance", produce, pdf_filename))
+
         try:
-            utils.generate_pdf_file(pdf_path, form_data, medications, analyses, radiologies)
-            print(f"DEBUG (routes.py - generate_pdf_route): PDF généré avec succès.")
-            return send_file(pdf_path, as_attachment=True, download_name=os.path.basename(pdf_path))
+            pdf_bytes = produce()
+            print(f"DEBUG (routes.py - generate_pdf_route): PDF prêt ({len(pdf_bytes)} octets).")
+            if persist:
+                saved_name = f"{pdf_filename[:-4]}_{uuid.uuid4().hex[:8]}.pdf"
+                utils.write_file_atomic(os.path.join(utils.PDF_FOLDER, saved_name), pdf_bytes)
+                pdf_store.record(os.path.join(utils.PDF_FOLDER, saved_name), form_data.get("patient_name", ""))
+                print(f"DEBUG (routes.py - generate_pdf_route): PDF enregistré sous {saved_name}")
+            return send_file(io.BytesIO(pdf_bytes), mimetype="application/pdf",
+                             as_attachment=True, download_name=pdf_filename)
         except Exception as e:
             print(f"ERREUR (routes.py - generate_pdf_route): Erreur lors de la génération du PDF : {e}")
             flash(f"Erreur lors de la génération du PDF : {e}", "error")
             return redirect(url_for(".index"))
 
+    # ---------------------------------------------------------------------
+    #  DOSSIER D'IMPRESSION – PLUSIEURS SECTIONS / PATIENTS, UN SEUL PDF
+    # ---------------------------------------------------------------------
+    @app.route("/print_bundle", methods=["POST"])
+    def print_bundle():
+        """
+        Corps JSON :
+          {"sections": ["ordonnance", "analyses", "radiologies", "consultation", "certificat"],
+           "documents": [{"patient_name": "...", "doctor_name": "...", ...,
+                          "medications": [...], "analyses": [...], "radiologies": [...],
+                          "sections": [...]}, ...]}
+        "sections" (global ou par document) est facultatif : toutes les sections par
+        défaut, le certificat selon include_certificate. Réponse : un seul PDF, rendu en
+        une passe (ou 202 + job avec ?async=1).
+        """
+        body = request.get_json(silent=True) or {}
+        specs = body.get("documents")
+        if not isinstance(specs, list) or not specs:
+            return jsonify({"error": "Aucun document à imprimer"}), 400
+        if len(specs) > BUNDLE_MAX_DOCUMENTS:
+            return jsonify({"error": f"Dossier limité à {BUNDLE_MAX_DOCUMENTS} documents"}), 400
+        try:
+            sections = _print_sections(body.get("sections"))
+            documents = []
+            for i, spec in enumerate(specs, 1):
+                if not isinstance(spec, dict):
+                    raise ValueError(f"Document {i} : objet JSON attendu")
+                form = {k: str(spec.get(k, "") or "") for k in PRINT_FIELDS}
+                form["include_certificate"] = "on" if spec.get("include_certificate") in (True, "on") else "off"
+                doc = {
+                    "form": form,
+                    "medications": _print_items(spec.get("medications")),
+                    "analyses": _print_items(spec.get("analyses")),
+                    "radiologies": _print_items(spec.get("radiologies")),
+                }
+                doc_sections = _print_sections(spec.get("sections"))
+                if doc_sections is not None:
+                    doc["sections"] = doc_sections
+                documents.append(doc)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        pdf_filename = f"Dossier_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+        payload = {"documents": documents, "sections": sections,
+                   "date": datetime.now().strftime("%Y-%m-%d")}
+
+        tenant = utils.tenant_context()
+
+        def render(path):
+            utils.generate_bundle_file(path, documents, sections, tenant["background"], tenant["merge_backend"])
+            return True
+
+        def produce():
+            return utils.cached_pdf("dossier", utils.PRESCRIPTION_LAYOUT_VERSION, payload, render,
+                                    tenant["cache_dir"], tenant["background"])
+
+        if jobs.wants_async():
+            return jobs.accepted(jobs.submit("dossier", produce, pdf_filename))
+        try:
+            pdf_bytes = produce()
+        except Exception as e:
+            print(f"ERREUR (routes.py - print_bundle): Erreur lors de la génération du dossier : {e}")
+            return jsonify({"error": str(e)}), 500
+        print(f"DEBUG (routes.py - print_bundle): {len(documents)} document(s), {len(pdf_bytes)} octets.")
+        return send_file(io.BytesIO(pdf_bytes), mimetype="application/pdf",
+                         as_attachment=True, download_name=pdf_filename)
+
 
     @app.route("/generate_history_pdf")
     def generate_history_pdf():
@@ -502,46 +626,76 @@ def register_routes(app):
             flash("Aucune donnée de consultation.", "warning")
             return redirect(url_for(".index"))
 
-        df = pd.DataFrame()
-        try:
-            df = pd.read_excel(utils.EXCEL_FILE_PATH, sheet_name=0, dtype=str).fillna('')
-            print(f"DEBUG (routes.py - generate_history_pdf): Données lues depuis {utils.EXCEL_FILE_PATH}.")
-        except Exception as e:
-            print(f"ERREUR (routes.py - generate_history_pdf): Erreur lors de la lecture de {utils.EXCEL_FILE_PATH} pour l'historique : {e}")
-            flash(f"Erreur lors de la lecture des données pour l'historique : {e}", "error")
-            return redirect(url_for(".index"))
-
-        df_filtered = pd.DataFrame()
-        if pid:
-            df_filtered = df[df["patient_id"].astype(str) == pid]
-            print(f"DEBUG (routes.py - generate_history_pdf): Filtrage par ID patient '{pid}'.")
-        elif pname:
-            df_filtered = df[df["patient_name"].astype(str).str.contains(pname, case=False, na=False)]
-            print(f"DEBUG (routes.py - generate_history_pdf): Filtrage par nom patient '{pname}'.")
-        else:
+        if not pid and not pname:
             print(f"ATTENTION (routes.py - generate_history_pdf): ID ou nom de patient manquant pour l'historique.")
             flash("Sélectionnez l'ID ou le nom du patient.", "warning")
             return redirect(url_for(".index"))
 
-        if df_filtered.empty:
-            print(f"DEBUG (routes.py - generate_history_pdf): Aucune consultation trouvée après filtrage.")
-            flash("Aucune consultation trouvée pour ce patient.", "info")
+        # Tranche optionnelle : dates ISO (from/to) et/ou pages (ex. « 2-5 », « 3- », « 4 »)
+        date_from = request.args.get("from", "").strip() or None
+        date_to   = request.args.get("to", "").strip() or None
+        pages     = request.args.get("pages", "").strip()
+        try:
+            for d in (date_from, date_to):
+                if d:
+                    datetime.strptime(d, "%Y-%m-%d")
+            first_page, last_page = 1, None
+            if pages:
+                lo, sep, hi = pages.partition("-")
+                first_page = int(lo) if lo.strip() else 1
+                last_page = (int(hi) if hi.strip() else None) if sep else first_page
+                if first_page < 1 or (last_page is not None and last_page < first_page):
+                    raise ValueError(pages)
+        except ValueError:
+            print(f"ATTENTION (routes.py - generate_history_pdf): Tranche invalide from={date_from} to={date_to} pages={pages}")
+            flash("Période ou pages invalides pour l'historique.", "warning")
             return redirect(url_for(".index"))
-        
-        if 'certificate_content' in df_filtered.columns:
-            df_filtered = df_filtered.drop(columns=['certificate_content'])
+
+        # Même patient, même tranche et classeur inchangé → PDF déjà rendu, servi tel quel
+        payload = {
+            "patient_id": pid, "patient_name": "" if pid else pname,
+            "from": date_from, "to": date_to, "pages": [first_page, last_page],
+            "data": utils.file_stamp(utils.EXCEL_FILE_PATH),
+        }
+
+        tenant = utils.tenant_context()
+
+        def render(path):
+            # Générateur : le classeur n'est (re)lu, via l'index par patient, qu'au début du rendu
+            consultations = utils.iter_consultations(pid, pname, date_from, date_to, path=tenant["consult_file"])
+            return utils.generate_history_pdf_file(path, consultations, first_page, last_page,
+                                                   tenant["background"], tenant["merge_backend"]) > 0
+
+        def produce():
+            return utils.cached_pdf("historique", utils.HISTORY_LAYOUT_VERSION, payload, render,
+                                    tenant["cache_dir"], tenant["background"])
+
+        def empty_message():
+            # Rien à rendre : patient sans consultation, ou pages demandées au-delà de la dernière
+            if pages and next(utils.iter_consultations(pid, pname, date_from, date_to,
+                                                       path=tenant["consult_file"]), None) is not None:
+                return f"Pages {pages} vides : l'historique de ce patient compte moins de {first_page} pages."
+            return "Aucune consultation trouvée pour ce patient."
 
         pdf_filename = f"Historique_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        pdf_path = os.path.join(utils.PDF_FOLDER, pdf_filename)
-        print(f"DEBUG (routes.py - generate_history_pdf): Génération du PDF d'historique vers {pdf_path}")
+        print(f"DEBUG (routes.py - generate_history_pdf): PDF d'historique demandé "
+              f"(patient '{pid or pname}', du {date_from or '-'} au {date_to or '-'}, pages {first_page}-{last_page or 'fin'})")
+        if jobs.wants_async():
+            return jobs.accepted(jobs.submit(
+                "historique", produce, pdf_filename, empty_message=empty_message))
+
         try:
-            utils.generate_history_pdf_file(pdf_path, df_filtered)
-            print(f"DEBUG (routes.py - generate_history_pdf): PDF d'historique généré avec succès.")
-            return send_file(pdf_path, as_attachment=True, download_name=os.path.basename(pdf_path))
+            pdf_bytes = produce()
         except Exception as e:
             print(f"ERREUR (routes.py - generate_history_pdf): Erreur lors de la génération du PDF d'historique : {e}")
             flash(f"Erreur lors de la génération du PDF d'historique : {e}", "error")
             return redirect(url_for(".index"))
+        if pdf_bytes is None:
+            print(f"DEBUG (routes.py - generate_history_pdf): Aucune consultation (ou page) dans la tranche demandée.")
+            flash(empty_message(), "info")
+            return redirect(url_for(".index"))
+        print(f"DEBUG (routes.py - generate_history_pdf): PDF d'historique prêt ({len(pdf_bytes)} octets).")
+        return send_file(io.BytesIO(pdf_bytes), mimetype="application/pdf", as_attachment=True, download_name=pdf_filename)
 
 
     # ---------------------------------------------------------------------
@@ -657,6 +811,7 @@ def register_routes(app):
                 if any(df["patient_id"].astype(str) == pid):
                     df.loc[df["patient_id"].astype(str) == pid, "doctor_comment"] = new_comment
                     df.to_excel(utils.EXCEL_FILE_PATH, index=False)
+                    events.publish("consultation.saved", {"patient_id": pid})
                     print(f"DEBUG (routes.py - update_comment): Commentaire mis à jour pour ID: {pid}.")
                     flash("Commentaire mis à jour.", "success")
                 else:
@@ -19,7 +19,7 @@ from typing import Optional
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from flask import (
     Blueprint, request, render_template_string,
@@ -38,6 +38,10 @@ from reportlab.lib.utils import ImageReader
 
 import utils
 import theme
+import patient_store
+import invoice_store
+import money
+import jobs
 
 statistique_bp = Blueprint("statistique", __name__, url_prefix="/statistique")
 
@@ -93,7 +97,9 @@ def to_mpl_color(c):
 
 def draw_chart(canvas_obj, plot_func, title, x, y, w, h, color):
     buf = io.BytesIO()
-    fig, ax = plt.subplots(figsize=(w/200, h/200), dpi=200)
+    # Figure sans pyplot : rendu possible depuis un thread de jobs.py
+    fig = Figure(figsize=(w/200, h/200), dpi=200)
+    ax = fig.subplots()
     try:
         ok = plot_func(ax)
         if not ok:
@@ -108,7 +114,6 @@ def draw_chart(canvas_obj, plot_func, title, x, y, w, h, color):
     ax.set_title(title, color=mpl_color, fontsize=10)
     fig.tight_layout(pad=1)
     fig.savefig(buf, format='PNG', dpi=200, bbox_inches='tight')
-    plt.close(fig)
     buf.seek(0)
     # drawImage position y is bottom-left
     canvas_obj.drawImage(ImageReader(buf), x, y - h, width=w, height=h)
@@ -265,85 +270,16 @@ def export_pdf():
             if "ID" in df_patient.columns and "ID" in df_consult.columns:
                 df_patient = df_patient[df_patient["ID"].isin(df_consult["ID"].unique())]
 
-        # 3. Préparation PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-        doc.addPageTemplates([LandscapeTemplate()])
-        doc.onFirstPage = add_header_footer
-        doc.onLaterPages = add_header_footer
-
-        story = []
+        # 3. Rendu (en arrière-plan avec ?async=1)
         theme_vars = theme.current_theme()
-        primary_color = colors.HexColor(theme_vars["primary-color"])
-        secondary_color = colors.HexColor(theme_vars["secondary-color"])
-
-        # 4. Dessin des graphiques (portrait)
-        c = canvas.Canvas(buffer, pagesize=landscape(A4))
-        y = A4[1] - 4*cm
-        h_chart = 180
-        # Utiliser la largeur de la page PDF moins les marges latérales
-        w = A4[0] - 4*cm 
-
-        # Dessin des graphiques en PNG et insertion dans le PDF
-        # Chaque appel à draw_chart consomme une hauteur h_chart + un petit espace
-        y = draw_chart(
-            c,
-            lambda ax: plot_consultations(ax, df_consult, primary_color),
-            "Consultations mensuelles",
-            2*cm, y, w, h_chart, primary_color
-        )
-        y = draw_chart(
-            c,
-            lambda ax: plot_ca(ax, df_facture, secondary_color),
-            "Chiffre d'affaires mensuel",
-            2*cm, y, w, h_chart, primary_color
-        )
-        y = draw_chart(
-            c,
-            lambda ax: plot_genre_distribution(ax, df_patient, primary_color),
-            "Répartition par sexe",
-            2*cm, y, w, h_chart, primary_color
-        )
-        y = draw_chart(
-            c,
-            lambda ax: plot_age_distribution(ax, df_patient, secondary_color),
-            "Tranches d'âge",
-            2*cm, y, w, h_chart, primary_color
-        )
-
-
-        c.showPage()
-        c.save()
-
-        # 5. Tableau (paysage)
-        table_data = prepare_table_data(df_facture)
-        table = Table(
-            table_data,
-            colWidths=[(landscape(A4)[0] - 4*cm)/len(table_data[0])] * len(table_data[0]),
-            repeatRows=1
-        )
-        table.setStyle(TableStyle([
-            ("BACKGROUND", (0,0),(-1,0), primary_color),
-            ("TEXTCOLOR", (0,0),(-1,0), colors.white),
-            ("FONTNAME",  (0,0),(-1,0), "Helvetica-Bold"),
-            ("FONTSIZE",  (0,0),(-1,0), 10),
-            ("FONTSIZE",  (0,1),(-1,-1), 8),
-            ("GRID",      (0,0),(-1,-1), 0.5, colors.black),
-            ("ALIGN",     (0,0),(-1,-1), "CENTER"),
-            ("ROWBACKGROUNDS", (0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
-            ("LEFTPADDING",(0,0),(-1,-1), 4),
-            ("RIGHTPADDING",(0,0),(-1,-1), 4),
-        ]))
-
-        story.append(Spacer(1, 2*cm))
-        story.append(table)
-        doc.build(story)
-
-        buffer.seek(0)
         filename = f"rapport_statistique_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        return send_file(buffer, as_attachment=True,
-                         download_name=filename,
-                         mimetype="application/pdf")
+        if jobs.wants_async():
+            return jobs.accepted(jobs.submit(
+                "statistiques",
+                lambda: render_report_pdf(df_consult, df_facture, df_patient, theme_vars),
+                filename))
+        return send_file(io.BytesIO(render_report_pdf(df_consult, df_facture, df_patient, theme_vars)),
+                         as_attachment=True, download_name=filename, mimetype="application/pdf")
 
     except Exception:
         logging.exception("Erreur génération PDF")
@@ -352,6 +288,83 @@ def export_pdf():
 # ────────────────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────────────────
+def render_report_pdf(df_consult, df_facture, df_patient, theme_vars: dict) -> bytes:
+    """Rapport PDF (graphiques + tableau des factures) ; sans accès à la requête."""
+    # Préparation PDF
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
+    doc.addPageTemplates([LandscapeTemplate()])
+    doc.onFirstPage = add_header_footer
+    doc.onLaterPages = add_header_footer
+
+    story = []
+    primary_color = colors.HexColor(theme_vars["primary-color"])
+    secondary_color = colors.HexColor(theme_vars["secondary-color"])
+
+    # Dessin des graphiques (portrait)
+    c = canvas.Canvas(buffer, pagesize=landscape(A4))
+    y = A4[1] - 4*cm
+    h_chart = 180
+    # Utiliser la largeur de la page PDF moins les marges latérales
+    w = A4[0] - 4*cm 
+
+    # Dessin des graphiques en PNG et insertion dans le PDF
+    # Chaque appel à draw_chart consomme une hauteur h_chart + un petit espace
+    y = draw_chart(
+        c,
+        lambda ax: plot_consultations(ax, df_consult, primary_color),
+        "Consultations mensuelles",
+        2*cm, y, w, h_chart, primary_color
+    )
+    y = draw_chart(
+        c,
+        lambda ax: plot_ca(ax, df_facture, secondary_color),
+        "Chiffre d'affaires mensuel",
+        2*cm, y, w, h_chart, primary_color
+    )
+    y = draw_chart(
+        c,
+        lambda ax: plot_genre_distribution(ax, df_patient, primary_color),
+        "Répartition par sexe",
+        2*cm, y, w, h_chart, primary_color
+    )
+    y = draw_chart(
+        c,
+        lambda ax: plot_age_distribution(ax, df_patient, secondary_color),
+        "Tranches d'âge",
+        2*cm, y, w, h_chart, primary_color
+    )
+
+
+    c.showPage()
+    c.save()
+
+    # Tableau (paysage)
+    table_data = prepare_table_data(df_facture)
+    table = Table(
+        table_data,
+        colWidths=[(landscape(A4)[0] - 4*cm)/len(table_data[0])] * len(table_data[0]),
+        repeatRows=1
+    )
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0,0),(-1,0), primary_color),
+        ("TEXTCOLOR", (0,0),(-1,0), colors.white),
+        ("FONTNAME",  (0,0),(-1,0), "Helvetica-Bold"),
+        ("FONTSIZE",  (0,0),(-1,0), 10),
+        ("FONTSIZE",  (0,1),(-1,-1), 8),
+        ("GRID",      (0,0),(-1,-1), 0.5, colors.black),
+        ("ALIGN",     (0,0),(-1,-1), "CENTER"),
+        ("ROWBACKGROUNDS", (0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
+        ("LEFTPADDING",(0,0),(-1,-1), 4),
+        ("RIGHTPADDING",(0,0),(-1,-1), 4),
+    ]))
+
+    story.append(Spacer(1, 2*cm))
+    story.append(table)
+    doc.build(story)
+
+    return buffer.getvalue()
+
 def process_consultations(df, start_dt=None, end_dt=None):
     if df.empty:
         return df
@@ -382,6 +395,10 @@ def prepare_table_data(df):
     if df.empty:
         # Renvoie une liste avec juste les en-têtes si le DataFrame est vide
         return [['ID', 'Date', 'Type', 'Description', 'Montant']] 
+    df = df.copy()
+    for col in [c for c in df.columns if str(c).endswith("_cents")]:
+        # Montants du registre en centimes → '1234.50', sous l'en-tête d'origine
+        df[col[:-len("_cents")]] = df.pop(col).map(money.fmt)
     headers = [Paragraph(str(c), styles['HeaderStyle']) for c in df.columns]
     body = []
     body_style = ParagraphStyle(
@@ -427,6 +444,14 @@ def _load_all_excels(folder: str) -> dict:
     df_map = {}
     if not os.path.isdir(folder):
         return df_map
+    # Les fiches patients encore dans le journal sont d'abord écrites dans le classeur
+    patient_store.flush(os.path.join(folder, "info_Base_patient.xlsx"))
+    # Les factures viennent du registre SQLite (un ancien factures.xlsx y est importé au passage)
+    try:
+        df_factures = invoice_store.dataframe()
+    except Exception as e:
+        print(f"ERROR: Lecture du registre des factures impossible : {e}")
+        df_factures = None
     for fname in os.listdir(folder):
         if not fname.lower().endswith((".xlsx", ".xls")):
             continue
@@ -434,6 +459,8 @@ def _load_all_excels(folder: str) -> dict:
             df_map[fname] = pd.read_excel(os.path.join(folder, fname), dtype=str).fillna("")
         except Exception:
             df_map[fname] = pd.DataFrame()
+    if df_factures is not None:
+        df_map[invoice_store.LEGACY_FILENAME] = df_factures
     return df_map
 
 def _find_column(df: pd.DataFrame, keys: list[str]) -> Optional[str]:
@@ -444,6 +471,12 @@ def _find_column(df: pd.DataFrame, keys: list[str]) -> Optional[str]:
             return col
     return None
 
+def _cents(df: pd.DataFrame, col: str) -> pd.Series:
+    """Montants en centimes int64 : colonnes *_cents du registre telles quelles, sinon conversion."""
+    if col.endswith("_cents"):
+        return df[col].astype('int64')
+    return money.cents_series(df[col])
+
 def _total_revenue(df_facture: pd.DataFrame) -> float:
     """Calcule la somme totale TTC en utilisant 'Sous-total' et 'TVA'."""
 
@@ -455,23 +488,9 @@ def _total_revenue(df_facture: pd.DataFrame) -> float:
         print("WARNING: Missing 'Sous-total' or 'TVA' columns for total revenue calculation.")
         return 0.0
 
-    df = df_facture.copy() # Travailler sur une copie pour éviter de modifier le DataFrame original
-    
-    # Nettoyage et conversion de la colonne 'Sous-total'
-    vals_sous_total = (df[sous_total_col].astype(str)
-                       .str.replace(r"[^\d,.\-]", "", regex=True)
-                       .str.replace(",", ".", regex=False))
-    numeric_sous_total = pd.to_numeric(vals_sous_total, errors="coerce").fillna(0)
-
-    # Nettoyage et conversion de la colonne 'TVA'
-    vals_tva = (df[tva_col].astype(str)
-                .str.replace(r"[^\d,.\-]", "", regex=True)
-                .str.replace(",", ".", regex=False))
-    numeric_tva = pd.to_numeric(vals_tva, errors="coerce").fillna(0)
-
-    # Calcul du TTC
-    ttc_calculated = numeric_sous_total + numeric_tva
-    return round(ttc_calculated.sum(), 2)
+    # TTC = HT + TVA, sommés en centimes entiers (int64) puis convertis pour l'affichage
+    ttc_cents = _cents(df_facture, sous_total_col) + _cents(df_facture, tva_col)
+    return float(money.from_cents(int(ttc_cents.sum())))
 
 def _finance_timeseries(df_facture: pd.DataFrame) -> dict:
     """Renvoie dict avec ca_labels/list et ca_values/list par mois."""
@@ -490,13 +509,10 @@ def _finance_timeseries(df_facture: pd.DataFrame) -> dict:
     df = df_facture.copy()
     df[date_col] = pd.to_datetime(df[date_col].astype(str).str.strip(), errors="coerce")
 
-    # Calcul explicite du TTC
-    df['calculated_total_ttc'] = (
-        df[sous_total_col].astype(str).str.replace(r"[^\d,.\-]", "", regex=True).str.replace(",", ".", regex=False).pipe(pd.to_numeric, errors="coerce").fillna(0) +
-        df[tva_col].astype(str).str.replace(r"[^\d,.\-]", "", regex=True).str.replace(",", ".", regex=False).pipe(pd.to_numeric, errors="coerce").fillna(0)
-    )
+    # Calcul explicite du TTC, en centimes entiers (int64)
+    df['calculated_total_ttc'] = _cents(df, sous_total_col) + _cents(df, tva_col)
 
-    df = df.dropna(subset=[date_col, 'calculated_total_ttc']) # Supprime les lignes où la date ou le total calculé est NaN
+    df = df.dropna(subset=[date_col]) # Supprime les lignes sans date exploitable
     
     df["period"] = df[date_col].dt.to_period("M")
     
@@ -510,7 +526,7 @@ def _finance_timeseries(df_facture: pd.DataFrame) -> dict:
         return {"ca_labels": [], "ca_values": []}
 
     labels = [p.strftime("%Y-%m") for p in ca.index]
-    values = ca.round(2).tolist()
+    values = (ca / 100).tolist()  # centimes exacts → unités pour le graphique
     
     return {"ca_labels": labels, "ca_values": values}
 
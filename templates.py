@@ -954,9 +954,16 @@ main_template = """
                             onclick="$('#consultationsTable').DataTable().ajax.reload();">
                       <i class="fas fa-sync-alt me-2"></i>Rafraîchir
                     </button>
-                    <button type="button" class="btn btn-outline-success" onclick="generateHistoryPDF()">
-                      <i class="fas fa-file-pdf me-2"></i>Historique Patient
-                    </button>
+                    <div class="input-group w-auto">
+                      <select id="historyPeriod" class="form-select" title="Période de l'historique">
+                        <option value="">Tout l'historique</option>
+                        <option value="12">12 derniers mois</option>
+                        <option value="3">3 derniers mois</option>
+                      </select>
+                      <button type="button" class="btn btn-outline-success" onclick="generateHistoryPDF()">
+                        <i class="fas fa-file-pdf me-2"></i>Historique Patient
+                      </button>
+                    </div>
                   </div>
                 </div>
 
@@ -1456,13 +1463,40 @@ main_template = """
        var params = new URLSearchParams();
        if (id) { params.set("patient_id_filter", id); }
        if (name) { params.set("patient_name_filter", name); }
+       var months = parseInt(document.getElementById("historyPeriod").value, 10);
+       if (months) {
+         var since = new Date();
+         since.setMonth(since.getMonth() - months);
+         params.set("from", since.toISOString().slice(0, 10));
+       }
+       params.set("async", "1");  // rendu en arrière-plan : on suit le job jusqu'au document
        var url = "{{ url_for('generate_history_pdf') }}" + "?" + params.toString();
+       Swal.fire({ title: 'Préparation du PDF…', allowOutsideClick: false, didOpen: () => Swal.showLoading() });
        fetch(url, {
          method: 'GET',
          credentials: 'same-origin'
        })
+       .then(resp => {
+         if (resp.status !== 202) throw new Error("Erreur réseau");
+         return resp.json();
+       })
+       .then(job => new Promise((resolve, reject) => {
+         (function poll() {
+           fetch(job.status_url, { credentials: 'same-origin' })
+             .then(r => r.json())
+             .then(st => {
+               if (st.status === 'done') resolve(st.download_url);
+               else if (st.status === 'empty') reject(Object.assign(new Error(st.message), { info: true }));
+               else if (st.status === 'error') reject(new Error(st.message || "Erreur de rendu"));
+               else setTimeout(poll, 1000);
+             })
+             .catch(reject);
+         })();
+       }))
+       .then(downloadUrl => fetch(downloadUrl, { credentials: 'same-origin' }))
        .then(resp => {
          if (!resp.ok) throw new Error("Erreur réseau");
+         Swal.close();
          return resp.blob();
        })
        .then(blob => {
@@ -1477,6 +1511,7 @@ main_template = """
        })
        .catch(err => {
          console.error(err);
+         if (err.info) { Swal.fire('Historique', err.message, 'info'); return; }
          Swal.fire('Erreur', 'Impossible de générer le PDF.', 'error');
        });
     };
@@ -1668,6 +1703,17 @@ main_template = """
             bootstrap.Tab.getOrCreateInstance(suiviTabTrigger).show();
         }
     }
+
+    // Consultations enregistrées / supprimées sur un autre poste : rafraîchir le suivi
+    if (window.EventSource) {
+      const source = new EventSource('/events/stream');
+      source.addEventListener('consultation.saved', ev => {
+        const d = JSON.parse(ev.data);
+        const shown = $('#suivi_patient_id').val();
+        if (!shown || shown === String(d.patient_id)) consultationsTable.ajax.reload(null, false);
+      });
+      source.addEventListener('consultation.deleted', () => consultationsTable.ajax.reload(null, false));
+    }
   }); // Fin de DOMContentLoaded
 </script>
 </body>
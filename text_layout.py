@@ -0,0 +1,68 @@
+# text_layout.py
+
+"""
+Mise en lignes du texte des PDF (ordonnance, certificat, consultation, planning RDV)
+• Largeur de chaque mot mesurée une seule fois par (police, taille), puis mémorisée
+• Largeur de la ligne accumulée mot après mot : coût linéaire en longueur de texte
+  (au lieu de remesurer tout le début de ligne à chaque mot ajouté)
+• Mesure reportlab (pdfmetrics, en points) ou fpdf (get_string_width, dans l'unité du document)
+"""
+
+from typing import Callable, List, Optional
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+_WIDTH_CACHE: dict = {}
+_WIDTH_CACHE_MAX = 50000
+
+
+def text_width(text: str, font, size: float, measure: Optional[Callable[[str], float]] = None) -> float:
+    """
+    Largeur de `text` mémorisée par (police, taille, texte).
+    Sans `measure`, `font` est un nom de police reportlab ; sinon `font` identifie
+    la police pour le cache et `measure(text)` donne la largeur.
+    """
+    key = (font, size, text)
+    width = _WIDTH_CACHE.get(key)
+    if width is None:
+        width = measure(text) if measure else stringWidth(text, font, size)
+        if len(_WIDTH_CACHE) >= _WIDTH_CACHE_MAX:
+            _WIDTH_CACHE.clear()
+        _WIDTH_CACHE[key] = width
+    return width
+
+def fpdf_width(pdf, text: str) -> float:
+    """pdf.get_string_width avec la police courante du document fpdf, mémorisé."""
+    font = ("fpdf", pdf.font_family, pdf.font_style, pdf.k)
+    return text_width(text, font, pdf.font_size_pt, pdf.get_string_width)
+
+def wrap_words(words: List[str], max_width: float, font, size: float,
+               measure: Optional[Callable[[str], float]] = None) -> List[str]:
+    """
+    Répartit `words` en lignes d'au plus `max_width` (un mot trop long occupe seul sa ligne).
+    Les polices sans crénage ayant des largeurs additives, largeur(« a b ») =
+    largeur(a) + largeur(espace) + largeur(b) : chaque mot n'est mesuré qu'une fois.
+    """
+    space = text_width(" ", font, size, measure)
+    lines, current, current_width = [], [], 0.0
+    for word in words:
+        w = text_width(word, font, size, measure)
+        if current and current_width + space + w > max_width:
+            lines.append(" ".join(current))
+            current, current_width = [word], w
+        elif current:
+            current.append(word)
+            current_width += space + w
+        else:
+            current, current_width = [word], w
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+def wrap_text(text: str, max_width: float, font, size: float,
+              measure: Optional[Callable[[str], float]] = None) -> List[str]:
+    """Comme wrap_words, paragraphe par paragraphe (un paragraphe vide donne une ligne vide)."""
+    lines = []
+    for para in text.splitlines():
+        lines.extend(wrap_words(para.split(), max_width, font, size, measure) or [""])
+    return lines
@@ -5,7 +5,12 @@
 #  Compatible Python 3.9 : pas d’opérateur "|" dans les annotations
 # ---------------------------------------------------------------------------
 
-import os, sys, platform, json, uuid, hashlib, re, copy, base64, io, subprocess, socket, requests
+import os, sys, platform, json, uuid, hashlib, re, copy, base64, io, subprocess, socket, requests, zipfile
+import bisect
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 from typing import Optional
 import pandas as pd
@@ -14,6 +19,8 @@ from werkzeug.utils import secure_filename # Importation ajoutée pour être exp
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A5, A4
 from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
 from reportlab.platypus import (
     BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer,
     Table, TableStyle, PageBreak, ListFlowable, SimpleDocTemplate
@@ -21,8 +28,30 @@ from reportlab.platypus import (
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_JUSTIFY
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
 from PIL import Image, ImageDraw
 from textwrap import dedent
+from xml.sax.saxutils import escape as xml_escape
+
+import text_layout
+
+# Flux d'images binaires : l'encodage ASCII85 (en Python pur) coûtait plus que tout
+# le reste du rendu d'une page avec fond, et grossissait le PDF d'un quart
+rl_config.useA85 = 0
+
+try:
+    import fcntl
+except ImportError:  # Windows (exécutable PyInstaller)
+    fcntl = None
+    import msvcrt
+
+try:
+    import pymupdf  # facultatif : fusion des fonds PDF en C (moteur "pymupdf")
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF < 1.24.3
+    except ImportError:
+        pymupdf = None
 
 # ---------------------------------------------------------------------------
 #  1. Constantes globales & répertoires
@@ -52,6 +81,7 @@ CONFIG_FILE: Optional[str] = None
 STORAGE_CONFIG_FILE: Optional[str] = None
 PATIENT_BASE_FILE: Optional[str] = None
 SQLITE_DB_PATH: Optional[str] = None
+PDF_CACHE_FOLDER: Optional[str] = None
 
 # This remains static as per your requirement
 LISTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Liste_Medications_Analyses_Radiologies.xlsx')
@@ -59,7 +89,7 @@ LISTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Liste_Med
 def set_dynamic_base_dir(admin_email: str):
     global DYNAMIC_BASE_DIR, ADMIN_EMAIL
     global EXCEL_FOLDER, EXCEL_FILE_PATH, CONSULT_FILE_PATH, PDF_FOLDER, CONFIG_FOLDER, BACKGROUND_FOLDER
-    global CONFIG_FILE, STORAGE_CONFIG_FILE, PATIENT_BASE_FILE, SQLITE_DB_PATH
+    global CONFIG_FILE, STORAGE_CONFIG_FILE, PATIENT_BASE_FILE, SQLITE_DB_PATH, PDF_CACHE_FOLDER
 
     ADMIN_EMAIL = admin_email.lower().replace('@', '_at_').replace('.', '_dot_') # Sanitize email for folder name
 
@@ -73,8 +103,9 @@ def set_dynamic_base_dir(admin_email: str):
     CONFIG_FOLDER     = os.path.join(DYNAMIC_BASE_DIR, "Config")
     BACKGROUND_FOLDER = os.path.join(DYNAMIC_BASE_DIR, "Background")
     SQLITE_DB_PATH = os.path.join(DYNAMIC_BASE_DIR, "database.db") # New SQLite DB path
+    PDF_CACHE_FOLDER = os.path.join(DYNAMIC_BASE_DIR, "Cache", "PDF")
 
-    for _dir in (DYNAMIC_BASE_DIR, EXCEL_FOLDER, PDF_FOLDER, CONFIG_FOLDER, BACKGROUND_FOLDER):
+    for _dir in (DYNAMIC_BASE_DIR, EXCEL_FOLDER, PDF_FOLDER, CONFIG_FOLDER, BACKGROUND_FOLDER, PDF_CACHE_FOLDER):
         os.makedirs(_dir, exist_ok=True)
 
     CONFIG_FILE         = os.path.join(CONFIG_FOLDER, "config.json")
@@ -85,6 +116,22 @@ def set_dynamic_base_dir(admin_email: str):
     print(f"DEBUG: SQLite DB path set to: {SQLITE_DB_PATH}")
 
 
+def tenant_context() -> dict:
+    """
+    Chemins et réglages du cabinet courant, figés dans le thread de la requête pour un
+    rendu qui s'exécute ailleurs (jobs.py) : les globales de ce module sont repositionnées
+    à chaque requête, pour le cabinet de celle-ci. Le fond vaut "" s'il n'y en a pas.
+    """
+    return {
+        "consult_file": CONSULT_FILE_PATH,
+        "cache_dir": PDF_CACHE_FOLDER,
+        "db_path": SQLITE_DB_PATH,
+        "config_file": CONFIG_FILE,
+        "background": background_file or "",
+        "merge_backend": pdf_merge_backend,
+    }
+
+
 # The following variables now depend on set_dynamic_base_dir being called.
 # They are initialized to None and will be set when an admin logs in or is identified.
 # For initial load, we might need a default or a way to ensure they are set before use.
@@ -93,10 +140,11 @@ def set_dynamic_base_dir(admin_email: str):
 LOCAL_IP = socket.gethostbyname(socket.gethostname())
 
 background_file: Optional[str] = None # This global variable needs to be updated
+pdf_merge_backend: str = "pypdf2"       # "pdf_merge_backend" de la configuration, voir PDF_MERGE_BACKENDS
 
 def init_app(app):
     """Initialisation de l'application Flask avec les valeurs du fichier de configuration."""
-    global background_file # Declare global to modify it
+    global background_file, pdf_merge_backend # Declare global to modify it
 
     # Ensure set_dynamic_base_dir has been called and DYNAMIC_BASE_DIR is set
     if ADMIN_EMAIL is None:
@@ -119,18 +167,20 @@ def init_app(app):
     else:
         background_file = None # No background configured or BACKGROUND_FOLDER not set yet
     print(f"DEBUG (utils.py - init_app): Global background_file set to: {background_file}")
+    pdf_merge_backend = config.get("pdf_merge_backend", "pypdf2")
 
 
 # ---------------------------------------------------------------------------
 # 4. Configuration & listes par défaut
 # ---------------------------------------------------------------------------
-def load_config() -> dict:
-    if CONFIG_FILE is None:
+def load_config(path: Optional[str] = None) -> dict:
+    path = path or CONFIG_FILE
+    if path is None:
         # This means set_dynamic_base_dir was not called. Handle accordingly.
         print("ERROR: CONFIG_FILE path is not set. Cannot load config.")
         return {}
     try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except FileNotFoundError:
         return {}
@@ -271,9 +321,11 @@ patient_id_to_dob = {}
 patient_id_to_gender = {}
 patient_id_to_nom = {}    # Nom de famille
 patient_id_to_prenom = {} # Prénom
+# (classeur patients, version de patient_store, empreinte de ConsultationData.xlsx) du dernier chargement
+_PATIENT_DATA_KEY: Optional[tuple] = None
 
 def load_patient_data():
-    global patient_ids, patient_names
+    global patient_ids, patient_names, _PATIENT_DATA_KEY
     global patient_id_to_name, patient_name_to_id
     global patient_id_to_age, patient_id_to_phone, patient_id_to_antecedents
     global patient_id_to_dob, patient_id_to_gender
@@ -284,6 +336,15 @@ def load_patient_data():
         print("ERROR: Dynamic base directory not set. Call set_dynamic_base_dir first.")
         return
 
+    # Rien n'a changé depuis le dernier chargement (même cabinet, mêmes fichiers) : les
+    # requêtes courantes (sondage de la file d'attente, pages) ne relisent plus les classeurs
+    import patient_store  # import local : patient_store dépend de utils
+    key = (PATIENT_BASE_FILE,
+           patient_store.version(PATIENT_BASE_FILE) if os.path.exists(PATIENT_BASE_FILE) else None,
+           file_stamp(CONSULT_FILE_PATH))
+    if key == _PATIENT_DATA_KEY:
+        return
+
     # Fichiers sources distincts
     # These paths are now global variables set by set_dynamic_base_dir
     # PATIENT_BASE_FILE = os.path.join(EXCEL_FOLDER, 'info_Base_patient.xlsx')
@@ -306,7 +367,7 @@ def load_patient_data():
         print(f"DEBUG: Fichier de base patient non trouvé: {PATIENT_BASE_FILE}. Les données patient ne seront pas chargées depuis ce fichier.")
     else:
         try:
-            df_base = pd.read_excel(PATIENT_BASE_FILE, sheet_name=0, dtype=str).fillna('')
+            df_base = patient_store.dataframe(PATIENT_BASE_FILE)
             print(f"DEBUG: df_base (info_Base_patient.xlsx) chargé avec {len(df_base)} lignes.")
             print(f"DEBUG: Colonnes de df_base avant renommage: {df_base.columns.tolist()}")
 
@@ -428,6 +489,7 @@ def load_patient_data():
     for pid, name in patient_id_to_name.items():
         if name:
             patient_name_to_id[name] = pid
+    _PATIENT_DATA_KEY = key
 
     print(f"DEBUG: patient_ids finaux chargés: {patient_ids[:5] if patient_ids else 'Vide'}...")
     print(f"DEBUG: patient_names finaux chargés: {patient_names[:5] if patient_names else 'Vide'}...")
@@ -439,34 +501,437 @@ def load_patient_data():
 # Do NOT call load_patient_data() here anymore directly.
 # It should be called after `set_dynamic_base_dir` has been invoked
 # (e.g., after an admin logs in and their email is known).
+
+# ─── Index des consultations par patient ───────────────────────────────────
+# chemin ConsultationData.xlsx → (empreinte, lignes, dates, ordre chronologique, {patient_id: indices})
+MAX_CONSULT_INDEXES = 4        # classeurs de consultations indexés en mémoire (tous cabinets)
+_CONSULT_INDEX: "OrderedDict[str, tuple]" = OrderedDict()
+_CONSULT_LOCK = threading.Lock()
+
+def _consultation_index(path: str) -> Optional[tuple]:
+    """Relit le classeur seulement s'il a changé ; indices triés par date (ordre de saisie à date égale)."""
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    with _CONSULT_LOCK:
+        cached = _CONSULT_INDEX.get(path)
+        if cached is not None and cached[0] == stamp:
+            _CONSULT_INDEX.move_to_end(path)
+            return cached
+    df = pd.read_excel(path, sheet_name=0, dtype=str).fillna('')
+    df = df.drop(columns=['certificate_content'], errors='ignore')
+    rows = df.to_dict('records')
+    dates = [str(r.get('consultation_date', '')).strip()[:10] for r in rows]
+    order = sorted(range(len(rows)), key=dates.__getitem__)
+    by_patient: dict = {}
+    for i in order:
+        by_patient.setdefault(str(rows[i].get('patient_id', '')).strip(), []).append(i)
+    entry = (stamp, rows, dates, order, by_patient)
+    with _CONSULT_LOCK:
+        _CONSULT_INDEX[path] = entry
+        _CONSULT_INDEX.move_to_end(path)
+        while len(_CONSULT_INDEX) > MAX_CONSULT_INDEXES:
+            _CONSULT_INDEX.popitem(last=False)  # cabinet le moins récemment consulté
+    print(f"DEBUG: Index des consultations reconstruit ({len(rows)} lignes, {len(by_patient)} patients)")
+    return entry
+
+def iter_consultations(patient_id: str = "", patient_name: str = "",
+                       start: Optional[str] = None, end: Optional[str] = None,
+                       path: Optional[str] = None):
+    """
+    Consultations d'un patient (par ID, sinon nom contenu, sans casse) dans l'ordre
+    chronologique, éventuellement limitées aux dates ISO start..end incluses.
+    Générateur : rien n'est copié au-delà de la ligne en cours.
+    """
+    index = _consultation_index(path or CONSULT_FILE_PATH)
+    if index is None:
+        return
+    _, rows, dates, order, by_patient = index
+    if patient_id:
+        indices = by_patient.get(patient_id, [])
+    elif patient_name:
+        needle = patient_name.casefold()
+        indices = [i for i in order if needle in str(rows[i].get('patient_name', '')).casefold()]
+    else:
+        return
+    keys = [dates[i] for i in indices]
+    lo = bisect.bisect_left(keys, start) if start else 0
+    hi = bisect.bisect_right(keys, end) if end else len(keys)
+    for i in indices[lo:hi]:
+        yield rows[i]
+
 # ---------------------------------------------------------------------------
 # 6. PDF : arrière plan, génération & fusion
 # ---------------------------------------------------------------------------
-def apply_background(pdf_canvas, width, height):
-    if background_file and os.path.exists(background_file):
-        if background_file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            try:
-                pdf_canvas.drawImage(background_file, 0, 0, width=width, height=height)
-            except Exception:
-                pass
+_BG_LOCK = threading.Lock()     # caches des fonds (image et PDF)
+BACKGROUND_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+BACKGROUND_DPI = 150            # résolution du fond une fois ramené au format de la page
+BACKGROUND_JPEG_QUALITY = 85
+MAX_BACKGROUND_IMAGES = 8       # fonds réduits gardés en mémoire (tous cabinets, tous formats)
+_BG_IMAGES: "OrderedDict[tuple, _BackgroundImage]" = OrderedDict()
+
+
+class _BackgroundImage:
+    """
+    Fond image réduit, encodé en JPEG (reportlab et fpdf l'intègrent tel quel, sans
+    recompression). Immuable : partageable entre threads.
+    """
+
+    def __init__(self, jpeg: bytes):
+        self.jpeg = jpeg
+        self.digest = hashlib.md5(jpeg).hexdigest()[:16]
+
+    def draw(self, pdf_canvas, width, height):
+        """
+        Dessine le fond sur la page courante. L'image est placée une seule fois par
+        document dans un Form XObject, puis chaque page ne fait que le référencer.
+        """
+        name = f"bg_{self.digest}_{round(width)}x{round(height)}"
+        if not pdf_canvas.hasForm(name):
+            pdf_canvas.beginForm(name, 0, 0, width, height)
+            pdf_canvas.drawImage(ImageReader(io.BytesIO(self.jpeg)), 0, 0, width=width, height=height)
+            pdf_canvas.endForm()
+        pdf_canvas.doForm(name)
+
+def _scaled_jpeg(path: str, size: tuple) -> bytes:
+    with Image.open(path) as img:
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            # Transparence posée sur blanc, comme sur la page (le JPEG n'a pas d'alpha)
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, 'white')
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            img.draft('RGB', size)  # JPEG : décodage directement à taille réduite
+            img = img.convert('RGB')
+        if img.width > size[0] or img.height > size[1]:
+            img = img.resize(size, Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=BACKGROUND_JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+def background_image(path: str, width_pt: float, height_pt: float) -> Optional[_BackgroundImage]:
+    """
+    Fond image ramené à BACKGROUND_DPI pour une page de width_pt × height_pt points
+    (jamais agrandi), calculé une fois par fichier et par format puis mis en cache.
+    None si le fichier n'est pas une image lisible.
+    """
+    if not (path and path.lower().endswith(BACKGROUND_IMAGE_EXTENSIONS)):
+        return None
+    path = os.path.abspath(path)
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    size = (max(1, round(width_pt / 72 * BACKGROUND_DPI)), max(1, round(height_pt / 72 * BACKGROUND_DPI)))
+    key = (path, stamp, size)
+    with _BG_LOCK:
+        bg = _BG_IMAGES.get(key)
+        if bg is not None:
+            _BG_IMAGES.move_to_end(key)
+            return bg
+    try:
+        bg = _BackgroundImage(_scaled_jpeg(path, size))
+    except Exception as e:
+        print(f"ERROR: Fond image illisible {path}: {e}")
+        return None
+    print(f"DEBUG: Fond image réduit et mis en cache : {path} ({size[0]}x{size[1]} px)")
+    with _BG_LOCK:
+        for stale in [k for k in _BG_IMAGES if k[0] == path and k[1] != stamp]:
+            del _BG_IMAGES[stale]
+        _BG_IMAGES[key] = bg
+        while len(_BG_IMAGES) > MAX_BACKGROUND_IMAGES:
+            _BG_IMAGES.popitem(last=False)
+    return bg
+
+def _background(background: Optional[str]) -> Optional[str]:
+    """Fond explicite ("" : aucun), sinon celui du cabinet de la requête courante."""
+    return background_file if background is None else (background or None)
+
+def apply_background(pdf_canvas, width, height, background: Optional[str] = None):
+    background = _background(background)
+    bg = background_image(background, width, height) if background else None
+    if bg is not None:
+        try:
+            bg.draw(pdf_canvas, width, height)
+        except Exception:
+            pass
 
-def merge_with_background_pdf(foreground_path: str):
-    if not (background_file and os.path.exists(background_file) and background_file.lower().endswith('.pdf')):
+def has_pdf_background(background: Optional[str] = None) -> bool:
+    background = _background(background)
+    return bool(background and os.path.exists(background) and background.lower().endswith('.pdf'))
+
+def page_to_form(page) -> DecodedStreamObject:
+    """
+    Page PDF → Form XObject autonome (contenu, ressources, BBox), à cloner dans un
+    PdfWriter puis à dessiner sous une autre page avec stamp_under.
+    """
+    source = page.get_contents()
+    content = DecodedStreamObject()
+    content.set_data(source.get_data() if source is not None else b"")
+    form = content.flate_encode()  # ne garde que /Filter : le dictionnaire est complété ensuite
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject(page.mediabox),
+        NameObject('/Resources'): page.get('/Resources', DictionaryObject()),
+    })
+    form.indirect_reference = None
+    return form
+
+def stamp_under(page, name: NameObject, form_ref, prefix_ref):
+    """Déclare le Form XObject `name` sur `page` et le dessine (prefix_ref) avant son contenu."""
+    resources = page.get('/Resources')
+    if resources is None:
+        resources = DictionaryObject()
+        page[NameObject('/Resources')] = resources
+    resources = resources.get_object()
+    xobjects = resources.get('/XObject')
+    if xobjects is None:
+        xobjects = DictionaryObject()
+        resources[NameObject('/XObject')] = xobjects
+    xobjects.get_object()[name] = form_ref
+    contents = page.raw_get('/Contents') if '/Contents' in page else None
+    if contents is None:  # page vide : seul le fond est dessiné
+        parts = []
+    elif isinstance(contents.get_object(), ArrayObject):
+        parts = list(contents.get_object())
+    else:
+        parts = [contents]
+    page[NameObject('/Contents')] = ArrayObject([prefix_ref, *parts])
+
+def page_geometry(page) -> DictionaryObject:
+    """/MediaBox, /CropBox et /Rotate d'une page de fond, à reporter avec set_geometry."""
+    geometry = DictionaryObject({NameObject('/MediaBox'): ArrayObject(page.mediabox)})
+    if '/CropBox' in page:
+        geometry[NameObject('/CropBox')] = ArrayObject(page.cropbox)
+    if page.rotation:
+        geometry[NameObject('/Rotate')] = NumberObject(page.rotation)
+    return geometry
+
+def set_geometry(page, geometry: DictionaryObject):
+    """
+    Donne à `page` le format, le recadrage et la rotation du fond : c'est la page de fond
+    qui est produite par bg_page.merge_page(fg_page), le Form XObject étant dessiné dans
+    le même espace que le contenu d'origine du fond.
+    """
+    for key in ('/CropBox', '/Rotate'):
+        if key in page and key not in geometry:
+            del page[key]
+    page.update(geometry)
+
+
+class _BackgroundPdf:
+    """Pages d'un fond PDF lues une seule fois, conservées sous forme de Form XObjects."""
+
+    def __init__(self, path: str):
+        holder = PdfWriter()  # copie entièrement résolue, partageable entre threads
+        self.pages = []
+        for i, page in enumerate(PdfReader(path).pages):
+            name = NameObject(f'/BgPage{i}')
+            self.pages.append((name, page_to_form(page).clone(holder), page_geometry(page)))
+        self._holder = holder
+
+    def page(self, i: int) -> tuple:
+        """Fond de la page `i` du document : page i du fond, ou sa dernière page."""
+        return self.pages[min(i, len(self.pages) - 1)]
+
+    def merge(self, foreground: bytes) -> bytes:
+        writer = PdfWriter()
+        placed = {}  # nom → (form, prefix) déjà ajoutés à ce document
+        for i, fg_page in enumerate(PdfReader(io.BytesIO(foreground)).pages):
+            name, form, geometry = self.page(i)
+            if name not in placed:
+                prefix = DecodedStreamObject()
+                prefix.set_data(b"q " + name.encode() + b" Do Q\n")
+                placed[name] = (form.clone(writer).indirect_reference, writer._add_object(prefix))
+            page = writer.add_page(fg_page)
+            stamp_under(page, name, *placed[name])
+            set_geometry(page, geometry)
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+
+MAX_BACKGROUND_PDFS = 8     # fonds gardés en mémoire (tous cabinets confondus)
+_BG_PDFS: "OrderedDict[tuple, _BackgroundPdf]" = OrderedDict()
+
+def background_pdf(path: str) -> _BackgroundPdf:
+    """
+    Fond PDF analysé pour `path`, relu seulement si le fichier change (clé : chemin
+    absolu + empreinte mtime/taille) : chaque cabinet a son propre BACKGROUND_FOLDER.
+    """
+    path = os.path.abspath(path)
+    key = (path, file_stamp(path))
+    with _BG_LOCK:
+        bg = _BG_PDFS.get(key)
+        if bg is not None:
+            _BG_PDFS.move_to_end(key)
+            return bg
+    bg = _BackgroundPdf(path)
+    print(f"DEBUG: Fond PDF analysé et mis en cache : {path}")
+    with _BG_LOCK:
+        for stale in [k for k in _BG_PDFS if k[0] == path]:
+            del _BG_PDFS[stale]
+        _BG_PDFS[key] = bg
+        while len(_BG_PDFS) > MAX_BACKGROUND_PDFS:
+            _BG_PDFS.popitem(last=False)
+    return bg
+
+# ─── Moteurs de fusion avec le fond PDF ────────────────────────────────────
+# "pypdf2"  : Form XObject mis en cache posé sous chaque page (pur Python, toujours présent,
+#             par défaut : le plus rapide mesuré, cf. benchmarks/bench_merge_backends.py)
+# "pymupdf" : show_pdf_page de PyMuPDF, si le module est installé ; PyPDF2 sinon
+PDF_MERGE_BACKENDS = ("pypdf2", "pymupdf")
+_FITZ_LOCK = threading.Lock()   # PyMuPDF n'accepte pas d'appels concurrents
+_FITZ_BGS: "OrderedDict[tuple, object]" = OrderedDict()
+
+def _merge_pypdf2(path: str, foreground: bytes) -> bytes:
+    return background_pdf(path).merge(foreground)
+
+def _merge_pymupdf(path: str, foreground: bytes) -> bytes:
+    """
+    Même superposition que _merge_pypdf2 : page i du fond (ou sa dernière page) dessinée
+    sous le contenu. PyMuPDF ne copie la page de fond qu'une fois par document produit.
+    """
+    path = os.path.abspath(path)
+    key = (path, file_stamp(path))
+    with _FITZ_LOCK:
+        bg = _FITZ_BGS.get(key)
+        if bg is None:
+            for stale in [k for k in _FITZ_BGS if k[0] == path]:
+                _FITZ_BGS.pop(stale).close()
+            bg = _FITZ_BGS[key] = pymupdf.open(path)
+            while len(_FITZ_BGS) > MAX_BACKGROUND_PDFS:
+                _FITZ_BGS.popitem(last=False)[1].close()
+        _FITZ_BGS.move_to_end(key)
+        doc = pymupdf.open(stream=foreground, filetype="pdf")
+        try:
+            for i, page in enumerate(doc):
+                bg_page = bg[min(i, len(bg) - 1)]
+                if page.rect != bg_page.rect:  # comme merge_page : format du fond
+                    page.set_mediabox(bg_page.rect)
+                page.show_pdf_page(page.rect, bg, bg_page.number, overlay=False)
+            return doc.tobytes(deflate=True)
+        finally:
+            doc.close()
+
+_MERGE_BACKENDS = {"pypdf2": _merge_pypdf2, "pymupdf": _merge_pymupdf}
+
+def merge_backend(name: Optional[str] = None) -> str:
+    """Moteur effectivement utilisé pour `name` (par défaut celui de la configuration)."""
+    name = str(name or pdf_merge_backend or "pypdf2").lower()
+    if name not in PDF_MERGE_BACKENDS:
+        print(f"WARNING: Moteur de fusion PDF inconnu '{name}', fusion des fonds avec PyPDF2.")
+        return "pypdf2"
+    if name == "pymupdf" and pymupdf is None:
+        print("WARNING: PyMuPDF n'est pas installé, fusion des fonds avec PyPDF2.")
+        return "pypdf2"
+    return name
+
+def merge_background_pdf_bytes(foreground: bytes, backend: Optional[str] = None,
+                               background: Optional[str] = None) -> bytes:
+    """
+    Pose chaque page de `foreground` sur le fond PDF (`background`, sinon celui de la
+    configuration), entièrement en mémoire, avec le moteur choisi (`backend`, sinon
+    "pdf_merge_backend" de la configuration). Le fond est analysé une fois par fichier ;
+    un échec de PyMuPDF retombe sur PyPDF2.
+    """
+    if not has_pdf_background(background):
+        return foreground
+    background = _background(background)
+    name = merge_backend(backend)
+    if name != "pypdf2":
+        try:
+            return _MERGE_BACKENDS[name](background, foreground)
+        except Exception as e:
+            print(f"ERROR: Fusion {name} impossible, repli sur PyPDF2 : {e}")
+    return _merge_pypdf2(background, foreground)
+
+def merge_with_background_pdf(foreground_path: str, background: Optional[str] = None,
+                              backend: Optional[str] = None):
+    if not has_pdf_background(background):
         return
-    bg_reader = PdfReader(background_file)
-    fg_reader = PdfReader(foreground_path)
-    writer = PdfWriter()
-    for i in range(len(fg_reader.pages)):
-        fg_page = fg_reader.pages[i]
-        bg_page = copy.deepcopy(bg_reader.pages[i] if i < len(bg_reader.pages) else bg_reader.pages[-1])
-        bg_page.merge_page(fg_page)
-        writer.add_page(bg_page)
+    with open(foreground_path, "rb") as f:
+        merged = merge_background_pdf_bytes(f.read(), backend, background)
     with open(foreground_path, "wb") as f:
-        writer.write(f)
+        f.write(merged)
+
+def write_file_atomic(path: str, data: bytes):
+    """Écrit via un fichier temporaire puis os.replace : jamais de fichier à moitié écrit."""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
 def generate_pdf_file(save_path: str, form_data: dict,
-                      medication_list: list, analyses_list: list, radiologies_list: list):
-    """Génère un PDF de consultation + ordonnance + certificat."""
+                      medication_list: list, analyses_list: list, radiologies_list: list,
+                      sections: Optional[list] = None, background: Optional[str] = None,
+                      backend: Optional[str] = None):
+    """Génère un PDF de consultation + ordonnance + certificat dans `save_path`."""
+    write_file_atomic(save_path, render_pdf_bytes(form_data, medication_list, analyses_list,
+                                                  radiologies_list, sections, background, backend))
+
+def generate_bundle_file(save_path: str, documents: list, sections: Optional[list] = None,
+                         background: Optional[str] = None, backend: Optional[str] = None):
+    """Écrit dans `save_path` le dossier d'impression de render_bundle_bytes."""
+    write_file_atomic(save_path, render_bundle_bytes(documents, sections, background, backend))
+
+# Sections d'une impression, dans l'ordre des pages
+PRINT_SECTIONS = ("ordonnance", "analyses", "radiologies", "consultation", "certificat")
+
+def render_pdf_bytes(form_data: dict, medication_list: list, analyses_list: list,
+                     radiologies_list: list, sections: Optional[list] = None,
+                     background: Optional[str] = None, backend: Optional[str] = None) -> bytes:
+    """
+    PDF de consultation + ordonnance + certificat, rendu en mémoire (fond PDF compris).
+    `sections` (sous-ensemble de PRINT_SECTIONS) limite l'impression à ces sections ;
+    par défaut toutes, le certificat seulement si include_certificate vaut "on".
+    """
+    return render_bundle_bytes([{
+        "form": form_data, "medications": medication_list,
+        "analyses": analyses_list, "radiologies": radiologies_list,
+    }], sections, background, backend)
+
+def render_bundle_bytes(documents: list, sections: Optional[list] = None,
+                        background: Optional[str] = None, backend: Optional[str] = None) -> bytes:
+    """
+    Dossier d'impression : les sections choisies d'un ou plusieurs patients dans un seul
+    PDF, en une passe (un canvas, polices et fond image intégrés une fois, une seule
+    fusion avec le fond PDF pour tout le lot).
+    documents : [{"form": form_data, "medications": [...], "analyses": [...],
+    "radiologies": [...], "sections": [...] (facultatif, sinon `sections`)}]
+    background / backend : fond et moteur de fusion ("" : sans fond), sinon ceux de la
+    configuration du cabinet courant.
+    """
+    background = _background(background) or ""
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A5)
+    width, height = A5
+    if background.lower().endswith(BACKGROUND_IMAGE_EXTENSIONS):
+        apply_background(c, width, height, background)
+    has_content = False
+    for doc in documents:
+        has_content = _draw_prescription(
+            c, doc.get("form") or {}, doc.get("medications") or [], doc.get("analyses") or [],
+            doc.get("radiologies") or [], doc.get("sections") or sections, has_content, background)
+    c.save()
+    pdf_bytes = buf.getvalue()
+    if has_pdf_background(background):
+        # Une fusion ratée remonte à l'appelant : un PDF sans en-tête ne doit pas être mis en cache
+        pdf_bytes = merge_background_pdf_bytes(pdf_bytes, backend, background)
+    return pdf_bytes
+
+def _draw_prescription(c, form_data: dict, medication_list: list, analyses_list: list,
+                       radiologies_list: list, sections: Optional[list], has_content: bool,
+                       background: str = "") -> bool:
+    """
+    Dessine les sections d'un patient sur le canvas `c` ; chaque section commence sur
+    une nouvelle page si une autre la précède. Renvoie True si le canvas a du contenu.
+    """
+    image_bg = background.lower().endswith(BACKGROUND_IMAGE_EXTENSIONS)
+
+    def wanted(section):
+        return sections is None or section in sections
+
     # Récupération des champs
     doctor_name   = form_data.get("doctor_name","").strip()
     patient_name  = form_data.get("patient_name","").strip()
@@ -492,19 +957,14 @@ def generate_pdf_file(save_path: str, form_data: dict,
     respiratory_rate    = form_data.get("respiratory_rate","").strip()
     diagnosis           = form_data.get("diagnosis","").strip()
     certificate_content = form_data.get("certificate_content","").strip()
-    include_certificate = form_data.get("include_certificate","off") == "on"
+    include_certificate = (form_data.get("include_certificate","off") == "on"
+                           if sections is None else "certificat" in sections)
     date_str            = datetime.now().strftime('%d/%m/%Y')
 
-    # Initialisation du canvas
-    c = canvas.Canvas(save_path, pagesize=A5)
     width, height = A5
     left_margin, header_margin, footer_margin = 56.7, 130, 56.7
     max_line_width = width - 2*left_margin
 
-    # Arrière plan image
-    if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-        apply_background(c, width, height)
-
     # Fonctions internes
     def draw_header(pdf, title):
         pdf.setFont("Helvetica", 10)
@@ -529,28 +989,17 @@ def generate_pdf_file(save_path: str, form_data: dict,
         pdf.drawString(left_margin+50, height-header_margin-110, computed_age)
 
     def justify_text(pdf, text, max_w, y_pos, x_left, foot, h):
-        paragraphs = text.splitlines()
-        for para in paragraphs:
-            lines, current = [], ""
-            for word in para.split():
-                test = f"{current} {word}".strip()
-                if pdf.stringWidth(test, "Helvetica", 10) <= max_w:
-                    current = test
-                else:
-                    lines.append(current)
-                    current = word
-            lines.append(current)
-            for line in lines:
-                lw = pdf.stringWidth(line, "Helvetica", 10)
-                pdf.drawString((max_w - lw)/2 + x_left, y_pos, line)
-                y_pos -= 15
-                if y_pos < foot:
-                    pdf.showPage()
-                    if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                        apply_background(pdf, width, h)
-                    draw_header(pdf, "Certificat Médical")
-                    pdf.setFont("Helvetica",10)
-                    y_pos = h - header_margin - 130
+        for line in text_layout.wrap_text(text, max_w, "Helvetica", 10):
+            lw = pdf.stringWidth(line, "Helvetica", 10)
+            pdf.drawString((max_w - lw)/2 + x_left, y_pos, line)
+            y_pos -= 15
+            if y_pos < foot:
+                pdf.showPage()
+                if image_bg:
+                    apply_background(pdf, width, h, background)
+                draw_header(pdf, "Certificat Médical")
+                pdf.setFont("Helvetica",10)
+                y_pos = h - header_margin - 130
         return y_pos
 
     def draw_signature(pdf, y_pos):
@@ -566,54 +1015,38 @@ def generate_pdf_file(save_path: str, form_data: dict,
         pdf.setFont("Helvetica", 10)
         max_w = 300
         for idx, item in enumerate(items, 1):
-            words, current = item.split(), f"{idx}. "
-            for w in words:
-                test = f"{current} {w}".strip()
-                if pdf.stringWidth(test, "Helvetica", 10) <= max_w:
-                    current = test
-                else:
-                    pdf.drawString(x_left, y_pos, current)
-                    y_pos -= 20
-                    if y_pos < foot:
-                        pdf.showPage()
-                        if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                            apply_background(pdf, width, h)
-                        draw_header(pdf, title)
-                        pdf.setFont("Helvetica",10)
-                        y_pos = h - header_margin - 130
-                    current = w
-            pdf.drawString(x_left, y_pos, current)
-            y_pos -= 20
-            if y_pos < foot:
-                pdf.showPage()
-                if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                    apply_background(pdf, width, h)
-                draw_header(pdf, title)
-                pdf.setFont("Helvetica",10)
-                y_pos = h - header_margin - 130
+            for line in text_layout.wrap_words([f"{idx}.", *item.split()], max_w, "Helvetica", 10):
+                pdf.drawString(x_left, y_pos, line)
+                y_pos -= 20
+                if y_pos < foot:
+                    pdf.showPage()
+                    if image_bg:
+                        apply_background(pdf, width, h, background)
+                    draw_header(pdf, title)
+                    pdf.setFont("Helvetica",10)
+                    y_pos = h - header_margin - 130
         return y_pos
 
     def draw_multiline(pdf, text, x_left, y_pos, max_w, foot, h):
-        for line in text.split('\n'):
+        for line in text_layout.wrap_text(text, max_w, "Helvetica", 10):
             if y_pos < foot:
                 pdf.showPage()
-                if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                    apply_background(pdf, width, h)
+                if image_bg:
+                    apply_background(pdf, width, h, background)
                 draw_header(pdf, "Consultation")
                 y_pos = h - header_margin - 130
             pdf.drawString(x_left, y_pos, line)
             y_pos -= 15
         return y_pos
 
-    has_content = False
     def add_section(stitle, items):
         nonlocal has_content
         # Vérifie si la liste d'éléments n'est pas vide et contient au moins un élément non vide après nettoyage
         if items and any(item.strip() for item in items):
             if has_content:
                 c.showPage()
-                if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                    apply_background(c, width, height)
+                if image_bg:
+                    apply_background(c, width, height, background)
             draw_header(c, stitle)
             y = height - header_margin - 130
             # Filtre les éléments vides avant de les dessiner
@@ -624,16 +1057,19 @@ def generate_pdf_file(save_path: str, form_data: dict,
 
     # Sections ordonnance/analyses/radiologies
     # Suppression de la logique qui ajoute des exemples si les listes sont vides
-    add_section("Ordonnance Médicale", medication_list)
-    add_section("Analyses", analyses_list)
-    add_section("Radiologies", radiologies_list)
+    if wanted("ordonnance"):
+        add_section("Ordonnance Médicale", medication_list)
+    if wanted("analyses"):
+        add_section("Analyses", analyses_list)
+    if wanted("radiologies"):
+        add_section("Radiologies", radiologies_list)
 
     # Section consultation
-    if any([clinical_signs, bp, temperature, heart_rate, respiratory_rate, diagnosis]):
+    if wanted("consultation") and any([clinical_signs, bp, temperature, heart_rate, respiratory_rate, diagnosis]):
         if has_content:
             c.showPage()
-            if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                apply_background(c, width, height)
+            if image_bg:
+                apply_background(c, width, height, background)
         draw_header(c, "Consultation")
         y0 = height - header_margin - 130
         if clinical_signs: # Ajout de cette condition
@@ -664,8 +1100,8 @@ def generate_pdf_file(save_path: str, form_data: dict,
     if include_certificate and certificate_content:
         if has_content:
             c.showPage()
-            if background_file and background_file.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
-                apply_background(c, width, height)
+            if image_bg:
+                apply_background(c, width, height, background)
         draw_header(c, "Certificat Médical")
         yc = height - header_margin - 130
         c.setFont("Helvetica-Bold",12); c.drawString(left_margin, yc, "Certificat Médical :"); yc -= 20
@@ -680,102 +1116,372 @@ def generate_pdf_file(save_path: str, form_data: dict,
         cert = cert.replace("[X]", extract_rest_duration(cert))
         yc = justify_text(c, cert, max_line_width, yc, left_margin, footer_margin, height)
         draw_signature(c, yc)
+        has_content = True
 
-    c.save()
-    if background_file and background_file.lower().endswith('.pdf'):
-        try:
-            merge_with_background_pdf(save_path)
-        except Exception:
-            pass
+    return has_content
 
 def add_background_platypus(canvas_obj, doc):
-    bg = background_file if background_file and os.path.exists(background_file) else None
-    if bg and bg.lower().endswith(('.png','.jpg','.jpeg','.gif','.bmp')):
+    apply_background(canvas_obj, doc.pagesize[0], doc.pagesize[1])
+
+# ─── Historique des consultations ──────────────────────────────────────────
+HISTORY_MARGINS = (56.7, 130, 56.7)  # gauche/droite, haut (en-tête du fond), bas
+
+_HISTORY_STYLES: Optional[dict] = None
+
+def _history_styles() -> dict:
+    """Styles de l'historique, construits une fois par processus."""
+    global _HISTORY_STYLES
+    if _HISTORY_STYLES is None:
+        styles = getSampleStyleSheet()
+        _HISTORY_STYLES = {
+            "heading": ParagraphStyle(
+                'CustomHeading', parent=styles["Heading1"],
+                fontSize=styles["Heading1"].fontSize - 2,
+                leading=styles["Heading1"].leading - 2
+            ),
+            "normal": ParagraphStyle(
+                'JustifiedNormal', parent=styles["Normal"],
+                fontSize=styles["Normal"].fontSize - 2,
+                alignment=TA_JUSTIFY
+            ),
+            "sub": styles["Heading2"],
+        }
+    return _HISTORY_STYLES
+
+def _field(row: dict, key: str) -> str:
+    """Valeur texte d'une colonne, échappée pour Paragraph ('' si absente ou vide)."""
+    value = row.get(key)
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return xml_escape(str(value).strip())
+
+def _history_title(row: dict) -> list:
+    st = _history_styles()
+    if _field(row, 'nom') and _field(row, 'prenom'):
+        patient_full_name = f"{_field(row, 'nom')} {_field(row, 'prenom')}"
+    else:
+        patient_full_name = _field(row, 'patient_name')
+    title = (
+        f"Historique des Consultations de {patient_full_name} "
+        f"(ID: {_field(row, 'patient_id')}, Age: {_field(row, 'age')}, Sexe: {_field(row, 'gender')}, "
+        f"Téléphone: {_field(row, 'patient_phone')}, Antécédents: {_field(row, 'antecedents')})"
+    )
+    return [Paragraph(title, st["heading"]), Spacer(1, 12)]
+
+def _history_entry(row: dict) -> list:
+    """Flowables d'une consultation."""
+    st = _history_styles()
+    normal = st["normal"]
+    out = [Paragraph(f"Date : {_field(row, 'consultation_date')}", st["sub"]), Spacer(1, 6)]
+    if _field(row, "clinical_signs"):
+        out.append(Paragraph("<b>Signes Cliniques / Motifs :</b>", normal))
+        out.append(Paragraph(_field(row, "clinical_signs"), normal))
+    vitals = []
+    if _field(row, "bp"): vitals.append(f"TA: {_field(row, 'bp')} mmHg")
+    if _field(row, "temperature"): vitals.append(f"T°: {_field(row, 'temperature')} °C")
+    if _field(row, "heart_rate"): vitals.append(f"FC: {_field(row, 'heart_rate')} bpm")
+    if _field(row, "respiratory_rate"): vitals.append(f"FR: {_field(row, 'respiratory_rate')} rpm")
+    if vitals:
+        out.append(Paragraph("<b>Paramètres Vitaux :</b> " + "; ".join(vitals), normal))
+    if _field(row, "diagnosis"):
+        out.append(Paragraph(f"<b>Diagnostic :</b> {_field(row, 'diagnosis')}", normal))
+    for key, label in (("medications", "Médicaments prescrits"),
+                       ("analyses", "Analyses demandées"),
+                       ("radiologies", "Radiologies demandées")):
+        items = [i.strip() for i in _field(row, key).split("; ") if i.strip()]
+        if items:
+            out.append(Paragraph(f"<b>{label} :</b>", normal))
+            out.extend(Paragraph(f"- {i}", normal) for i in items)
+    if _field(row, "certificate_category"):
+        out.append(Paragraph(f"<b>Certificat :</b> {_field(row, 'certificate_category')}", normal))
+    if _field(row, "rest_duration"):
+        out.append(Paragraph(f"<b>Durée du repos :</b> {_field(row, 'rest_duration')} jours", normal))
+    if _field(row, "doctor_comment"):
+        out.append(Paragraph("<b>Commentaire :</b>", normal))
+        out.append(Paragraph(_field(row, "doctor_comment"), normal))
+    out.append(Spacer(1, 12))
+    return out
+
+def render_history_pdf(out, consultations, first_page: int = 1, last_page: Optional[int] = None,
+                       background: Optional[str] = None) -> int:
+    """
+    Écrit dans `out` (chemin ou fichier) l'historique des consultations données, dans
+    l'ordre reçu, et renvoie le nombre de pages écrites (fond : voir render_bundle_bytes).
+    Les flowables sont produits consultation par consultation et posés page par page
+    (jamais de « story » complète en mémoire). Seules les pages first_page..last_page
+    sont conservées ; la mise en page s'arrête après last_page.
+    """
+    rows = iter(consultations)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    def flowables():
+        yield from _history_title(first)
+        yield from _history_entry(first)
+        for row in rows:
+            yield from _history_entry(row)
+
+    width, height = A5
+    side, top, bottom = HISTORY_MARGINS
+    doc = canvas.Canvas(out, pagesize=A5, pageCompression=1)
+    page_no, written = 0, 0
+    canv = frame = None
+    page_empty = True
+
+    def start_page():
+        nonlocal page_no, canv, frame, page_empty
+        page_no += 1
+        if page_no >= first_page:
+            canv = doc
+            apply_background(canv, width, height, background)
+        else:
+            canv = canvas.Canvas(io.BytesIO(), pagesize=A5)  # page hors plage : mise en page sans rien garder
+        frame = Frame(side, bottom, width - 2 * side, height - top - bottom,
+                      leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)
+        page_empty = True
+
+    def end_page():
+        nonlocal written, page_empty
+        if canv is doc:
+            doc.showPage()
+            written += 1
+        page_empty = True
+
+    start_page()
+    pending = deque()
+    source = flowables()
+    while True:
+        if not pending:
+            f = next(source, None)
+            if f is None:
+                break
+            pending.append(f)
+        f = pending.popleft()
+        if frame.add(f, canv):
+            page_empty = False
+            continue
+        parts = frame.split(f, canv)
+        if parts and frame.add(parts[0], canv):
+            page_empty = False
+            pending.extendleft(reversed(parts[1:]))
+            continue
+        if page_empty:
+            print(f"ERROR: Élément trop grand pour une page d'historique, ignoré : {type(f).__name__}")
+            continue
+        end_page()
+        if last_page is not None and page_no >= last_page:
+            break
+        start_page()
+        pending.appendleft(f)
+    if not page_empty:
+        end_page()
+    if written:
+        doc.save()
+    return written
+
+def generate_history_pdf_file(pdf_path: str, consultations, first_page: int = 1,
+                              last_page: Optional[int] = None, background: Optional[str] = None,
+                              backend: Optional[str] = None) -> int:
+    """
+    Génère un PDF d’historique de consultations (DataFrame ou itérable de dicts)
+    et renvoie le nombre de pages écrites (0 : aucun fichier créé).
+    """
+    if isinstance(consultations, pd.DataFrame):
+        consultations = (row for row in consultations.to_dict('records'))
+    pages = render_history_pdf(pdf_path, consultations, first_page, last_page, background)
+    if pages and has_pdf_background(background):
+        merge_with_background_pdf(pdf_path, background, backend)
+    return pages
+
+
+# ---------------------------------------------------------------------------
+# 7. Fichiers partagés entre processus (empreintes & verrous)
+# ---------------------------------------------------------------------------
+def file_stamp(path) -> Optional[tuple]:
+    """Empreinte (mtime, taille) d'un fichier, ou None s'il est absent."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Verrou exclusif inter-processus (workers gunicorn) sur '<path>.lock'.
+    flock sous Linux/macOS, msvcrt.locking sous Windows.
+    """
+    with open(f"{path}.lock", "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK abandonne après 10 s : on réessaie
         try:
-            canvas_obj.drawImage(bg, 0, 0, width=doc.pagesize[0], height=doc.pagesize[1])
-        except Exception:
-            pass
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
 
-def generate_history_pdf_file(pdf_path: str, df_filtered: pd.DataFrame):
-    """Génère un PDF d’historique de consultations."""
-    doc = SimpleDocTemplate(pdf_path, pagesize=A5,
-                            rightMargin=56.7, leftMargin=56.7,
-                            topMargin=130, bottomMargin=56.7)
-    elements = []
-    styles = getSampleStyleSheet()
-    style_heading = ParagraphStyle(
-        'CustomHeading', parent=styles["Heading1"],
-        fontSize=styles["Heading1"].fontSize - 2,
-        leading=styles["Heading1"].leading - 2
-    )
-    style_normal = ParagraphStyle(
-        'JustifiedNormal', parent=styles["Normal"],
-        fontSize=styles["Normal"].fontSize - 2,
-        alignment=TA_JUSTIFY
-    )
-    style_sub = styles["Heading2"]
-
-    if not df_filtered.empty:
-        row0 = df_filtered.iloc[0]
-        # Utiliser 'nom' et 'prenom' si disponibles, sinon 'patient_name'
-        patient_full_name = ""
-        if pd.notnull(row0.get('nom')) and pd.notnull(row0.get('prenom')):
-            patient_full_name = f"{str(row0.get('nom')).strip()} {str(row0.get('prenom')).strip()}"
-        elif pd.notnull(row0.get('patient_name')):
-            patient_full_name = str(row0.get('patient_name')).strip()
-
-        title = (
-            f"Historique des Consultations de {patient_full_name} "
-            f"(ID: {str(row0.get('patient_id', '')).strip()}, Age: {str(row0.get('age', '')).strip()}, Sexe: {str(row0.get('gender', '')).strip()}, "
-            f"Téléphone: {str(row0.get('patient_phone', '')).strip()}, Antécédents: {str(row0.get('antecedents', '')).strip()})"
-        )
-        elements.append(Paragraph(title, style_heading))
-        elements.append(Spacer(1, 12))
-        for _, row in df_filtered.iterrows():
-            elements.append(Paragraph(f"Date : {str(row.get('consultation_date', '')).strip()}", style_sub))
-            elements.append(Spacer(1, 6))
-            if pd.notnull(row.get("clinical_signs")) and str(row["clinical_signs"]).strip(): # Ajout de la condition pour vérifier si le champ est vide
-                elements.append(Paragraph("<b>Signes Cliniques / Motifs :</b>", style_normal))
-                elements.append(Paragraph(str(row["clinical_signs"]).strip(), style_normal)) # Ensure string conversion
-            vitals = []
-            if pd.notnull(row.get("bp")) and str(row.bp).strip(): vitals.append(f"TA: {str(row.bp).strip()} mmHg")
-            if pd.notnull(row.get("temperature")) and str(row.temperature).strip(): vitals.append(f"T°: {str(row.temperature).strip()} °C")
-            if pd.notnull(row.get("heart_rate")) and str(row.heart_rate).strip(): vitals.append(f"FC: {str(row.heart_rate).strip()} bpm")
-            if pd.notnull(row.get("respiratory_rate")) and str(row.respiratory_rate).strip(): vitals.append(f"FR: {str(row.respiratory_rate).strip()} rpm")
-            if vitals:
-                elements.append(Paragraph("<b>Paramètres Vitaux :</b> " + "; ".join(vitals), style_normal))
-            if pd.notnull(row.get("diagnosis")) and str(row['diagnosis']).strip(): # Ajout de la condition pour vérifier si le champ est vide
-                elements.append(Paragraph(f"<b>Diagnostic :</b> {str(row['diagnosis']).strip()}", style_normal))
-            if pd.notnull(row.get("medications")):
-                meds = [m.strip() for m in str(row.medications).split("; ") if m.strip()]
-                if meds: # Vérifier si la liste filtrée n'est pas vide
-                    elements.append(Paragraph("<b>Médicaments prescrits :</b>", style_normal))
-                    for m in meds:
-                        elements.append(Paragraph(f"- {m}", style_normal))
-            if pd.notnull(row.get("analyses")):
-                analyses = [a.strip() for a in str(row.analyses).split("; ") if a.strip()]
-                if analyses: # Vérifier si la liste filtrée n'est pas vide
-                    elements.append(Paragraph("<b>Analyses demandées :</b>", style_normal))
-                    for a in analyses:
-                        elements.append(Paragraph(f"- {a}", style_normal))
-            if pd.notnull(row.get("radiologies")):
-                radios = [r.strip() for r in str(row.radiologies).split("; ") if r.strip()]
-                if radios: # Vérifier si la liste filtrée n'est pas vide
-                    elements.append(Paragraph("<b>Radiologies demandées :</b>", style_normal))
-                    for r in radios:
-                        elements.append(Paragraph(f"- {r}", style_normal))
-            if pd.notnull(row.get("certificate_category")) and str(row['certificate_category']).strip(): # Ajout de la condition pour vérifier si le champ est vide
-                elements.append(Paragraph(f"<b>Certificat :</b> {str(row['certificate_category']).strip()}", style_normal))
-            if pd.notnull(row.get("rest_duration")) and str(row['rest_duration']).strip(): # Ajout de la condition pour vérifier si le champ est vide
-                elements.append(Paragraph(f"<b>Durée du repos :</b> {str(row['rest_duration']).strip()} jours", style_normal))
-            if pd.notnull(row.get("doctor_comment")) and str(row['doctor_comment']).strip():
-                elements.append(Paragraph("<b>Commentaire :</b>", style_normal))
-                elements.append(Paragraph(str(row['doctor_comment']).strip(), style_normal))
-            elements.append(Spacer(1, 12))
-
-    doc.build(elements, onFirstPage=add_background_platypus, onLaterPages=add_background_platypus)
-    if background_file and background_file.lower().endswith('.pdf'):
+
+# ---------------------------------------------------------------------------
+# 8. Archives ZIP diffusées en flux
+# ---------------------------------------------------------------------------
+class _ChunkSink(io.RawIOBase):
+    """Destination non positionnable pour zipfile : garde les octets écrits jusqu'au prochain drain()."""
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+ZIP_CHUNK_SIZE = 64 * 1024
+
+def zip_stream(entries):
+    """
+    Archive ZIP produite au fil de l'eau à partir de couples (nom, contenu), le contenu
+    étant des octets ou le chemin d'un fichier lu par blocs de ZIP_CHUNK_SIZE :
+    mémoire constante quelle que soit la taille de l'archive. Un fichier disparu
+    entre-temps est ignoré. Les PDF étant déjà compressés, rien n'est recompressé (ZIP_STORED).
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, strict_timestamps=False) as zf:
+        for name, source in entries:
+            if isinstance(source, (bytes, bytearray)):
+                zf.writestr(name, source)
+            else:
+                try:
+                    info = zipfile.ZipInfo.from_file(source, name, strict_timestamps=False)
+                    src = open(source, "rb")
+                except OSError:
+                    continue
+                with src, zf.open(info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dst:
+                    for block in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                        dst.write(block)
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+# ---------------------------------------------------------------------------
+# 9. Cache disque des PDF rendus (ordonnances, historiques)
+# ---------------------------------------------------------------------------
+PRESCRIPTION_LAYOUT_VERSION = 1     # à incrémenter si render_pdf_bytes change de rendu
+HISTORY_LAYOUT_VERSION = 1          # idem pour render_history_pdf
+PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PDF_CACHE_TTL = 24 * 3600           # secondes sans être servi avant suppression
+PDF_CACHE_SWEEP_SECONDS = 3600      # péremption vérifiée aussi sur les documents servis du cache
+_PDF_CACHE_SWEPT: dict = {}         # dossier du cache → heure du dernier passage d'éviction
+
+def pdf_cache_key(kind: str, version: int, payload, background: Optional[str] = None) -> str:
+    """
+    Empreinte SHA-256 d'un document : données d'entrée, version de mise en page et
+    version du fond (chemin + empreinte du fichier, réglages de réduction de l'image).
+    """
+    background = _background(background)
+    blob = json.dumps({
+        "kind": kind,
+        "version": version,
+        "payload": payload,
+        "background": [background, file_stamp(background) if background else None,
+                       BACKGROUND_DPI, BACKGROUND_JPEG_QUALITY],
+    }, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def cached_pdf(kind: str, version: int, payload, render, cache_dir: Optional[str] = None,
+               background: Optional[str] = None) -> Optional[bytes]:
+    """
+    Contenu du PDF pour ces données ; au premier appel, render(chemin) l'écrit dans le
+    cache et renvoie False s'il n'y a rien à produire (rien n'est alors mis en cache).
+    Un document déjà rendu est servi tel quel ; sa date de modification tient lieu
+    de date de dernier accès pour l'éviction (voir _evict_pdf_cache).
+    cache_dir / background : ceux du cabinet (tenant_context), sinon ceux de la requête.
+    """
+    cache_dir = cache_dir or PDF_CACHE_FOLDER
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{kind}_{pdf_cache_key(kind, version, payload, background)}.pdf")
+    try:
+        # Lu dès l'ouverture : un autre worker peut évincer le fichier juste après
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        data = None
+    if data is not None:
         try:
-            merge_with_background_pdf(pdf_path)
-        except Exception:
+            os.utime(path, None)
+        except OSError:
             pass
+        print(f"DEBUG: PDF servi depuis le cache : {os.path.basename(path)}")
+        if time.time() - _PDF_CACHE_SWEPT.get(cache_dir, 0) > PDF_CACHE_SWEEP_SECONDS:
+            _evict_pdf_cache(cache_dir, keep=path)
+        return data
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        if not render(tmp):
+            return None
+        with open(tmp, "rb") as fh:
+            data = fh.read()
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _evict_pdf_cache(cache_dir, keep=path)
+    return data
+
+def _evict_pdf_cache(cache_dir: str, keep: Optional[str] = None):
+    """
+    Supprime les PDF non servis depuis PDF_CACHE_TTL (données patient : rien ne reste
+    indéfiniment), puis les moins récemment servis tant que le cache dépasse sa taille.
+    """
+    _PDF_CACHE_SWEPT[cache_dir] = time.time()
+    expired = time.time() - PDF_CACHE_TTL
+    with file_lock(os.path.join(cache_dir, "cache")):
+        entries, total = [], 0
+        for entry in os.scandir(cache_dir):
+            if not (entry.name.endswith(".pdf") and entry.is_file()):
+                continue
+            try:
+                st = entry.stat()
+                if st.st_mtime < expired and entry.path != keep:
+                    os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+        if total <= PDF_CACHE_MAX_BYTES:
+            return
+        for _, size, path in sorted(entries):
+            if total <= PDF_CACHE_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        print(f"DEBUG: Cache PDF réduit à {total // 1024} Ko")
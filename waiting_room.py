@@ -0,0 +1,135 @@
+# waiting_room.py
+
+"""
+File d'attente des rendez-vous du jour, par administrateur
+• Construite depuis DonneesRDV.xlsx, triée par numéro d'ordre (calculate_order_number)
+• États : prévu → arrivé → en consultation → terminé, conservés dans
+  Excel/file_attente.json (remis à zéro chaque jour)
+• Instantané en mémoire (entrées + JSON sérialisé + ETag) reconstruit uniquement
+  quand le classeur des RDV ou le fichier d'états change, dans n'importe quel processus
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Callable, Optional
+
+import pandas as pd
+
+import utils
+
+STATUSES = ("prevu", "arrive", "en_consultation", "termine")
+STATUS_LABELS = {
+    "prevu":           "Prévu",
+    "arrive":          "Arrivé",
+    "en_consultation": "En consultation",
+    "termine":         "Terminé",
+}
+STATE_FILENAME = "file_attente.json"
+
+_LOCK = threading.RLock()
+_QUEUES: dict = {}   # chemin de DonneesRDV.xlsx → QueueSnapshot
+
+
+class QueueSnapshot:
+    def __init__(self, day: str, version: tuple, entries: list):
+        self.day = day
+        self.version = version
+        self.entries = entries
+        self.payload = json.dumps({
+            "date": day,
+            "entries": entries,
+            "counts": {s: sum(1 for e in entries if e["status"] == s) for s in STATUSES},
+        }, ensure_ascii=False)
+        self.etag = hashlib.sha1(self.payload.encode("utf-8")).hexdigest()[:20]
+
+
+def _state_path(rdv_file: str) -> str:
+    return os.path.join(os.path.dirname(str(rdv_file)), STATE_FILENAME)
+
+def entry_key(heure: str, pid: str) -> str:
+    """Clé stable d'un RDV du jour (le créneau est unique pour une date)."""
+    return f"{str(heure).strip()}|{str(pid).strip()}"
+
+def _load_statuses(rdv_file: str, day: str) -> dict:
+    path = _state_path(rdv_file)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            state = json.load(fh)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Lecture de {path} impossible : {e}")
+        return {}
+    return state.get("statuses", {}) if state.get("date") == day else {}
+
+def _order_key(num_ordre: str, heure: str) -> tuple:
+    try:
+        return (0, int(float(num_ordre)), heure)
+    except (TypeError, ValueError):
+        return (1, 0, heure)  # "N/A" (hors plage 08:00–17:59) en fin de file
+
+
+def _build(rdv_file: str, day: str, version: tuple, df_day: pd.DataFrame) -> QueueSnapshot:
+    statuses = _load_statuses(rdv_file, day)
+    entries = []
+    # L'index de df_day est la position de la ligne dans DonneesRDV.xlsx (lien de consultation)
+    for index, row in zip(df_day.index.tolist(), df_day.to_dict("records")):
+        heure = str(row.get("Heure", "")).strip()
+        key = entry_key(heure, row.get("ID", ""))
+        status = statuses.get(key, "prevu")
+        entries.append({
+            "key":       key,
+            "index":     int(index),
+            "num_ordre": str(row.get("Num Ordre", "")),
+            "heure":     heure,
+            "id":        str(row.get("ID", "")),
+            "nom":       str(row.get("Nom", "")),
+            "prenom":    str(row.get("Prenom", "")),
+            "status":    status,
+            "label":     STATUS_LABELS.get(status, status),
+        })
+    entries.sort(key=lambda e: _order_key(e["num_ordre"], e["heure"]))
+    waiting = 0
+    for e in entries:
+        # Rang dans la salle d'attente pour les patients arrivés, None sinon
+        if e["status"] == "arrive":
+            waiting += 1
+            e["rang"] = waiting
+        else:
+            e["rang"] = None
+    return QueueSnapshot(day, version, entries)
+
+def snapshot(rdv_file, day: str, load_day: Callable[[str], pd.DataFrame]) -> QueueSnapshot:
+    """
+    File d'attente de `day` pour ce classeur. `load_day(day)` renvoie les RDV du jour
+    (index = position dans le classeur) et n'est appelé que si les fichiers ont changé.
+    """
+    rdv_file = str(rdv_file)
+    version = (day, utils.file_stamp(rdv_file), utils.file_stamp(_state_path(rdv_file)))
+    with _LOCK:
+        snap = _QUEUES.get(rdv_file)
+        if snap is None or snap.version != version:
+            snap = _build(rdv_file, day, version, load_day(day))
+            _QUEUES[rdv_file] = snap
+        return snap
+
+def set_status(rdv_file, day: str, key: str, status: str,
+               load_day: Callable[[str], pd.DataFrame]) -> Optional[QueueSnapshot]:
+    """Change l'état d'un RDV du jour. Renvoie None si le RDV n'est pas dans la file."""
+    if status not in STATUSES:
+        raise ValueError(f"État inconnu : {status}")
+    rdv_file = str(rdv_file)
+    path = _state_path(rdv_file)
+    with _LOCK, utils.file_lock(path):
+        if key not in {e["key"] for e in snapshot(rdv_file, day, load_day).entries}:
+            return None
+        statuses = _load_statuses(rdv_file, day)
+        if statuses.get(key, "prevu") != status:
+            statuses[key] = status
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"date": day, "statuses": statuses}, fh, ensure_ascii=False)
+            os.replace(tmp, path)
+        return snapshot(rdv_file, day, load_day)